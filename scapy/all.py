@@ -7,6 +7,8 @@
 Aggregate top level objects from all Scapy modules.
 """
 
+import sys
+
 from scapy.base_classes import *
 from scapy.config import *
 from scapy.dadict import *
@@ -25,6 +27,8 @@ from scapy.asn1packet import *
 from scapy.utils import *
 from scapy.route import *
 from scapy.sendrecv import *
+if sys.version_info >= (3, 5):
+    from scapy.asyncsendrecv import *
 from scapy.sessions import *
 from scapy.supersocket import *
 from scapy.volatile import *
@@ -11,8 +11,11 @@ from __future__ import absolute_import
 
 
 import array
+from collections import deque
 import ctypes
+from ctypes.util import find_library
 from fcntl import ioctl
+import mmap
 import os
 from select import select
 import socket
@@ -22,7 +25,7 @@ import time
 
 import subprocess
 
-from scapy.compat import raw, plain_str
+from scapy.compat import orb, raw, plain_str
 from scapy.consts import LINUX
 import scapy.utils
 import scapy.utils6
@@ -42,7 +45,8 @@ from scapy.interfaces import IFACES, InterfaceProvider, NetworkInterface, \
 from scapy.libs.structures import sock_fprog
 from scapy.packet import Packet, Padding
 from scapy.pton_ntop import inet_ntop
-from scapy.supersocket import SuperSocket
+from scapy.supersocket import SuperSocket, tpacket_auxdata, ETH_P_8021Q, \
+    TP_STATUS_VLAN_VALID
 
 import scapy.modules.six as six
 from scapy.modules.six.moves import range
@@ -79,6 +83,12 @@ PACKET_DROP_MEMBERSHIP = 2
 PACKET_RECV_OUTPUT = 3
 PACKET_RX_RING = 5
 PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_FANOUT = 18
+PACKET_FANOUT_HASH = 0
+PACKET_FANOUT_LB = 1
+PACKET_FANOUT_CPU = 2
+PACKET_FANOUT_FLAG_UNIQUEID = 0x2000
 PACKET_MR_MULTICAST = 0
 PACKET_MR_PROMISC = 1
 PACKET_MR_ALLMULTI = 2
@@ -100,6 +110,15 @@ PACKET_AUXDATA = 8
 PACKET_FASTROUTE = 6  # Fastrouted frame
 # Unused, PACKET_FASTROUTE and PACKET_LOOPBACK are invisible to user space
 
+# From linux/if_packet.h
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TP_STATUS_VLAN_TPID_VALID = 1 << 6
+
+# From bits/socket.h
+MSG_WAITFORONE = 0x10000  # recvmmsg(): block until 1+ packets avail
+
 # Utils
 
 
@@ -431,13 +450,213 @@ def _flush_fd(fd):
             break
 
 
+# Batched I/O, see sendmmsg(2) and recvmmsg(2)
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+SOCKADDR_LL_LEN = 20  # sizeof(struct sockaddr_ll)
+
+# Packing the arrays is much faster than filling them field by field.
+# The "N" (size_t) format code is not available on Python 2
+_SIZE_T = "Q" if ctypes.sizeof(ctypes.c_size_t) == 8 else "I"
+_iovec = struct.Struct("@P" + _SIZE_T)
+_MSGHDR_FMT = "@PIP{0}P{0}i".format(_SIZE_T)
+_CMSGHDR_FMT = "@%sii" % _SIZE_T
+_mmsghdr = struct.Struct("%s%dxI%dx" % (
+    _MSGHDR_FMT,
+    mmsghdr.msg_len.offset - struct.calcsize(_MSGHDR_FMT),
+    ctypes.sizeof(mmsghdr) - mmsghdr.msg_len.offset - 4,
+))
+
+LIBC = ctypes.CDLL(find_library("c"), use_errno=True)
+try:
+    _sendmmsg = LIBC.sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                          ctypes.c_uint, ctypes.c_int]
+    _recvmmsg = LIBC.recvmmsg
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                          ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    HAS_MMSG = True
+except AttributeError:
+    # libc older than 2.14
+    HAS_MMSG = False
+
+
+def _mmsghdrs(bufs, lengths, names=None, namelen=0,
+              control=None, controllen=0):
+    """Internal function to build an array of mmsghdr, one per buffer,
+    from the addresses of the buffers, names and control buffers.
+    Returns the array, and the array of iovec it points to"""
+    n = len(bufs)
+    iovs = ctypes.create_string_buffer(b"".join(
+        _iovec.pack(buf, ln) for buf, ln in zip(bufs, lengths)
+    ))
+    iovs_base = ctypes.addressof(iovs)
+    msgs = (mmsghdr * n).from_buffer_copy(b"".join(
+        _mmsghdr.pack(
+            0 if names is None else names[i], namelen,
+            iovs_base + i * _iovec.size, 1,
+            0 if control is None else control + i * controllen, controllen,
+            0, 0
+        ) for i in range(n)
+    ))
+    return msgs, iovs
+
+
+def _parse_cmsgs(data):
+    """Internal function to parse a control buffer into a list of
+    (cmsg_level, cmsg_type, cmsg_data), as returned by socket.recvmsg()"""
+    ancdata = []
+    hdr_len = socket.CMSG_LEN(0)
+    while len(data) >= hdr_len:
+        cmsg_len, cmsg_level, cmsg_type = struct.unpack(
+            _CMSGHDR_FMT, data[:struct.calcsize(_CMSGHDR_FMT)]
+        )
+        if cmsg_len < hdr_len:
+            break
+        ancdata.append((cmsg_level, cmsg_type, data[hdr_len:cmsg_len]))
+        data = data[socket.CMSG_SPACE(cmsg_len - hdr_len):]
+    return ancdata
+
+
+def sendmmsg(sock, frames, addresses=None):
+    """Sends frames, a list of bytes, on sock with a single sendmmsg() call.
+
+    :param sock: the socket
+    :param frames: the list of frames to send
+    :param addresses: (optional) a packed sockaddr per frame, all of the
+        same family
+    :returns: the number of frames sent, that may be lower than len(frames)
+    """
+    if not frames:
+        return 0
+    data = b"".join(frames)
+    buf = ctypes.create_string_buffer(data, len(data))
+    bufs, offset = [], ctypes.addressof(buf)
+    for frame in frames:
+        bufs.append(offset)
+        offset += len(frame)
+    names = namelen = names_buf = None
+    if addresses:
+        namelen = len(addresses[0])
+        names_buf = ctypes.create_string_buffer(b"".join(addresses))
+        names_base = ctypes.addressof(names_buf)
+        names = [names_base + i * namelen for i in range(len(addresses))]
+    msgs, iovs = _mmsghdrs(bufs, [len(f) for f in frames],
+                           names, namelen or 0)
+    ret = _sendmmsg(sock.fileno(), msgs, len(frames), 0)
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise socket.error(err, os.strerror(err))
+    return ret
+
+
+class RecvmmsgBuffers(object):
+    """The buffers used by recvmmsg() to receive up to n packets of at most
+    x bytes, with controllen bytes of ancillary data each. They are
+    allocated once, and reused by each call.
+    """
+
+    def __init__(self, n, x=MTU, controllen=0):
+        self.n, self.x, self.controllen = n, x, controllen
+        self.buf = ctypes.create_string_buffer(n * x)
+        self.names = ctypes.create_string_buffer(n * SOCKADDR_LL_LEN)
+        self.control = None
+        if controllen:
+            self.control = ctypes.create_string_buffer(n * controllen)
+        self.msgs, self.iovs = _mmsghdrs(
+            [ctypes.addressof(self.buf) + i * x for i in range(n)],
+            [x] * n,
+            [ctypes.addressof(self.names) + i * SOCKADDR_LL_LEN
+             for i in range(n)],
+            SOCKADDR_LL_LEN,
+            None if self.control is None else ctypes.addressof(self.control),
+            controllen,
+        )
+        # The kernel updates the lengths of the names and control buffers:
+        # they are restored before each call
+        self.headers = ctypes.string_at(self.msgs, ctypes.sizeof(self.msgs))
+
+    def fits(self, n, x, controllen):
+        """Returns True if these buffers can be used for such a call"""
+        return n <= self.n and x == self.x and controllen == self.controllen
+
+
+def recvmmsg(sock, n, x=MTU, controllen=0, buffers=None):
+    """Receives up to n packets from sock with a single recvmmsg() call,
+    that only waits for the first one.
+
+    :param sock: the socket
+    :param n: the maximum number of packets to receive
+    :param x: the maximum size of a packet
+    :param controllen: the size of the control buffer of each packet, 0 to
+        ignore ancillary data
+    :param buffers: (optional) the RecvmmsgBuffers to reuse
+    :returns: a list of tuples (pkt, sa_ll, ancdata), where sa_ll is the
+        packed sockaddr_ll and ancdata is formatted as by socket.recvmsg()
+    """
+    if buffers is None or not buffers.fits(n, x, controllen):
+        buffers = RecvmmsgBuffers(n, x, controllen)
+    else:
+        ctypes.memmove(buffers.msgs, buffers.headers, len(buffers.headers))
+    msgs = buffers.msgs
+    base = ctypes.addressof(buffers.buf)
+    names_base = ctypes.addressof(buffers.names)
+    ret = _recvmmsg(sock.fileno(), msgs, n, MSG_WAITFORONE, None)
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise socket.error(err, os.strerror(err))
+    results = []
+    data = ctypes.string_at(msgs, ret * _mmsghdr.size)
+    for i in range(ret):
+        _, namelen, _, _, control_base, controllen, _, ln = \
+            _mmsghdr.unpack_from(data, i * _mmsghdr.size)
+        ancdata = []
+        if buffers.control is not None:
+            ancdata = _parse_cmsgs(
+                ctypes.string_at(control_base, controllen)
+            )
+        results.append((
+            ctypes.string_at(base + i * x, min(ln, x)),
+            ctypes.string_at(names_base + i * SOCKADDR_LL_LEN, namelen),
+            ancdata
+        ))
+    return results
+
+
 class L2Socket(SuperSocket):
     desc = "read/write packets at layer 2 using Linux PF_PACKET sockets"
+    #: the number of packets sent or received per system call by
+    #: send_batch() and recv_batch()
+    batch_size = 64
+    #: the maximal size of the packets received by recv_batch(). The
+    #: frames aggregated by GRO can be larger than the MTU of the interface
+    snaplen = MTU
 
     def __init__(self, iface=None, type=ETH_P_ALL, promisc=None, filter=None,
                  nofilter=0, monitor=None):
         self.iface = network_name(iface or conf.iface)
         self.type = type
+        # The buffers of recv_batch(), allocated by its first call
+        self._recv_buffers = None
         self.promisc = conf.sniff_promisc if promisc is None else promisc
         if monitor is not None:
             log_runtime.info(
@@ -533,6 +752,88 @@ class L2Socket(SuperSocket):
                     return SuperSocket.send(self, raw(x) + padding)
             raise
 
+    def set_fanout(self, group=None, mode=PACKET_FANOUT_HASH):
+        """Adds the socket to a PACKET_FANOUT group: the kernel spreads the
+        packets among the sockets of the group. With PACKET_FANOUT_HASH,
+        both directions of a flow go to the same socket.
+
+        :param group: the id of the group to join, None to create a new one
+        :param mode: the PACKET_FANOUT_* algorithm used to spread packets
+        :returns: the id of the group
+        """
+        if group is None:
+            # The kernel picks an unused id
+            self.ins.setsockopt(SOL_PACKET, PACKET_FANOUT,
+                                (mode | PACKET_FANOUT_FLAG_UNIQUEID) << 16)
+            group = struct.unpack("I", self.ins.getsockopt(
+                SOL_PACKET, PACKET_FANOUT, 4
+            ))[0] & 0xffff
+        else:
+            self.ins.setsockopt(SOL_PACKET, PACKET_FANOUT, group | mode << 16)
+        # Drop the packets received before joining the group
+        self._flush()
+        return group
+
+    def _flush(self):
+        _flush_fd(self.ins)
+
+    def recv_batch(self, n=None, x=None):
+        """Receives up to n packets (default: batch_size) of at most x bytes
+        (default: snaplen) with a single system call, that only waits for
+        the first one. Returns a list of packets"""
+        x = x or self.snaplen
+        if not HAS_MMSG:
+            pkt = self.recv(x)
+            return [] if pkt is None else [pkt]
+        n = n or self.batch_size
+        controllen = 0
+        if self.auxdata_available:
+            controllen = (socket.CMSG_SPACE(ctypes.sizeof(tpacket_auxdata)) +
+                          socket.CMSG_SPACE(16))
+        buffers = self._recv_buffers
+        if buffers is None or not buffers.fits(n, x, controllen):
+            # Allocated once, for the largest batches
+            buffers = RecvmmsgBuffers(max(n, self.batch_size), x, controllen)
+            self._recv_buffers = buffers
+        pkts = []
+        for pkt, sa_ll, ancdata in recvmmsg(self.ins, n, x, controllen,
+                                            buffers):
+            if self.outs and orb(sa_ll[10]) == socket.PACKET_OUTGOING:
+                continue
+            ts = None
+            if pkt and ancdata:
+                pkt, ts = self._process_ancdata(pkt, ancdata)
+            if ts is None:
+                ts = get_last_packet_timestamp(self.ins)
+            pkt = self._dissect(self.LL, pkt, ts)
+            if pkt is not None:
+                pkts.append(pkt)
+        return pkts
+
+    def send_batch(self, pkts):
+        """Sends a list of packets with as few system calls as possible"""
+        self._send_frames(pkts, [raw(p) for p in pkts])
+
+    def _send_frames(self, pkts, frames, addresses=None):
+        """Internal function to send the frames of pkts with sendmmsg()"""
+        if not HAS_MMSG:
+            for p in pkts:
+                self.send(p)
+            return
+        sent_time = time.time()
+        for p in pkts:
+            if isinstance(p, Packet):
+                p.sent_time = sent_time
+        i = 0
+        while i < len(frames):
+            try:
+                i += sendmmsg(self.outs, frames[i:],
+                              addresses and addresses[i:])
+            except socket.error:
+                # Let send() handle (or raise) the error of this packet
+                self.send(pkts[i])
+                i += 1
+
 
 class L2ListenSocket(L2Socket):
     desc = "read packets at layer 2 using Linux PF_PACKET sockets. Also receives the packets going OUT"  # noqa: E501
@@ -540,6 +841,126 @@ class L2ListenSocket(L2Socket):
     def send(self, x):
         raise Scapy_Exception("Can't send anything with L2ListenSocket")
 
+    def send_batch(self, pkts):
+        raise Scapy_Exception("Can't send anything with L2ListenSocket")
+
+
+class L2RingSocket(L2ListenSocket):
+    desc = "read packets at layer 2 from a Linux PACKET_MMAP (TPACKET_V3) ring. Also receives the packets going OUT"  # noqa: E501
+
+    def __init__(self, iface=None, type=ETH_P_ALL, promisc=None, filter=None,
+                 nofilter=0, monitor=None, block_size=1 << 20, block_nr=16,
+                 block_timeout=10):
+        """
+        :param block_size: the size of the blocks of the ring, a multiple
+            of the page size
+        :param block_nr: the number of blocks of the ring
+        :param block_timeout: the delay (in ms) after which the kernel
+            hands over a block that is not full
+        """
+        L2ListenSocket.__init__(self, iface=iface, type=type,
+                                promisc=promisc, filter=filter,
+                                nofilter=nofilter, monitor=monitor)
+        self.ins.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        # struct tpacket_req3. With TPACKET_V3, frames have a variable
+        # size: frame_size is only used to check the ring geometry
+        frame_size = 1 << 11
+        self.ins.setsockopt(SOL_PACKET, PACKET_RX_RING, struct.pack(
+            "7I", block_size, block_nr, frame_size,
+            block_size // frame_size * block_nr, block_timeout, 0, 0
+        ))
+        self.ring = mmap.mmap(self.ins.fileno(), block_size * block_nr,
+                              mmap.MAP_SHARED,
+                              mmap.PROT_READ | mmap.PROT_WRITE)
+        self.block_size = block_size
+        self.block_nr = block_nr
+        self.block = 0
+        self._ring_frames = deque()
+        self._ring_stats = [0, 0, 0]
+
+    def _read_block(self, timeout=None):
+        """Internal function to read the frames of the next block of the
+        ring, when the kernel hands it over before the timeout.
+        Returns True if a block was read"""
+        ring = self.ring
+        offset = self.block * self.block_size
+        # struct tpacket_block_desc
+        while not struct.unpack_from("I", ring, offset + 8)[0] & \
+                TP_STATUS_USER:
+            if not select([self.ins], [], [], timeout)[0]:
+                return False
+        num_pkts, frame = struct.unpack_from("II", ring, offset + 12)
+        frame += offset
+        for _ in range(num_pkts):
+            # struct tpacket3_hdr
+            (next_offset, sec, nsec, snaplen, _, status, mac, _, _,
+             tci, tpid) = struct.unpack_from("=IIIIIIHHIIH", ring, frame)
+            pkt = ring[frame + mac:frame + mac + snaplen]
+            if tci or status & TP_STATUS_VLAN_VALID:
+                # Insert VLAN tag
+                if not status & TP_STATUS_VLAN_TPID_VALID:
+                    tpid = ETH_P_8021Q
+                pkt = pkt[:12] + struct.pack("!HH", tpid, tci) + pkt[12:]
+            self._ring_frames.append((pkt, sec + nsec * 1e-9))
+            frame += next_offset
+        # Give the block back to the kernel
+        struct.pack_into("I", ring, offset + 8, TP_STATUS_KERNEL)
+        self.block = (self.block + 1) % self.block_nr
+        return True
+
+    def _flush(self):
+        while self._read_block(0):
+            pass
+        self._ring_frames.clear()
+
+    def recv_raw(self, x=MTU):
+        """Receives a packet, then returns a tuple containing (cls, pkt_data, time)"""  # noqa: E501
+        while not self._ring_frames:
+            self._read_block()
+        pkt, ts = self._ring_frames.popleft()
+        return self.LL, pkt, ts
+
+    def recv_batch(self, n=None, x=MTU):
+        """Returns up to n packets (default: all of them) of the next
+        block of the ring"""
+        frames = self._ring_frames
+        while not frames:
+            self._read_block()
+        pkts = []
+        for _ in range(min(n or len(frames), len(frames))):
+            pkt = self._dissect(self.LL, *frames.popleft())
+            if pkt is not None:
+                pkts.append(pkt)
+        return pkts
+
+    def stats(self):
+        """Returns the number of packets received and dropped by the ring,
+        and the number of times it was full, since the socket was created
+        """
+        # struct tpacket_stats_v3, reset by each call
+        stats = struct.unpack("III", self.ins.getsockopt(
+            SOL_PACKET, PACKET_STATISTICS, 12
+        ))
+        self._ring_stats = [a + b for a, b in zip(self._ring_stats, stats)]
+        return dict(zip(("packets", "drops", "freeze_q_cnt"),
+                        self._ring_stats))
+
+    @staticmethod
+    def select(sockets, remain=conf.recv_poll_rate):
+        # The frames already read from the ring are available right away
+        ready = [s for s in sockets if getattr(s, "_ring_frames", None)]
+        if ready:
+            return ready, None
+        return SuperSocket.select(sockets, remain)
+
+    def close(self):
+        if self.closed:
+            return
+        ring = getattr(self, "ring", None)
+        if ring is not None:
+            ring.close()
+        L2ListenSocket.close(self)
+
 
 class L3PacketSocket(L2Socket):
     desc = "read/write packets at layer 3 using Linux PF_PACKET sockets"
@@ -551,7 +972,18 @@ class L3PacketSocket(L2Socket):
             return pkt.payload
         return pkt
 
-    def send(self, x):
+    def recv_batch(self, n=None, x=None):
+        pkts = L2Socket.recv_batch(self, n, x)
+        if self.lvl == 2:
+            for pkt in pkts:
+                pkt.payload.time = pkt.time
+            return [pkt.payload for pkt in pkts]
+        return pkts
+
+    def _build(self, x):
+        """Internal function to build x for the interface it is routed to.
+        Returns a tuple (ll, raw packet, sdto), where ll adds the link
+        layer to a packet"""
         iff = x.route()[0]
         if iff is None:
             iff = conf.iface
@@ -568,7 +1000,10 @@ class L3PacketSocket(L2Socket):
             warning("Incompatible L3 types detected using %s instead of %s !",
                     type_x, self.LL)
             self.LL = type_x
-        sx = raw(ll(x))
+        return ll, raw(ll(x)), sdto
+
+    def send(self, x):
+        ll, sx, sdto = self._build(x)
         x.sent_time = time.time()
         try:
             self.outs.sendto(sx, sdto)
@@ -581,6 +1016,21 @@ class L3PacketSocket(L2Socket):
             else:
                 raise
 
+    def send_batch(self, pkts):
+        frames, addresses, ifindexes = [], [], {}
+        for x in pkts:
+            ll, sx, (iff, proto) = self._build(x)
+            if iff not in ifindexes:
+                ifindexes[iff] = get_if_index(iff)
+            frames.append(sx)
+            # struct sockaddr_ll
+            addresses.append(
+                struct.pack("=H", socket.AF_PACKET) +
+                struct.pack("!H", proto) +
+                struct.pack("=iHBB8s", ifindexes[iff], 0, 0, 0, b"")
+            )
+        self._send_frames(pkts, frames, addresses)
+
 
 class VEthPair(object):
     """
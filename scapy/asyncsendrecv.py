@@ -0,0 +1,471 @@
+# This file is part of Scapy
+# See http://www.secdev.org/projects/scapy for more information
+# This program is published under a GPLv2 license
+
+"""
+Functions to send and receive packets from asyncio coroutines.
+
+This module requires Python 3.5 or newer.
+"""
+
+import asyncio
+import time
+import types
+
+from scapy.base_classes import Gen, SetGen
+from scapy.config import conf
+from scapy.data import ETH_P_ALL, MTU
+from scapy.interfaces import network_name, resolve_iface
+from scapy.plist import PacketList, SndRcvList
+from scapy.sendrecv import SndRcvHandler, debug, _interface_selection, \
+    _DOC_SNDRCV_PARAMS
+
+
+class AsyncSocket(object):
+    """
+    Wraps a SuperSocket to use it from an asyncio event loop.
+
+    The socket is registered with ``loop.add_reader()`` as long as
+    somebody is waiting for packets. Each received packet is given to
+    all the listeners, and to the asr*() calls that sent a packet with
+    the same hashret(). A single socket can hence be shared by many
+    concurrent calls::
+
+        >>> s = AsyncSocket(conf.L3socket())
+        >>> await asyncio.gather(*(asr1(IP(dst=d)/ICMP(), timeout=2,
+        ...                             socket=s) for d in hosts))
+
+    :param sock: the SuperSocket to wrap
+    :param loop: the event loop to use (default: the current one)
+    """
+
+    def __init__(self, sock, loop=None):
+        self.sock = sock
+        self.loop = loop
+        self.listeners = set()
+        self.expected = {}
+        self._reading = False
+        self._poller = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def send(self, x):
+        return self.sock.send(x)
+
+    async def recv(self, x=MTU):
+        """Waits for the next packet received on the socket.
+        Returns None when the socket reached its end."""
+        fut = self._get_loop().create_future()
+
+        def _set(pkt):
+            if not fut.done():
+                fut.set_result(pkt)
+        self.add_listener(_set)
+        try:
+            return await fut
+        finally:
+            self.remove_listener(_set)
+
+    def close(self):
+        self._stop()
+        self.sock.close()
+
+    def add_listener(self, callback):
+        """Calls callback(pkt) for each received packet, and
+        callback(None) when the socket reaches its end."""
+        self.listeners.add(callback)
+        self._start()
+
+    def remove_listener(self, callback):
+        self.listeners.discard(callback)
+        self._update()
+
+    def expect(self, h, handler):
+        """Gives handler the packets whose hashret() is h"""
+        self.expected.setdefault(h, set()).add(handler)
+        self._start()
+
+    def forget(self, h, handler):
+        handlers = self.expected.get(h)
+        if handlers is not None:
+            handlers.discard(handler)
+            if not handlers:
+                del self.expected[h]
+        self._update()
+
+    def _get_loop(self):
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        return self.loop
+
+    def _start(self):
+        if self._reading:
+            return
+        if getattr(self.sock, "nonblocking_socket", False):
+            # Those sockets have no file descriptor to watch: poll them
+            self._reading = True
+            self._poll()
+        else:
+            self._get_loop().add_reader(self.sock.fileno(),
+                                        self._on_readable)
+            self._reading = True
+
+    def _stop(self):
+        if not self._reading:
+            return
+        self._reading = False
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        else:
+            self.loop.remove_reader(self.sock.fileno())
+
+    def _update(self):
+        if not self.listeners and not self.expected:
+            self._stop()
+
+    def _poll(self):
+        self._on_readable()
+        if self._reading:
+            self._poller = self._get_loop().call_later(conf.recv_poll_rate,
+                                                       self._poll)
+
+    def _on_readable(self):
+        sock = self.sock
+        # Wake-ups may be spurious, and recv() must never block the loop
+        ready, read_func = sock.select([sock], 0)
+        if not ready:
+            return
+        try:
+            if read_func is not None:
+                pkts = [read_func(sock)]
+            elif hasattr(sock, "recv_batch"):
+                pkts = sock.recv_batch()
+            else:
+                pkts = [sock.recv()]
+        except EOFError:
+            self._stop()
+            for callback in list(self.listeners):
+                callback(None)
+            return
+        for pkt in pkts:
+            if pkt is not None:
+                self._dispatch(pkt)
+        # Some sockets buffer packets that select() reports but that
+        # the file descriptor does not
+        if self._reading and self._poller is None and \
+                sock.select([sock], 0)[0]:
+            self.loop.call_soon(self._on_readable)
+
+    def _dispatch(self, pkt):
+        for callback in list(self.listeners):
+            callback(pkt)
+        if self.expected:
+            handlers = self.expected.get(pkt.hashret())
+            if handlers:
+                for handler in list(handlers):
+                    handler._process_packet(pkt)
+
+
+def _async_socket(sock):
+    """Returns the AsyncSocket wrapping sock, creating it if needed"""
+    if isinstance(sock, AsyncSocket):
+        return sock
+    try:
+        return sock._async_socket
+    except AttributeError:
+        sock._async_socket = AsyncSocket(sock)
+        return sock._async_socket
+
+
+class AsyncSndRcvHandler(SndRcvHandler):
+    """
+    Util to send/receive packets, used by asr*().
+    Do not use directly.
+
+    Same as SndRcvHandler, but the packets are sent and their answers
+    awaited from a coroutine, without any thread.
+    """
+    def __init__(self, asock, pkt,
+                 timeout=None, inter=0, verbose=None,
+                 retry=0, multi=False, prebuild=False):
+        if verbose is None:
+            verbose = conf.verb
+        if conf.debug_match:
+            debug.recv = PacketList([], "Received")
+            debug.sent = PacketList([], "Sent")
+            debug.match = SndRcvList([], "Matched")
+        self.nbrecv = 0
+        self.ans = []
+        self.asock = asock
+        self.inter = inter
+        self.verbose = verbose
+        self.multi = multi
+        self.retry = retry
+        self.timeout = timeout
+        if timeout is not None and timeout < 0:
+            self.timeout = None
+        if isinstance(pkt, types.GeneratorType) or prebuild:
+            self.tobesent = [p for p in pkt]
+            self.notans = len(self.tobesent)
+        else:
+            self.tobesent = (
+                SetGen(pkt) if not isinstance(pkt, Gen) else pkt
+            )
+            self.notans = self.tobesent.__iterlen__()
+        self.hsent = {}
+        self.probes = None
+        self.rto = None
+        self._done = None
+
+    async def run(self):
+        """Sends the packets, waits for the answers and returns them"""
+        retry = self.retry
+        if retry < 0:
+            autostop = retry = -retry
+        else:
+            autostop = 0
+
+        remain = []
+        while retry >= 0:
+            self.hsent = {}
+            self._done = asyncio.Event()
+            try:
+                await self._sndrcv_snd()
+                if self.notans > 0 or self.multi:
+                    try:
+                        await asyncio.wait_for(self._done.wait(),
+                                               self.timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                for h in self.hsent:
+                    self.asock.forget(h, self)
+
+            remain = self._remain()
+            if autostop and len(remain) > 0 and \
+               len(remain) != len(self.tobesent):
+                retry = autostop
+
+            self.tobesent = remain
+            if len(self.tobesent) == 0:
+                break
+            retry -= 1
+
+        self._finish(remain)
+        return self.results()
+
+    async def _sndrcv_snd(self):
+        if self.verbose:
+            print("Begin emission:")
+        i = 0
+        for p in self.tobesent:
+            h = p.hashret()
+            self.hsent.setdefault(h, []).append(p)
+            self.asock.expect(h, self)
+            self.asock.send(p)
+            i += 1
+            # Always yield, to let the answers be processed
+            await asyncio.sleep(self.inter)
+        if self.verbose:
+            print("Finished sending %i packets." % i)
+
+    def _process_packet(self, r):
+        if self._match(r) and self.notans <= 0 and not self.multi:
+            self._done.set()
+
+
+async def asndrcv(socket, pkt, *args, **kargs):
+    """Scapy raw coroutine to send a packet and receive its answer.
+    WARNING: This is an internal function. Using asr/asrp/asr1/asrp1 is
+    more appropriate in many cases.
+    """
+    handler = AsyncSndRcvHandler(_async_socket(socket), pkt, *args, **kargs)
+    return await handler.run()
+
+
+async def _asndrcv_on(sock, pkt, *args, **kargs):
+    """Runs asndrcv() on a socket of its own, closed afterwards"""
+    asock = AsyncSocket(sock)
+    try:
+        return await asndrcv(asock, pkt, *args, **kargs)
+    finally:
+        asock.close()
+
+
+@conf.commands.register
+async def asr(x, promisc=None, filter=None, iface=None, nofilter=0,
+              *args, socket=None, **kargs):
+    """
+    Send and receive packets at layer 3 from an asyncio coroutine
+
+    :param socket: the socket (or AsyncSocket) to use. Sharing one
+        between concurrent calls avoids opening a socket per call
+    """
+    if socket is not None:
+        return await asndrcv(socket, x, *args, **kargs)
+    s = conf.L3socket(promisc=promisc, filter=filter,
+                      iface=iface, nofilter=nofilter)
+    return await _asndrcv_on(s, x, *args, **kargs)
+
+
+@conf.commands.register
+async def asr1(x, promisc=None, filter=None, iface=None, nofilter=0,
+               *args, socket=None, **kargs):
+    """
+    Send packets at layer 3 from an asyncio coroutine and return only
+    the first answer
+
+    :param socket: the socket (or AsyncSocket) to use. Sharing one
+        between concurrent calls avoids opening a socket per call
+    """
+    if socket is not None:
+        ans, _ = await asndrcv(socket, x, *args, **kargs)
+    else:
+        iface = _interface_selection(iface, x)
+        s = conf.L3socket(promisc=promisc, filter=filter,
+                          nofilter=nofilter, iface=iface)
+        ans, _ = await _asndrcv_on(s, x, *args, **kargs)
+    if len(ans) > 0:
+        return ans[0][1]
+
+
+@conf.commands.register
+async def asrp(x, promisc=None, iface=None, iface_hint=None, filter=None,
+               nofilter=0, type=ETH_P_ALL, *args, socket=None, **kargs):
+    """
+    Send and receive packets at layer 2 from an asyncio coroutine
+
+    :param socket: the socket (or AsyncSocket) to use. Sharing one
+        between concurrent calls avoids opening a socket per call
+    """
+    if socket is not None:
+        return await asndrcv(socket, x, *args, **kargs)
+    if iface is None and iface_hint is not None:
+        iface = conf.route.route(iface_hint)[0]
+    iface = resolve_iface(iface or conf.iface)
+    s = iface.l2socket()(promisc=promisc, iface=iface,
+                         filter=filter, nofilter=nofilter, type=type)
+    return await _asndrcv_on(s, x, *args, **kargs)
+
+
+@conf.commands.register
+async def asrp1(*args, **kargs):
+    """
+    Send and receive packets at layer 2 from an asyncio coroutine and
+    return only the first answer
+    """
+    ans, _ = await asrp(*args, **kargs)
+    if len(ans) > 0:
+        return ans[0][1]
+
+
+# Append doc
+for sr_func in [asrp, asrp1, asr, asr1]:
+    if sr_func.__doc__ is not None:
+        sr_func.__doc__ += _DOC_SNDRCV_PARAMS
+
+
+class AsyncSniffIterator(object):
+    """
+    Asynchronous iterator over sniffed packets, returned by asniff().
+    Do not use directly.
+    """
+    def __init__(self, asock, count=0, timeout=None, lfilter=None,
+                 stop_filter=None, label=None, close_socket=False):
+        self.asock = asock
+        self.count = count
+        self.timeout = timeout
+        self.lfilter = lfilter
+        self.stop_filter = stop_filter
+        self.label = label
+        self.close_socket = close_socket
+        self.stoptime = None
+        self.queue = None
+        self.running = True
+        self.n = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    async def __anext__(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            if self.timeout is not None:
+                self.stoptime = time.time() + self.timeout
+            self.asock.add_listener(self.queue.put_nowait)
+        remain = None
+        while self.running:
+            if self.stoptime is not None:
+                remain = self.stoptime - time.time()
+                if remain <= 0:
+                    break
+            try:
+                pkt = await asyncio.wait_for(self.queue.get(), remain)
+            except asyncio.TimeoutError:
+                break
+            if pkt is None:
+                # End of the capture
+                break
+            if self.lfilter and not self.lfilter(pkt):
+                continue
+            if self.label is not None:
+                pkt.sniffed_on = self.label
+            self.n += 1
+            if (self.count > 0 and self.n >= self.count) or \
+                    (self.stop_filter and self.stop_filter(pkt)):
+                self.stop()
+            return pkt
+        self.stop()
+        raise StopAsyncIteration
+
+    def stop(self):
+        """Stops sniffing, and closes the socket if asniff() opened it"""
+        if self.queue is not None:
+            self.asock.remove_listener(self.queue.put_nowait)
+        if self.running and self.close_socket:
+            self.asock.close()
+        self.running = False
+
+
+@conf.commands.register
+def asniff(count=0, timeout=None, lfilter=None, stop_filter=None,
+           iface=None, opened_socket=None, L2socket=None, **karg):
+    """Sniff packets from an asyncio coroutine, without blocking the loop.
+
+    Returns an asynchronous iterator over the sniffed packets::
+
+        >>> async for pkt in asniff(iface="eth0", count=10):
+        ...     print(pkt.summary())
+
+    :param count: number of packets to capture. 0 means infinity.
+    :param timeout: stop sniffing after a given time (default: None).
+    :param lfilter: Python function applied to each packet to determine if
+        it has to be returned.
+    :param stop_filter: Python function applied to each packet to determine
+        if we have to stop the capture after this packet.
+    :param iface: interface to sniff on (default: conf.iface).
+    :param opened_socket: provide an object (either a SuperSocket or an
+        AsyncSocket) to sniff on, which is not closed afterwards.
+    :param L2socket: use the provided L2socket (default: use conf.L2listen).
+    :param karg: additional arguments given to the socket, e.g. filter.
+    """
+    if opened_socket is not None:
+        return AsyncSniffIterator(_async_socket(opened_socket), count,
+                                  timeout, lfilter, stop_filter)
+    iface = resolve_iface(iface or conf.iface)
+    sock = (L2socket or iface.l2listen())(iface=iface, type=ETH_P_ALL,
+                                          **karg)
+    return AsyncSniffIterator(AsyncSocket(sock), count, timeout, lfilter,
+                              stop_filter, label=network_name(iface),
+                              close_socket=True)
@@ -356,6 +356,17 @@ class Field_metaclass(_Generic_metaclass):
         # type: (...) -> Type['scapy.fields.Field'[Any, Any]]
         dct.setdefault("__slots__", [])
         newcls = super(Field_metaclass, cls).__new__(cls, name, bases, dct)
+        # getfield_at() is an offset-based version of getfield(). If
+        # getfield() is overloaded by a more specific class than the one
+        # implementing getfield_at(), the latter must rely on the former.
+        owners = []
+        for attr in ["getfield", "getfield_at"]:
+            for i, kls in enumerate(newcls.__mro__):
+                if attr in kls.__dict__:
+                    owners.append(i)
+                    break
+        if len(owners) == 2 and owners[0] < owners[1]:
+            newcls.getfield_at = newcls.getfield_at_compat  # type: ignore
         return newcls
 
 
@@ -772,6 +772,15 @@ class Conf(ConfClass):
     auto_fragment = True
     #: raise exception when a packet dissector raises an exception
     debug_dissector = False
+    #: when True, the payload of a layer is only dissected the first time
+    #: it is accessed (e.g. by getlayer(), haslayer() or show()). The
+    #: configuration in use at that time applies to its dissection.
+    lazy_dissection = False
+    #: when True, the IP, TCP, UDP and ICMP checksums of a dissected packet
+    #: that was modified, then had its checksum deleted, are computed by
+    #: updating its original checksum (RFC 1624) rather than from scratch.
+    #: The original checksums must be valid.
+    incremental_checksums = False
     color_theme = Interceptor("color_theme", NoTheme(), _prompt_changer)
     #: how much time between warnings from the same place
     warning_threshold = 5
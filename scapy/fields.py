@@ -19,7 +19,6 @@ import struct
 import time
 import warnings
 
-from types import MethodType
 from uuid import UUID
 
 from scapy.config import conf
@@ -136,6 +135,17 @@ I = TypeVar('I')  # Internal storage  # noqa: E741
 M = TypeVar('M')  # Machine storage
 
 
+def _remain_at(s, offset):
+    # type: (Any, int) -> Any
+    """Returns the raw packet string `s` (that may hold a bits
+    state) starting at `offset`"""
+    if not offset:
+        return s
+    if isinstance(s, tuple):
+        return s[0][offset:], s[1]
+    return s[offset:]
+
+
 @six.add_metaclass(Field_metaclass)
 class Field(Generic[I, M]):
     """
@@ -254,6 +264,29 @@ class Field(Generic[I, M]):
         """
         return s[self.sz:], self.m2i(pkt, self.struct.unpack(s[:self.sz])[0])
 
+    def getfield_at(self, pkt, s, offset):
+        # type: (Packet, Any, int) -> Tuple[Any, int, I]
+        """Extract an internal value from a string, at a given offset
+
+        Same as getfield(), but reads the field from `s` at `offset`
+        instead of slicing the raw packet string after each field.
+
+        Returns a three-element tuple: the raw packet string to use for the
+        next field, the offset of the next field in it, and the extracted
+        field itself in internal representation.
+        """
+        return s, offset + self.sz, self.m2i(
+            pkt, self.struct.unpack_from(s, offset)[0]
+        )
+
+    def getfield_at_compat(self, pkt, s, offset):
+        # type: (Packet, Any, int) -> Tuple[Any, int, I]
+        """getfield_at() implementation relying on getfield(), used for
+        fields that only implement the latter.
+        """
+        s, val = self.getfield(pkt, _remain_at(s, offset))
+        return s, 0, val
+
     def do_copy(self, x):
         # type: (I) -> I
         if hasattr(x, "copy"):
@@ -300,6 +333,12 @@ class _FieldContainer(object):
         # type: (str) -> Any
         return getattr(self.fld, attr)
 
+    def getfield_at(self, pkt, s, offset):
+        # type: (Packet, Any, int) -> Tuple[Any, int, Any]
+        # Containers may overload getfield(): do not bypass it
+        s, val = self.getfield(pkt, _remain_at(s, offset))  # type: ignore
+        return s, 0, val
+
 
 AnyField = Union[Field[Any, Any], _FieldContainer]
 
@@ -362,6 +401,13 @@ class ConditionalField(_FieldContainer):
         else:
             return s, None
 
+    def getfield_at(self, pkt, s, offset):
+        # type: (Packet, Any, int) -> Tuple[Any, int, Any]
+        if self._evalcond(pkt):
+            return self.fld.getfield_at(pkt, s, offset)
+        else:
+            return s, offset, None
+
     def addfield(self, pkt, s, val):
         # type: (Packet, bytes, Any) -> bytes
         if self._evalcond(pkt):
@@ -497,6 +543,10 @@ the value to set is also known) of ._find_fld_pkt() instead.
         # type: (...) -> Tuple[bytes, Any]
         return self._find_fld_pkt(pkt).getfield(pkt, s)
 
+    def getfield_at(self, pkt, s, offset):
+        # type: (Packet, Any, int) -> Tuple[Any, int, Any]
+        return self._find_fld_pkt(pkt).getfield_at(pkt, s, offset)
+
     def addfield(self, pkt, s, val):
         # type: (Packet, bytes, Any) -> bytes
         fld, val = self._find_fld_pkt_val(pkt, val)
@@ -616,36 +666,24 @@ class FCSField(Field[int, int]):
     """Special Field that gets its value from the end of the *packet*
     (Note: not layer, but packet).
 
-    Mostly used for FCS
+    Mostly used for FCS. The value is appended to the payload, before
+    post_build() is called, by Packet.do_build() (see add_trailer()).
     """
 
     def getfield(self, pkt, s):
         # type: (Packet, bytes) -> Tuple[bytes, int]
-        previous_post_dissect = pkt.post_dissect
         val = self.m2i(pkt, struct.unpack(self.fmt, s[-self.sz:])[0])
-
-        def _post_dissect(self, s):
-            # type: (Packet, bytes) -> bytes
-            # Reset packet to allow post_build
-            self.raw_packet_cache = None
-            self.post_dissect = previous_post_dissect  # type: ignore
-            return previous_post_dissect(s)
-        pkt.post_dissect = MethodType(_post_dissect, pkt)  # type: ignore
         return s[:-self.sz], val
 
     def addfield(self, pkt, s, val):
         # type: (Packet, bytes, Optional[int]) -> bytes
-        previous_post_build = pkt.post_build
-        value = struct.pack(self.fmt, self.i2m(pkt, val))
-
-        def _post_build(self, p, pay):
-            # type: (Packet, bytes, bytes) -> bytes
-            pay += value
-            self.post_build = previous_post_build  # type: ignore
-            return previous_post_build(p, pay)
-        pkt.post_build = MethodType(_post_build, pkt)  # type: ignore
         return s
 
+    def add_trailer(self, pkt, pay, val):
+        # type: (Packet, bytes, Optional[int]) -> bytes
+        """Appends the value to the payload of the packet"""
+        return pay + struct.pack(self.fmt, self.i2m(pkt, val))
+
     def i2repr(self, pkt, x):
         # type: (Optional[Packet], int) -> str
         return lhex(self.i2h(pkt, x))
@@ -1328,6 +1366,12 @@ class _StrField(Field[I, bytes]):
         else:
             return s[-self.remain:], self.m2i(pkt, s[:-self.remain])
 
+    def getfield_at(self, pkt, s, offset):
+        # type: (Packet, Any, int) -> Tuple[Any, int, I]
+        if self.remain == 0:
+            return s, len(s), self.m2i(pkt, s[offset:])
+        return self.getfield_at_compat(pkt, s, offset)
+
     def randval(self):
         # type: () -> RandBin
         return RandBin(RandNum(0, 1200))
@@ -1592,22 +1636,32 @@ class PacketListField(_PacketField[List[BasePacket]]):
 
     def getfield(self, pkt, s):
         # type: (Packet, bytes) -> Tuple[bytes, List[BasePacket]]
+        # Subclasses overloading getfield() use it as their getfield_at()
+        s, offset, lst = PacketListField.getfield_at(self, pkt, s, 0)
+        return s[offset:], lst
+
+    def getfield_at(self, pkt, s, offset):
+        # type: (Packet, bytes, int) -> Tuple[bytes, int, List[BasePacket]]
         c = len_pkt = cls = None
         if self.length_from is not None:
             len_pkt = self.length_from(pkt)
         elif self.count_from is not None:
             c = self.count_from(pkt)
         if self.next_cls_cb is not None:
-            cls = self.next_cls_cb(pkt, [], None, s)
+            cls = self.next_cls_cb(pkt, [], None, s[offset:])
             c = 1
             if cls is None:
                 c = 0
 
         lst = []  # type: List[BasePacket]
-        ret = b""
-        remain = s
-        if len_pkt is not None:
-            remain, ret = s[:len_pkt], s[len_pkt:]
+        if len_pkt is None:
+            remain = s[offset:]
+        elif len_pkt >= 0:
+            # Only copy the part of the string holding the packets
+            remain = s[offset:offset + len_pkt]
+        else:
+            remain = s[offset:][:len_pkt]
+        end = offset + len(remain)
         while remain:
             if c is not None:
                 if c <= 0:
@@ -1636,7 +1690,8 @@ class PacketListField(_PacketField[List[BasePacket]]):
                 else:
                     remain = b""
             lst.append(p)
-        return remain + ret, lst
+        # What is left of the packets is followed by the rest of `s`
+        return s, end - len(remain), lst
 
     def addfield(self, pkt, s, val):
         # type: (Packet, bytes, Any) -> bytes
@@ -1673,6 +1728,15 @@ class StrFixedLenField(StrField):
         len_pkt = self.length_from(pkt)
         return s[len_pkt:], self.m2i(pkt, s[:len_pkt])
 
+    def getfield_at(self, pkt, s, offset):
+        # type: (Packet, Any, int) -> Tuple[Any, int, bytes]
+        len_pkt = self.length_from(pkt)
+        if len_pkt is None or len_pkt < 0:
+            return self.getfield_at_compat(pkt, s, offset)
+        return s, offset + len_pkt, self.m2i(
+            pkt, s[offset:offset + len_pkt]
+        )
+
     def addfield(self, pkt, s, val):
         # type: (Packet, bytes, Optional[bytes]) -> bytes
         len_pkt = self.length_from(pkt)
@@ -1769,6 +1833,15 @@ class StrLenField(StrField):
         len_pkt = (self.length_from or (lambda x: 0))(pkt)
         return s[len_pkt:], self.m2i(pkt, s[:len_pkt])
 
+    def getfield_at(self, pkt, s, offset):
+        # type: (Any, Any, int) -> Tuple[Any, int, bytes]
+        len_pkt = (self.length_from or (lambda x: 0))(pkt)
+        if len_pkt is None or len_pkt < 0:
+            return self.getfield_at_compat(pkt, s, offset)
+        return s, offset + len_pkt, self.m2i(
+            pkt, s[offset:offset + len_pkt]
+        )
+
     def randval(self):
         # type: () -> RandBin
         return RandBin(RandNum(0, self.max_length or 1200))
@@ -2195,6 +2268,40 @@ class _BitField(Field[I, int]):
         else:
             return s, b2
 
+    def getfield_at(self,  # type: ignore
+                    pkt,  # type: Packet
+                    s,  # type: Union[Tuple[bytes, int], bytes]
+                    offset,  # type: int
+                    ):
+        # type: (...) -> Tuple[Union[Tuple[bytes, int], bytes], int, I]
+        if isinstance(s, tuple):
+            s, bn = s
+        elif self.rev and self.tot_size > 1:
+            # The group of bits needs to be reversed first
+            return self.getfield_at_compat(pkt, s, offset)
+        else:
+            bn = 0
+
+        nb_bytes = (self.size + bn - 1) // 8 + 1
+        _bytes = struct.unpack_from('!%dB' % nb_bytes, s, offset)
+
+        b = 0
+        for c in range(nb_bytes):
+            b |= int(_bytes[c]) << (nb_bytes - c - 1) * 8
+
+        # get rid of high order bits, then remove low order bits
+        b &= (1 << (nb_bytes * 8 - bn)) - 1
+        b = b >> (nb_bytes * 8 - self.size - bn)
+
+        bn += self.size
+        offset += bn // 8
+        bn = bn % 8
+        b2 = self.m2i(pkt, b)
+        if bn:
+            return (s, bn), offset, b2
+        else:
+            return s, offset, b2
+
     def randval(self):
         # type: () -> RandNum
         return RandNum(0, 2**self.size - 1)
@@ -2228,6 +2335,15 @@ class BitFixedLenField(BitField):
         self.size = self.length_from(pkt)
         return super(BitFixedLenField, self).getfield(pkt, s)
 
+    def getfield_at(self,  # type: ignore
+                    pkt,  # type: Packet
+                    s,  # type: Union[Tuple[bytes, int], bytes]
+                    offset,  # type: int
+                    ):
+        # type: (...) -> Tuple[Union[Tuple[bytes, int], bytes], int, int]
+        self.size = self.length_from(pkt)
+        return super(BitFixedLenField, self).getfield_at(pkt, s, offset)
+
     def addfield(self,  # type: ignore
                  pkt,  # type: Packet
                  s,  # type: Union[Tuple[bytes, int, int], bytes]
@@ -3637,3 +3753,189 @@ class MSBExtendedField(BitExtendedField):
     def __init__(self, name, default):
         # type: (str, Optional[Any]) -> None
         BitExtendedField.__init__(self, name, default, extension_bit=7)
+
+
+############################
+#  Fused fixed-size fields  #
+############################
+
+def _get_impl(cls, attr):
+    # type: (type, str) -> Any
+    """Returns the implementation of `attr` used by `cls`"""
+    for kls in cls.__mro__:
+        if attr in kls.__dict__:
+            return kls.__dict__[attr]
+    return None
+
+
+class FusedFields(object):
+    """
+    A run of consecutive fixed-size fields (and complete groups of bit
+    fields) of a layer, read and written with a single struct.Struct.
+
+    Only fields that use the default Field or BitField implementations of
+    getfield_at() and addfield() can be fused: see compile_fields().
+    """
+    __slots__ = ["fields", "struct", "sz", "layout", "nvals"]
+
+    def __init__(self, order, items):
+        # type: (Optional[str], List[Tuple[List[Field[Any, Any]], str]]) -> None  # noqa: E501
+        self.fields = [f for flds, _ in items for f in flds]
+        self.struct = struct.Struct(
+            (order or "!") + "".join(code for _, code in items)
+        )
+        self.sz = self.struct.size
+        self.nvals = len(items)
+        # (field, index in the struct, shift, mask, mutable) - the mask is
+        # None for fields that are not bit fields
+        self.layout = []  # type: List[Tuple[Field[Any, Any], int, int, Optional[int], bool]]  # noqa: E501
+        for i, (flds, _) in enumerate(items):
+            if len(flds) == 1 and not isinstance(flds[0], _BitField):
+                self.layout.append((flds[0], i, 0, None, flds[0].ismutable))
+                continue
+            shift = sum(f.size for f in flds)  # type: ignore
+            for f in flds:
+                shift -= f.size  # type: ignore
+                self.layout.append((
+                    f, i, shift, (1 << f.size) - 1,  # type: ignore
+                    f.ismutable
+                ))
+
+    def getfields_at(self, pkt, s, offset):
+        # type: (Packet, bytes, int) -> int
+        """Dissects all the fields from `s` at `offset`, and stores their
+        value in `pkt`. Returns the offset of the next field."""
+        vals = self.struct.unpack_from(s, offset)
+        fields = pkt.fields
+        for f, i, shift, mask, mutable in self.layout:
+            v = vals[i]
+            if mask is not None:
+                v = (v >> shift) & mask
+            v = f.m2i(pkt, v)
+            if mutable:
+                if pkt.raw_packet_cache_fields is None:
+                    pkt.raw_packet_cache_fields = {}
+                pkt.raw_packet_cache_fields[f.name] = f.do_copy(v)
+            fields[f.name] = v
+        return offset + self.sz
+
+    def addfields(self, pkt, s):
+        # type: (Packet, bytes) -> Optional[bytes]
+        """Adds all the fields of `pkt` to `s`. Returns None if they need
+        to be built one by one (RawVal values, invalid values...)."""
+        vals = [0] * self.nvals
+        for f, i, shift, mask, _ in self.layout:
+            val = pkt.getfieldval(f.name)
+            if isinstance(val, RawVal):
+                return None
+            val = f.i2m(pkt, val)
+            if mask is None:
+                vals[i] = val
+            else:
+                vals[i] |= (val & mask) << shift
+        try:
+            return s + self.struct.pack(*vals)
+        except (struct.error, TypeError):
+            return None
+
+    def __repr__(self):
+        # type: () -> str
+        return "<FusedFields %s [%s]>" % (
+            self.struct.format,
+            ", ".join(f.name for f in self.fields)
+        )
+
+
+_BYTE_ORDERS = {"!": ">", ">": ">", "<": "<"}
+_BITS_CODES = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+
+def _fusable_field(fld):
+    # type: (Any) -> Tuple[Optional[str], Optional[str], Optional[str], Any]
+    """Returns (kind, struct code, byte order, field) of a field that can
+    be fused, kind being "bits" or "field", or None otherwise."""
+    if isinstance(fld, Emph):
+        # Only used for display
+        fld = fld.fld
+    if not isinstance(fld, Field) or fld.islist or fld.holds_packets:
+        return None, None, None, fld
+    cls = fld.__class__
+    if isinstance(fld, _BitField):
+        if _get_impl(cls, "getfield_at") is \
+                _BitField.__dict__["getfield_at"] and \
+                _get_impl(cls, "addfield") is \
+                _BitField.__dict__["addfield"] and \
+                not fld.rev and fld.size > 0:
+            return "bits", None, None, fld
+        return None, None, None, fld
+    if _get_impl(cls, "getfield_at") is not Field.__dict__["getfield_at"] \
+            or _get_impl(cls, "addfield") is not Field.__dict__["addfield"]:
+        return None, None, None, fld
+    order = _BYTE_ORDERS.get(fld.fmt[0])
+    code = fld.fmt[1:]
+    if order is None or len(fld.struct.unpack(b"\x00" * fld.sz)) != 1:
+        return None, None, None, fld
+    if fld.sz == 1 or code[-1] in "sp":
+        # Byte order does not matter
+        order = None
+    return "field", code, order, fld
+
+
+def _end_run(steps, items, order):
+    # type: (List[Any], List[Tuple[List[Field[Any, Any]], str]], Optional[str]) -> None  # noqa: E501
+    if sum(len(flds) for flds, _ in items) > 1:
+        steps.append(FusedFields(order, items))
+    else:
+        steps.extend(f for flds, _ in items for f in flds)
+
+
+def compile_fields(flist):
+    # type: (Sequence[Any]) -> List[Any]
+    """
+    Compiles a fields_desc list: runs of consecutive fixed-size fields
+    are replaced by FusedFields instances.
+
+    :param flist: a list of fields
+    :return: a list of fields and FusedFields
+    """
+    steps = []  # type: List[Any]
+    items = []  # type: List[Tuple[List[Field[Any, Any]], str]]
+    order = None  # type: Optional[str]
+    bits = []  # type: List[Field[Any, Any]]
+    nbits = 0
+    for orig_fld in list(flist) + [None]:
+        kind, code, forder, fld = _fusable_field(orig_fld)
+        if kind == "bits":
+            bits.append(fld)
+            nbits += fld.size
+            if nbits % 8:
+                continue
+            flds, bits, nbits = bits, [], 0
+            code = _BITS_CODES.get(
+                sum(f.size for f in flds) // 8  # type: ignore
+            )
+            if code is None:
+                # No struct code for this group of bits
+                _end_run(steps, items, order)
+                items, order = [], None
+                steps.extend(flds)
+                continue
+            forder = ">" if code != "B" else None
+            entry = (flds, code)
+        elif kind == "field" and not bits:
+            entry = ([fld], code)  # type: ignore
+        else:
+            _end_run(steps, items, order)
+            items, order = [], None
+            steps.extend(bits)
+            bits, nbits = [], 0
+            if orig_fld is not None:
+                steps.append(orig_fld)
+            continue
+        if forder is not None:
+            if order is not None and forder != order:
+                _end_run(steps, items, order)
+                items = []
+            order = forder
+        items.append(entry)
+    return steps
@@ -34,6 +34,15 @@ You can turn auto-decompression/auto-compression off with:
     >>> conf.contribs["http"]["auto_compression"] = False
 
 (Defaults to True)
+
+The messages are parsed incrementally, as their segments are received.
+To handle large bodies without keeping them, set a function that gets
+each piece of body received, with the HTTP packet of the headers. The
+reassembled packets then only contain the headers:
+
+    >>> conf.contribs["http"]["body_callback"] = lambda pkt, data: f.write(data)  # noqa: E501
+
+(Defaults to None)
 """
 
 # This file is a modified version of the former scapy_http plugin.
@@ -78,6 +87,7 @@ except ImportError:
 if "http" not in conf.contribs:
     conf.contribs["http"] = {}
     conf.contribs["http"]["auto_compression"] = True
+    conf.contribs["http"]["body_callback"] = None
 
 # https://en.wikipedia.org/wiki/List_of_HTTP_header_fields
 
@@ -291,7 +301,7 @@ class _HTTPContent(Packet):
         encodings = self._get_encodings()
         # Un-chunkify
         if "chunked" in encodings:
-            data = b""
+            data = []
             while s:
                 length, _, body = s.partition(b"\r\n")
                 try:
@@ -305,9 +315,9 @@ class _HTTPContent(Packet):
                         # Invalid chunk. Ignore
                         break
                     s = body[length + 2:]
-                    data += load
+                    data.append(load)
             if not s:
-                s = data
+                s = b"".join(data)
         # Decompress
         try:
             if "deflate" in encodings:
@@ -548,6 +558,186 @@ class HTTPResponse(_HTTPContent):
 
 # General HTTP class + defragmentation
 
+_HTTP_REQUEST_LINE = re.compile(
+    br"^(?:OPTIONS|GET|HEAD|POST|PUT|DELETE|TRACE|CONNECT) "
+    br"(?:.+?) "
+    br"HTTP/\d\.\d$"
+)
+_HTTP_RESPONSE_LINE = re.compile(br"^HTTP/\d\.\d \d\d\d .*$")
+_HTTP_FIRST_WORDS = [b"OPTIONS", b"GET", b"HEAD", b"POST", b"PUT", b"DELETE",
+                     b"TRACE", b"CONNECT", b"HTTP/"]
+
+
+def _guess_http_class(payload):
+    """Returns HTTPRequest or HTTPResponse from the first line of payload,
+    or Raw"""
+    crlfIndex = payload.find(b"\r\n")
+    if crlfIndex != -1:
+        req = payload[:crlfIndex]
+        if _HTTP_REQUEST_LINE.match(req):
+            return HTTPRequest
+        if _HTTP_RESPONSE_LINE.match(req):
+            return HTTPResponse
+    # Anything that isn't HTTP but on port 80
+    return Raw
+
+
+def _is_http_start(payload):
+    """Returns True if payload, without its first CRLF yet, may be the
+    beginning of an HTTP message"""
+    word = payload.split(b" ", 1)[0]
+    if len(word) < len(payload):
+        return word in _HTTP_FIRST_WORDS or word.startswith(b"HTTP/")
+    return any(w.startswith(word) or word.startswith(w)
+               for w in _HTTP_FIRST_WORDS)
+
+
+def _find_http_start(payload):
+    """Returns the offset of the first message start in payload, or -1"""
+    offsets = [payload.find(w + b" ") for w in _HTTP_FIRST_WORDS[:-1]]
+    offsets.append(payload.find(b"HTTP/1."))
+    offsets = [i for i in offsets if i != -1]
+    return min(offsets) if offsets else -1
+
+
+class _HTTPStream(object):
+    """Incremental parser of the HTTP/1.x messages of a TCP stream, used by
+    HTTP.tcp_reassemble(). Each call only processes the new bytes: the
+    message being received is kept here.
+    """
+
+    def __init__(self):
+        self.head = b""
+        # The HTTP packet of the headers, once they are all received
+        self.http = None
+        self.body = []
+        # The length of the body left to receive, None until the end of
+        # the stream
+        self.remain = 0
+        # Protocol switch: the bytes that follow are another protocol
+        self.upgrade = False
+        self.chunked = False
+        # Chunked encoding: the length of the chunk left to receive (with
+        # its CRLF), the line being received, and the trailer flag
+        self.chunk_left = 0
+        self.line = b""
+        self.trailer = False
+
+    def feed(self, data, metadata):
+        """Processes the new bytes. Returns the HTTP packet of the message
+        if it is complete (else None), and the number of bytes used
+        """
+        pos = 0
+        if self.http is None:
+            start = max(0, len(self.head) - 3)
+            self.head += data
+            end = self.head.find(b"\r\n\r\n", start)
+            if end == -1:
+                return None, len(data)
+            end += 4
+            pos = len(data) - (len(self.head) - end)
+            self.head = self.head[:end]
+            self._start()
+        if self.upgrade:
+            # Keep the data of the new protocol received with the headers
+            self._store(data[pos:])
+            end = len(data)
+        elif self.chunked:
+            end = self._chunks(data, pos)
+        elif self.remain is None:
+            # The message ends with the stream
+            self._store(data[pos:])
+            end = len(data) if metadata.get("tcp_end") else None
+        else:
+            n = min(self.remain, len(data) - pos)
+            self._store(data[pos:pos + n])
+            self.remain -= n
+            end = None if self.remain else pos + n
+        if end is None:
+            return None, len(data)
+        if conf.contribs["http"].get("body_callback"):
+            return self.http, end
+        return HTTP(self.head + b"".join(self.body)), end
+
+    def _start(self):
+        """Finds how the body of the message ends, from its headers"""
+        self.http = HTTP(self.head)
+        headers = _parse_headers(self.head.split(b"\r\n", 1)[1])
+        length = headers.get("content_length", (None, None))[1]
+        encoding = headers.get("transfer_encoding", (None, b""))[1]
+        content = self.http.payload
+        if isinstance(content, HTTPResponse) and \
+                content.Status_Code == b"101":
+            self.upgrade = True
+        elif isinstance(content, HTTPResponse) and (
+                content.Status_Code[:1] == b"1" or
+                content.Status_Code in [b"204", b"304"]):
+            # No body
+            self.remain = 0
+        elif b"chunked" in encoding.lower():
+            self.chunked = True
+        elif length is not None:
+            try:
+                self.remain = int(length)
+            except ValueError:
+                self.remain = None
+        elif isinstance(content, HTTPResponse):
+            self.remain = None
+
+    def _chunks(self, data, pos):
+        """Processes the chunks in data[pos:]. Returns the end of the
+        message, or None
+        """
+        while pos < len(data):
+            if self.chunk_left:
+                n = min(self.chunk_left, len(data) - pos)
+                # The data of the chunk, then its CRLF
+                k = min(n, max(0, self.chunk_left - 2))
+                self._store(data[pos:pos + k])
+                self._store(data[pos + k:pos + n], framing=True)
+                self.chunk_left -= n
+                pos += n
+                continue
+            # The size of the next chunk, or a line of the trailer
+            end = data.find(b"\n", pos)
+            if end == -1:
+                self.line += data[pos:]
+                self._store(data[pos:], framing=True)
+                return None
+            end += 1
+            line = (self.line + data[pos:end]).strip()
+            self.line = b""
+            self._store(data[pos:end], framing=True)
+            pos = end
+            if self.trailer:
+                if not line:
+                    return pos
+                continue
+            try:
+                size = int(line.split(b";", 1)[0], 16)
+            except ValueError:
+                # Not a valid chunk: the message ends with the stream
+                self.chunked = False
+                self.remain = None
+                self._store(data[pos:])
+                return None
+            if size:
+                self.chunk_left = size + 2
+            else:
+                self.trailer = True
+        return None
+
+    def _store(self, data, framing=False):
+        """Keeps data, or passes it to the body callback. The framing of
+        the chunks is only kept, to dissect the message"""
+        if not data:
+            return
+        callback = conf.contribs["http"].get("body_callback")
+        if not callback:
+            self.body.append(data)
+        elif not framing:
+            callback(self.http, data)
+
 
 class HTTP(Packet):
     name = "HTTP 1"
@@ -582,86 +772,36 @@ class HTTP(Packet):
     # tcp_reassemble is used by TCPSession in session.py
     @classmethod
     def tcp_reassemble(cls, data, metadata):
-        detect_end = metadata.get("detect_end", None)
-        is_unknown = metadata.get("detect_unknown", True)
-        if not detect_end or is_unknown:
-            metadata["detect_unknown"] = False
-            http_packet = HTTP(data)
-            # Detect packing method
-            if not isinstance(http_packet.payload, _HTTPContent):
-                return http_packet
-            length = http_packet.Content_Length
-            if length is not None:
-                # The packet provides a Content-Length attribute: let's
-                # use it. When the total size of the frags is high enough,
-                # we have the packet
-                length = int(length)
-                # Subtract the length of the "HTTP*" layer
-                if http_packet.payload.payload or length == 0:
-                    http_length = len(data) - len(http_packet.payload.payload)
-                    detect_end = lambda dat: len(dat) - http_length >= length
-                else:
-                    # The HTTP layer isn't fully received.
-                    detect_end = lambda dat: False
-                    metadata["detect_unknown"] = True
-            else:
-                # It's not Content-Length based. It could be chunked
-                encodings = http_packet[HTTP].payload._get_encodings()
-                chunked = ("chunked" in encodings)
-                is_response = isinstance(http_packet.payload, HTTPResponse)
-                if chunked:
-                    detect_end = lambda dat: dat.endswith(b"0\r\n\r\n")
-                # HTTP Requests that do not have any content,
-                # end with a double CRLF
-                elif isinstance(http_packet.payload, HTTPRequest):
-                    detect_end = lambda dat: dat.endswith(b"\r\n\r\n")
-                    # In case we are handling a HTTP Request,
-                    # we want to continue assessing the data,
-                    # to handle requests with a body (POST)
-                    metadata["detect_unknown"] = True
-                elif is_response and http_packet.Status_Code == b"101":
-                    # If it's an upgrade response, it may also hold a
-                    # different protocol data.
-                    # make sure all headers are present
-                    detect_end = lambda dat: dat.find(b"\r\n\r\n")
-                else:
-                    # If neither Content-Length nor chunked is specified,
-                    # it means it's the TCP packet that contains the data,
-                    # or that the information hasn't been given yet.
-                    detect_end = lambda dat: metadata.get("tcp_end", False)
-                    metadata["detect_unknown"] = True
-            metadata["detect_end"] = detect_end
-            if detect_end(data):
-                return http_packet
-        else:
-            if detect_end(data):
-                http_packet = HTTP(data)
-                return http_packet
+        stream = metadata.get("http_stream")
+        skipped = 0
+        if stream is None and metadata.get("tcp_resync"):
+            # Data was lost: skip to the next message
+            skipped = _find_http_start(data)
+            if skipped == -1:
+                # Keep the bytes that may be the beginning of a message
+                metadata["tcp_release"] = max(0, len(data) - 7)
+                return None
+            del metadata["tcp_resync"]
+            data = data[skipped:]
+        if stream is None:
+            if b"\r\n" not in data and _is_http_start(data):
+                # Wait for the first line
+                metadata["tcp_release"] = skipped
+                return None
+            if _guess_http_class(data) is Raw:
+                # Not HTTP/1.x: there is no message end to wait for
+                return HTTP(data)
+            stream = metadata["http_stream"] = _HTTPStream()
+        http_packet, used = stream.feed(data, metadata)
+        # Only the next bytes are needed at the next call
+        metadata["tcp_release"] = skipped + used
+        return http_packet
 
     def guess_payload_class(self, payload):
         """Decides if the payload is an HTTP Request or Response, or
         something else.
         """
-        try:
-            prog = re.compile(
-                br"^(?:OPTIONS|GET|HEAD|POST|PUT|DELETE|TRACE|CONNECT) "
-                br"(?:.+?) "
-                br"HTTP/\d\.\d$"
-            )
-            crlfIndex = payload.index(b"\r\n")
-            req = payload[:crlfIndex]
-            result = prog.match(req)
-            if result:
-                return HTTPRequest
-            else:
-                prog = re.compile(br"^HTTP/\d\.\d \d\d\d .*$")
-                result = prog.match(req)
-                if result:
-                    return HTTPResponse
-        except ValueError:
-            # Anything that isn't HTTP but on port 80
-            pass
-        return Raw
+        return _guess_http_class(payload)
 
 
 def http_request(host, path="/", port=80, timeout=3,
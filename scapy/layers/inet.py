@@ -9,6 +9,10 @@ IPv4 (Internet Protocol v4).
 
 from __future__ import absolute_import
 from __future__ import print_function
+import bisect
+import hashlib
+import hmac
+import os
 import time
 import struct
 import re
@@ -17,10 +21,10 @@ import select
 import socket
 from collections import defaultdict
 
-from scapy.utils import checksum, do_graph, incremental_label, \
-    linehexdump, strxor, whois, colgen
+from scapy.utils import checksum, checksum_update, do_graph, \
+    incremental_label, linehexdump, strxor, whois, colgen
 from scapy.ansmachine import AnsweringMachine
-from scapy.base_classes import Gen, Net
+from scapy.base_classes import Gen, Net, SetGen
 from scapy.data import ETH_P_IP, ETH_P_ALL, DLT_RAW, DLT_RAW_ALT, DLT_IPV4, \
     IP_PROTOS, TCP_SERVICES, UDP_SERVICES
 from scapy.layers.l2 import Ether, Dot3, getmacbyip, CookedLinux, GRE, SNAP, \
@@ -59,7 +63,7 @@ from scapy.volatile import RandShort, RandInt, RandBin, RandNum, VolatileValue
 from scapy.sendrecv import sr, sr1
 from scapy.plist import _PacketList, PacketList, SndRcvList
 from scapy.automaton import Automaton, ATMT
-from scapy.error import log_runtime, warning
+from scapy.error import log_runtime, warning, Scapy_Exception
 from scapy.pton_ntop import inet_pton
 
 import scapy.as_resolvers
@@ -527,10 +531,26 @@ class IP(Packet, IPTools):
             tmp_len = len(p) + len(pay)
             p = p[:2] + struct.pack("!H", tmp_len) + p[4:]
         if self.chksum is None:
-            ck = checksum(p)
+            ck = self._chksum_update(p)
+            if ck is None:
+                ck = checksum(p)
             p = p[:10] + chb(ck >> 8) + chb(ck & 0xff) + p[12:]
         return p + pay
 
+    def _chksum_update(self, p):
+        """Returns the checksum of the header p, updated from the one of
+        the dissected header, or None (see conf.incremental_checksums)
+        """
+        old = self.original
+        if not conf.incremental_checksums or len(old) < 20 or \
+                orb(old[0]) >> 4 != 4:
+            return None
+        ihl = (orb(old[0]) & 0xf) * 4
+        if len(old) < ihl:
+            return None
+        return checksum_update(struct.unpack("!H", old[10:12])[0],
+                               old[:10] + old[12:ihl], p[:10] + p[12:])
+
     def extract_padding(self, s):
         tmp_len = self.len - (self.ihl << 2)
         if tmp_len < 0:
@@ -644,6 +664,14 @@ def in4_chksum(proto, u, p):
     if not isinstance(u, IP):
         warning("No IP underlayer to compute checksum. Leaving null.")
         return 0
+    return checksum(in4_pseudoheader(proto, u, p) + p)
+
+
+def in4_pseudoheader(proto, u, p):
+    """
+    Builds the pseudo-header used in the IPv4 Upper Layer checksum
+    computation. The parameters are those of in4_chksum().
+    """
     if u.len is not None:
         if u.ihl is None:
             olen = sum(len(x) for x in u.options)
@@ -653,12 +681,50 @@ def in4_chksum(proto, u, p):
         ln = max(u.len - 4 * ihl, 0)
     else:
         ln = len(p)
-    psdhdr = struct.pack("!4s4sHH",
-                         inet_pton(socket.AF_INET, u.src),
-                         inet_pton(socket.AF_INET, u.dst),
-                         proto,
-                         ln)
-    return checksum(psdhdr + p)
+    return struct.pack("!4s4sHH",
+                       inet_pton(socket.AF_INET, u.src),
+                       inet_pton(socket.AF_INET, u.dst),
+                       proto,
+                       ln)
+
+
+def in4_chksum_update(proto, pkt, p, hdr_len, old_hdr_len, offset):
+    """
+    Computes the IPv4 Upper Layer checksum of pkt, a layer that was
+    dissected along with its IP underlayer, then modified, by updating
+    its original checksum (RFC 1624). The payload of pkt must not have
+    changed. Provided parameters are:
+    - 'proto' : value of upper layer protocol
+    - 'pkt' : the upper layer instance
+    - 'p' : the upper layer and its payload, provided as a string
+    - 'hdr_len', 'old_hdr_len' : the length of the header of the upper
+      layer in p, and in the dissected bytes
+    - 'offset' : the offset of the checksum in the header
+
+    Returns None when the checksum cannot be updated, see
+    conf.incremental_checksums.
+    """
+    u = pkt.underlayer
+    if not conf.incremental_checksums or not isinstance(u, IP):
+        return None
+    old_ip, old = u.original, pkt.original
+    if len(old_ip) < 20 or orb(old_ip[0]) >> 4 != 4 or \
+            struct.unpack("!H", old_ip[6:8])[0] & 0x3fff:
+        # Not an IPv4 header, or a fragment
+        return None
+    ihl = (orb(old_ip[0]) & 0xf) * 4
+    ln = struct.unpack("!H", old_ip[2:4])[0] - ihl
+    if (len(old) < ln or old_hdr_len > ln or
+            old_ip[ihl:ihl + len(old)] != old or
+            old[old_hdr_len:ln] != p[hdr_len:]):
+        # Not dissected together, truncated, or a different payload
+        return None
+    old_psdhdr = old_ip[12:20] + struct.pack("!HH", proto, ln)
+    return checksum_update(
+        struct.unpack("!H", old[offset:offset + 2])[0],
+        old_psdhdr + old[:offset] + old[offset + 2:old_hdr_len],
+        in4_pseudoheader(proto, u, p) + p[:offset] + p[offset + 2:hdr_len]
+    )
 
 
 class TCP(Packet):
@@ -685,7 +751,14 @@ class TCP(Packet):
             p = p[:12] + chb(dataofs & 0xff) + p[13:]
         if self.chksum is None:
             if isinstance(self.underlayer, IP):
-                ck = in4_chksum(socket.IPPROTO_TCP, self.underlayer, p)
+                ck = None
+                if len(self.original) >= 20:
+                    ck = in4_chksum_update(
+                        socket.IPPROTO_TCP, self, p, len(p) - len(pay),
+                        (orb(self.original[12]) >> 4) * 4, 16
+                    )
+                if ck is None:
+                    ck = in4_chksum(socket.IPPROTO_TCP, self.underlayer, p)
                 p = p[:16] + struct.pack("!H", ck) + p[18:]
             elif conf.ipv6_enabled and isinstance(self.underlayer, scapy.layers.inet6.IPv6) or isinstance(self.underlayer, scapy.layers.inet6._IPv6ExtHdr):  # noqa: E501
                 ck = scapy.layers.inet6.in6_chksum(socket.IPPROTO_TCP, self.underlayer, p)  # noqa: E501
@@ -757,7 +830,13 @@ class UDP(Packet):
             p = p[:4] + struct.pack("!H", tmp_len) + p[6:]
         if self.chksum is None:
             if isinstance(self.underlayer, IP):
-                ck = in4_chksum(socket.IPPROTO_UDP, self.underlayer, p)
+                ck = None
+                if self.original[6:8] not in (b"", b"\0\0"):
+                    # A null checksum means that there was none
+                    ck = in4_chksum_update(socket.IPPROTO_UDP, self, p,
+                                           len(p) - len(pay), 8, 6)
+                if ck is None:
+                    ck = in4_chksum(socket.IPPROTO_UDP, self.underlayer, p)
                 # According to RFC768 if the result checksum is 0, it should be set to 0xFFFF  # noqa: E501
                 if ck == 0:
                     ck = 0xFFFF
@@ -885,12 +964,30 @@ class ICMP(Packet):
                    ]
 
     def post_build(self, p, pay):
+        hdr_len = len(p)
         p += pay
         if self.chksum is None:
-            ck = checksum(p)
+            ck = self._chksum_update(p, hdr_len)
+            if ck is None:
+                ck = checksum(p)
             p = p[:2] + chb(ck >> 8) + chb(ck & 0xff) + p[4:]
         return p
 
+    def _chksum_update(self, p, hdr_len):
+        """Returns the checksum of the message p, updated from the one of
+        the dissected message, or None (see conf.incremental_checksums).
+        The payload must not have changed.
+        """
+        old = self.original
+        old_hdr_len = len(old) - (len(p) - hdr_len)
+        if not conf.incremental_checksums or old_hdr_len < 4 or \
+                hdr_len % 2 or old_hdr_len % 2 or \
+                old[old_hdr_len:] != p[hdr_len:]:
+            return None
+        return checksum_update(struct.unpack("!H", old[2:4])[0],
+                               old[:2] + old[4:old_hdr_len],
+                               p[:2] + p[4:hdr_len])
+
     def hashret(self):
         if self.type in [0, 8, 13, 14, 15, 16, 17, 18, 33, 34, 35, 36, 37, 38]:
             return struct.pack("HH", self.id, self.seq) + self.payload.hashret()  # noqa: E501
@@ -1089,51 +1186,130 @@ overlap_fragsize: the fragment size of the overlapping packet"""
     return qfrag + fragment(p, fragsize)
 
 
-def _defrag_list(lst, defrag, missfrag):
-    """Internal usage only. Part of the _defrag_logic"""
-    p = lst[0]
-    lastp = lst[-1]
-    if p.frag > 0 or lastp.flags.MF:  # first or last fragment missing
-        missfrag.extend(lst)
-        return
-    p = p.copy()
-    if conf.padding_layer in p:
-        del(p[conf.padding_layer].underlayer.payload)
-    ip = p[IP]
-    if ip.len is None or ip.ihl is None:
-        clen = len(ip.payload)
-    else:
-        clen = ip.len - (ip.ihl << 2)
-    txt = conf.raw_layer()
-    for q in lst[1:]:
-        if clen != q.frag << 3:  # Wrong fragmentation offset
-            if clen > q.frag << 3:
-                warning("Fragment overlap (%i > %i) %r || %r ||  %r" % (clen, q.frag << 3, p, txt, q))  # noqa: E501
-            missfrag.extend(lst)
-            break
-        if q[IP].len is None or q[IP].ihl is None:
-            clen += len(q[IP].payload)
+class _DefragBuffer(object):
+    """The fragments of an IPv4 datagram being reassembled.
+
+    The byte ranges received are tracked, merged when they touch: the
+    datagram is complete when the first and the last fragments are
+    received, and there is no hole left between them, whatever the order
+    of the fragments. Their payloads are only copied once, into the
+    reassembled datagram.
+
+    A fragment that overlaps another one with different data, that ends
+    after the last fragment or beyond the maximal size of a datagram,
+    or that is not a multiple of 8 bytes long while more fragments
+    follow, makes the datagram invalid: its data is then dropped.
+
+    :param keep: if True, the fragments are kept in ``fragments``
+    """
+
+    def __init__(self, keep=False):
+        self.keep = keep
+        self.fragments = []
+        # The first fragment, whose headers are used
+        self.first = None
+        # The size of the payload, once the last fragment is received
+        self.size = None
+        # The received ranges, and the payloads by offset
+        self.starts = []
+        self.ends = []
+        self.pieces = {}
+        # The size of the payloads stored
+        self.stored = 0
+        self.bad = False
+        self.time = None
+        self.pos = 0
+
+    def add(self, pkt):
+        """Adds a fragment. Returns False if the datagram is invalid"""
+        if self.keep:
+            self.fragments.append(pkt)
+        if self.bad:
+            return False
+        if self.time is None or pkt.time > self.time:
+            self.time = pkt.time
+        self.pos = max(self.pos, getattr(pkt, "_defrag_pos", 0))
+        ip = pkt[IP]
+        data = raw(ip.payload)
+        if ip.len is not None and ip.ihl is not None:
+            data = data[:max(0, ip.len - (ip.ihl << 2))]
+        start = ip.frag << 3
+        end = start + len(data)
+        if ip.flags.MF:
+            if len(data) % 8 or (self.size is not None and end > self.size):
+                return self._invalid()
+        elif self.size not in [None, end] or (self.ends and
+                                              self.ends[-1] > end):
+            return self._invalid()
         else:
-            clen += q[IP].len - (q[IP].ihl << 2)
-        if conf.padding_layer in q:
-            del(q[conf.padding_layer].underlayer.payload)
-        txt.add_payload(q[IP].payload.copy())
-        if q.time > p.time:
-            p.time = q.time
-    else:
+            self.size = end
+        if end > 0xffff - ((ip.ihl or 5) << 2):
+            return self._invalid()
+        if start == 0 and self.first is None:
+            self.first = pkt
+        if not data:
+            return True
+        i = bisect.bisect_right(self.starts, start)
+        if (i and self.ends[i - 1] > start) or (i < len(self.starts) and
+                                                self.starts[i] < end):
+            # Overlap: only allowed for a retransmitted fragment
+            if self.pieces.get(start) == data:
+                return True
+            return self._invalid()
+        self.pieces[start] = data
+        self.stored += len(data)
+        # Merge the range with the ones it touches
+        if i < len(self.starts) and self.starts[i] == end:
+            end = self.ends.pop(i)
+            del self.starts[i]
+        if i and self.ends[i - 1] == start:
+            self.ends[i - 1] = end
+        else:
+            self.starts.insert(i, start)
+            self.ends.insert(i, end)
+        return True
+
+    def _invalid(self):
+        self.bad = True
+        self.first = None
+        self.pieces = {}
+        self.starts = []
+        self.ends = []
+        self.stored = 0
+        return False
+
+    def complete(self):
+        """Returns True if all the fragments are received"""
+        if self.first is None or self.size is None:
+            return False
+        return self.size == 0 or (self.starts == [0] and
+                                  self.ends == [self.size])
+
+    def build(self):
+        """Returns the reassembled datagram, dissected"""
+        buf = bytearray(self.size)
+        for start, data in six.iteritems(self.pieces):
+            buf[start:start + len(data)] = data
+        p = self.first.copy()
+        ip = p[IP]
+        # The protocol may be overloaded by the payload
+        ip.proto = ip.proto
+        ip.remove_payload()
         ip.flags.MF = False
         del(ip.chksum)
         del(ip.len)
-        p = p / txt
-        p._defrag_pos = max(x._defrag_pos for x in lst)
-        defrag.append(p)
+        p = p / conf.raw_layer(load=bytes(buf))
+        q = p.__class__(raw(p))
+        q.time = self.time
+        q._defrag_pos = self.pos
+        return q
 
 
 def _defrag_logic(plist, complete=False):
     """Internal function used to defragment a list of packets.
     It contains the logic behind the defrag() and defragment() functions
     """
-    frags = defaultdict(lambda: [])
+    frags = defaultdict(lambda: _DefragBuffer(keep=True))
     final = []
     pos = 0
     for p in plist:
@@ -1143,23 +1319,19 @@ def _defrag_logic(plist, complete=False):
             ip = p[IP]
             if ip.frag != 0 or ip.flags.MF:
                 uniq = (ip.id, ip.src, ip.dst, ip.proto)
-                frags[uniq].append(p)
+                frags[uniq].add(p)
                 continue
         final.append(p)
 
     defrag = []
     missfrag = []
-    for lst in six.itervalues(frags):
-        lst.sort(key=lambda x: x.frag)
-        _defrag_list(lst, defrag, missfrag)
-    defrag2 = []
-    for p in defrag:
-        q = p.__class__(raw(p))
-        q._defrag_pos = p._defrag_pos
-        q.time = p.time
-        defrag2.append(q)
+    for buf in six.itervalues(frags):
+        if buf.complete():
+            defrag.append(buf.build())
+        else:
+            missfrag.extend(buf.fragments)
     if complete:
-        final.extend(defrag2)
+        final.extend(defrag)
         final.extend(missfrag)
         final.sort(key=lambda x: x._defrag_pos)
         if hasattr(plist, "listname"):
@@ -1168,7 +1340,7 @@ def _defrag_logic(plist, complete=False):
             name = "Defragmented"
         return PacketList(final, name=name)
     else:
-        return PacketList(final), PacketList(defrag2), PacketList(missfrag)
+        return PacketList(final), PacketList(defrag), PacketList(missfrag)
 
 
 @conf.commands.register
@@ -1184,6 +1356,213 @@ def defragment(plist):
     return _defrag_logic(plist, complete=True)
 
 
+######################
+#  Stateless probes  #
+######################
+
+class ProbeCookies(object):
+    """Matches the answers of IPv4 probes without keeping the probes.
+
+    The identity of a probe (destination, protocol, ports or ICMP type)
+    is hashed with a secret key into a 32 bits cookie, which is stamped
+    into the fields that its answers echo back: the IP id, the TCP
+    sequence number (and acknowledgment number of the ACK probes), the
+    ICMP echo id and seq, and the DNS id. These values of the probes are
+    overwritten.
+
+    An answer is accepted if it echoes the cookie of the probe it names.
+    That probe is then rebuilt from the first of the probes. The probes
+    must thus only differ by their identity: a ValueError is raised
+    otherwise, e.g. for probes that only differ by their TTL, which would
+    share their cookie. Used by sr*(stateless=True).
+
+    ex:
+        >>> cookies = ProbeCookies(IP(dst="192.0.2.0/24")/TCP(flags="S"))
+        >>> c = cookies.stamp(p)  # p is IP(dst="192.0.2.7")/TCP(...)
+        >>> c, query = cookies.query(answer)
+
+    :param probes: the probes (a packet generator, or a list of packets)
+    :param key: the secret key (default: random)
+    """
+    # ICMP request types, by type of the reply
+    icmp_requests = {0: 8, 14: 13, 16: 15, 18: 17}
+    # The fields that make the identity of the probes, by layer
+    identity_fields = [(IP, ["dst"]), (TCP, ["sport", "dport"]),
+                       (UDP, ["sport", "dport"]), (ICMP, ["type"])]
+
+    def __init__(self, probes, key=None):
+        self.tmpl = next(iter(probes)).copy()
+        if IP not in self.tmpl:
+            raise Scapy_Exception("Only IPv4 probes can be stateless")
+        self.key = key or os.urandom(16)
+        # A random source port is not a part of the identity of the
+        # probes, which keep their cookies when they are sent again.
+        # The generated probes have it fixed: look at the generator
+        if isinstance(probes, Packet):
+            self._check_template(probes)
+            l4 = probes[IP].payload
+        else:
+            l4 = next(iter(probes))[IP].payload
+        self.sport = not (isinstance(l4, (TCP, UDP)) and
+                          isinstance(l4.getfieldval("sport"), VolatileValue))
+        if not isinstance(probes, Packet):
+            self._check_list(probes)
+
+    def _check_template(self, tmpl):
+        """Raises ValueError if the probes generated by tmpl do not only
+        differ by their identity"""
+        layer = tmpl
+        while not isinstance(layer, NoPayload):
+            allowed = [fname for cls, fnames in self.identity_fields
+                       if isinstance(layer, cls) for fname in fnames]
+            for fname, val in six.iteritems(layer.fields):
+                if not isinstance(val, Gen):
+                    if layer.get_field(fname).islist:
+                        continue
+                    val = SetGen(val)
+                if val.__iterlen__() <= 1:
+                    continue
+                if fname not in allowed:
+                    raise ValueError(
+                        "The probes differ by %s.%s: they would share "
+                        "their cookies" % (layer.__class__.__name__, fname)
+                    )
+                if isinstance(val, SetGen) and \
+                        len(set(val.values)) != len(val.values):
+                    raise ValueError(
+                        "Some probes are duplicated (%s.%s)" % (
+                            layer.__class__.__name__, fname
+                        )
+                    )
+            layer = layer.payload
+
+    def _check_list(self, probes):
+        """Raises ValueError if some of the listed probes share their
+        identity"""
+        seen = set()
+        for pkt in probes:
+            identity = self.identity(pkt)
+            if identity in seen:
+                raise ValueError(
+                    "Some probes share their cookies: they must only differ "
+                    "by their identity"
+                )
+            seen.add(identity)
+
+    def cookie(self, dst, proto, sport, dport):
+        """Returns the cookie of a probe, as an integer"""
+        msg = inet_pton(socket.AF_INET, dst) + struct.pack(
+            "!BHH", proto, sport, dport
+        )
+        return struct.unpack(
+            "!I", hmac.new(self.key, msg, hashlib.sha1).digest()[:4]
+        )[0]
+
+    @staticmethod
+    def _fixed(pkt, fname):
+        """Returns the value of a field, fixing it if it is random"""
+        val = pkt.getfieldval(fname)
+        if isinstance(val, VolatileValue):
+            val = val._fix()
+            pkt.setfieldval(fname, val)
+        return val
+
+    def identity(self, pkt):
+        """Returns the identity of a probe, as a (dst, proto, sport, dport)
+        tuple"""
+        ip = pkt[IP]
+        l4 = ip.payload
+        if isinstance(l4, (TCP, UDP)):
+            sport = self._fixed(l4, "sport") if self.sport else 0
+            return ip.dst, ip.proto, sport, self._fixed(l4, "dport")
+        elif isinstance(l4, ICMP):
+            return ip.dst, ip.proto, l4.type, 0
+        return ip.dst, ip.proto, 0, 0
+
+    def stamp(self, pkt):
+        """Stamps the cookie of pkt into it, and returns it"""
+        c = self.cookie(*self.identity(pkt))
+        ip = pkt[IP]
+        l4 = ip.payload
+        ip.id = c & 0xffff
+        if isinstance(l4, TCP):
+            l4.seq = c
+            if l4.flags.A:
+                l4.ack = c
+        elif isinstance(l4, ICMP):
+            if l4.type in six.itervalues(self.icmp_requests):
+                l4.id = c >> 16
+                l4.seq = c & 0xffff
+        else:
+            dns = l4.getlayer("DNS")
+            if dns is not None:
+                dns.id = c >> 16
+        return c
+
+    def query(self, r):
+        """Returns a (cookie, probe) tuple with the probe answered by r,
+        rebuilt, or None if r does not answer any probe"""
+        ip = r.getlayer(IP)
+        if ip is None:
+            return None
+        l4 = ip.payload
+        error = isinstance(l4, ICMP) and l4.type in [3, 4, 5, 11, 12]
+        if error:
+            # The error quotes the headers of the probe
+            quoted = l4.getlayer(IPerror)
+            if quoted is None:
+                return None
+            dst, src, q4 = quoted.dst, quoted.src, quoted.payload
+            if isinstance(q4, (TCPerror, UDPerror)):
+                sport, dport = q4.sport, q4.dport
+            elif isinstance(q4, ICMPerror):
+                sport, dport = q4.type, None
+            else:
+                sport = dport = None
+        else:
+            dst, src = ip.src, ip.dst
+            if isinstance(l4, (TCP, UDP)):
+                sport, dport = l4.dport, l4.sport
+            elif isinstance(l4, ICMP):
+                sport = self.icmp_requests.get(l4.type)
+                if sport is None:
+                    return None
+                dport = None
+            else:
+                sport = dport = None
+        query = self.tmpl.copy()
+        qip = query[IP]
+        qip.dst, qip.src = dst, src
+        q4 = qip.payload
+        if isinstance(q4, (TCP, UDP)):
+            if sport is None or dport is None:
+                return None
+            q4.sport, q4.dport = sport, dport
+        elif isinstance(q4, ICMP):
+            if sport is None:
+                return None
+            q4.type = sport
+        c = self.stamp(query)
+        if not r.answers(query):
+            return None
+        if isinstance(l4, TCP):
+            # answers() tolerates small differences
+            if l4.flags.A:
+                delta = len(q4.payload) + q4.flags.S + q4.flags.F
+                if (l4.ack - c - delta) & 0xffffffff:
+                    return None
+            elif not q4.flags.A or l4.seq != c:
+                return None
+        elif error:
+            # answers() does not check all the quoted fields
+            if quoted.id != qip.id:
+                return None
+            if isinstance(quoted.payload, TCPerror) and \
+                    quoted.payload.seq != c:
+                return None
+        return c, query
+
+
 # Add timeskew_graph() method to PacketList
 def _packetlist_timeskew_graph(self, ip, **kargs):
     """Tries to graph the timeskew between the timestamps and real time for a given ip"""  # noqa: E501
@@ -16,7 +16,10 @@ Provides:
 from __future__ import absolute_import
 from __future__ import print_function
 from collections import defaultdict
+import array
+import mmap
 import re
+import tempfile
 import time
 import itertools
 import copy
@@ -29,13 +32,16 @@ from scapy.fields import (
     ConditionalField,
     Emph,
     EnumField,
+    FCSField,
     Field,
     FlagsField,
+    FusedFields,
     MultiEnumField,
     MultipleTypeField,
     PacketListField,
     RawVal,
     StrField,
+    compile_fields,
 )
 from scapy.config import conf, _version_checker
 from scapy.compat import raw, orb, bytes_encode
@@ -73,6 +79,72 @@ except ImportError:
 
 _T = TypeVar("_T", Dict[str, Any], Optional[Dict[str, Any]])
 
+# Shared by all the packets that do not overload any field. Like the
+# overload_fields dictionaries it gets replaced with, it must never be
+# modified in place.
+_NO_OVERLOADED_FIELDS = {}  # type: Dict[str, Any]
+
+
+class _PayloadGuessIndex(object):
+    """
+    Hashed view of a payload_guess list, used by guess_payload_class().
+
+    The bindings are grouped by the names of the fields they are bound on,
+    and each group maps the bound values to the first (position, class)
+    it appears in. A lookup is then one dictionary access per group instead
+    of a scan of all the bindings. Bindings on values that may compare
+    equal to a field value of another type with a different hash (e.g.
+    flag names) are kept aside and scanned linearly.
+    """
+    __slots__ = ["payload_guess", "length", "groups", "linear"]
+
+    def __init__(self, payload_guess):
+        # type: (List[Tuple[Dict[str, Any], Type[Packet]]]) -> None
+        self.payload_guess = payload_guess
+        self.length = len(payload_guess)
+        groups = {}  # type: Dict[Tuple[str, ...], Any]
+        self.linear = []  # type: List[Tuple[int, Dict[str, Any], Type[Packet]]]  # noqa: E501
+        for pos, (fval, cls) in enumerate(payload_guess):
+            if not all(isinstance(v, six.integer_types + (bytes,))
+                       for v in six.itervalues(fval)):
+                self.linear.append((pos, fval, cls))
+                continue
+            keys = tuple(sorted(fval))
+            vals = tuple(fval[k] for k in keys)
+            table, entries = groups.setdefault(keys, ({}, []))
+            table.setdefault(vals, (pos, cls))
+            entries.append((pos, vals, cls))
+        self.groups = [(keys, table, entries)
+                       for keys, (table, entries) in six.iteritems(groups)]
+
+    def lookup(self, pkt):
+        # type: (Packet) -> Optional[Type[Packet]]
+        """Returns the first class bound to the field values of pkt"""
+        best = None  # type: Optional[Tuple[int, Type[Packet]]]
+        for keys, table, entries in self.groups:
+            try:
+                vals = tuple(pkt.getfieldval(k) for k in keys)
+            except AttributeError:
+                continue
+            try:
+                hit = table.get(vals)
+            except TypeError:
+                # Unhashable field value
+                hit = next(((pos, cls) for pos, v, cls in entries
+                            if v == vals), None)
+            if hit is not None and (best is None or hit[0] < best[0]):
+                best = hit
+        for pos, fval, cls in self.linear:
+            if best is not None and pos > best[0]:
+                break
+            try:
+                if all(v == pkt.getfieldval(k)
+                       for k, v in six.iteritems(fval)):
+                    return cls
+            except AttributeError:
+                pass
+        return None if best is None else best[1]
+
 
 # six.with_metaclass typing is glitchy
 class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
@@ -88,11 +160,13 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         "payload", "underlayer",
         "name",
         # used for sr()
-        "_answered",
+        "_answered", "_sent_time_parent",
         # used when sniffing
         "direction", "sniffed_on",
         # handle snaplen Vs real length
         "wirelen",
+        # undissected (payload, padding) when using lazy dissection
+        "_lazy_payload",
     ]
     name = None
     fields_desc = []  # type: Sequence[AnyField]
@@ -107,6 +181,9 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
     class_default_fields = {}  # type: Dict[Type[Packet], Dict[str, Any]]
     class_default_fields_ref = {}  # type: Dict[Type[Packet], List[str]]
     class_fieldtype = {}  # type: Dict[Type[Packet], Dict[str, AnyField]]  # noqa: E501
+    class_fused_fields = {}  # type: Dict[Type[Packet], List[Any]]
+    class_fcs_fields = {}  # type: Dict[Type[Packet], List[FCSField]]
+    class_payload_guess_index = {}  # type: Dict[Type[Packet], _PayloadGuessIndex]  # noqa: E501
 
     @classmethod
     def from_hexcap(cls):
@@ -134,13 +211,14 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
                  ):
         # type: (...) -> None
         self.time = time.time()  # type: Union[EDecimal, float]
+        self._sent_time_parent = None  # type: Optional[Packet]
         self.sent_time = None  # type: Union[EDecimal, float, None]
         self.name = (self.__class__.__name__
                      if self._name is None else
                      self._name)
         self.default_fields = {}  # type: Dict[str, Any]
         self.overload_fields = self._overload_fields
-        self.overloaded_fields = {}  # type: Dict[str, Any]
+        self.overloaded_fields = _NO_OVERLOADED_FIELDS
         self.fields = {}  # type: Dict[str, Any]
         self.fieldtype = {}  # type: Dict[str, AnyField]
         self.packetfields = []  # type: List[AnyField]
@@ -154,6 +232,7 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         self.wirelen = None  # type: Optional[int]
         self.direction = None  # type: Optional[int]
         self.sniffed_on = None  # type: Optional[str]
+        self._lazy_payload = None  # type: Optional[Tuple[bytes, Optional[bytes]]]  # noqa: E501
         if _pkt:
             self.dissect(_pkt)
             if not _internal:
@@ -180,7 +259,8 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         if isinstance(post_transform, list):
             self.post_transforms = post_transform
         elif post_transform is None:
-            self.post_transforms = []
+            # Only allocate a list when there are post transforms
+            self.post_transforms = ()  # type: Sequence[Callable[[bytes], bytes]]  # noqa: E501
         else:
             self.post_transforms = [post_transform]
 
@@ -326,11 +406,55 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         # Last to avoid racing issues
         Packet.class_default_fields[cls_name] = class_default_fields
 
+    def get_fused_fields(self):
+        # type: () -> List[Any]
+        """
+        Returns the fields_desc of the class, where runs of fixed-size
+        fields are fused in a single FusedFields (see compile_fields()).
+        It is computed once per class.
+        """
+        cls_name = self.__class__
+        fused_fields = Packet.class_fused_fields.get(cls_name, None)
+        if fused_fields is None:
+            fused_fields = compile_fields(self.fields_desc)
+            Packet.class_fused_fields[cls_name] = fused_fields
+        return fused_fields
+
+    def get_fcs_fields(self):
+        # type: () -> List[FCSField]
+        """
+        Returns the FCSFields of the class, whose values are appended to the
+        end of the packet. It is computed once per class.
+        """
+        cls_name = self.__class__
+        fcs_fields = Packet.class_fcs_fields.get(cls_name, None)
+        if fcs_fields is None:
+            fcs_fields = [f for f in self.fields_desc
+                          if isinstance(f, FCSField)]
+            Packet.class_fcs_fields[cls_name] = fcs_fields
+        return fcs_fields
+
+    @classmethod
+    def get_payload_guess_index(cls):
+        # type: () -> _PayloadGuessIndex
+        """
+        Returns the hashed index of the payload_guess list of the class.
+        It is rebuilt whenever payload_guess is changed.
+        """
+        index = Packet.class_payload_guess_index.get(cls, None)
+        if index is None or index.payload_guess is not cls.payload_guess or \
+                index.length != len(cls.payload_guess):
+            index = _PayloadGuessIndex(cls.payload_guess)
+            Packet.class_payload_guess_index[cls] = index
+        return index
+
     def dissection_done(self, pkt):
         # type: (Packet) -> None
         """DEV: will be called after a dissection is completed"""
         self.post_dissection(pkt)
-        self.payload.dissection_done(pkt)
+        if self._lazy_payload is None:
+            # Lazy payloads are notified when they get dissected
+            self.payload.dissection_done(pkt)
 
     def post_dissection(self, pkt):
         # type: (Packet) -> None
@@ -363,9 +487,13 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
 
     def remove_payload(self):
         # type: () -> None
-        self.payload.remove_underlayer(self)
+        if self._lazy_payload is not None:
+            # Drop the undissected payload without dissecting it
+            self._lazy_payload = None
+        else:
+            self.payload.remove_underlayer(self)
         self.payload = NoPayload()
-        self.overloaded_fields = {}
+        self.overloaded_fields = _NO_OVERLOADED_FIELDS
 
     def add_underlayer(self, underlayer):
         # type: (Packet) -> None
@@ -389,6 +517,7 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
             self.raw_packet_cache_fields
         )
         clone.wirelen = self.wirelen
+        clone.original = self.original
         clone.post_transforms = self.post_transforms[:]
         clone.payload = self.payload.copy()
         clone.payload.add_underlayer(clone)
@@ -431,6 +560,10 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
 
     def __getattr__(self, attr):
         # type: (str) -> Any
+        if attr == "payload" and self._lazy_payload is not None:
+            # Only reached when the payload slot is unset (lazy dissection)
+            self.do_dissect_lazy_payload()
+            return self.payload
         try:
             fld, v = self.getfield_and_val(attr)
         except ValueError:
@@ -644,7 +777,7 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         :param field_pos_list:
         """
         if self.raw_packet_cache is not None:
-            for fname, fval in six.iteritems(self.raw_packet_cache_fields):
+            for fname, fval in six.iteritems(self.raw_packet_cache_fields or {}):  # noqa: E501
                 if self.getfieldval(fname) != fval:
                     self.raw_packet_cache = None
                     self.raw_packet_cache_fields = None
@@ -653,12 +786,22 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
             if self.raw_packet_cache is not None:
                 return self.raw_packet_cache
         p = b""
-        for f in self.fields_desc:
-            val = self.getfieldval(f.name)
-            if isinstance(val, RawVal):
-                p += bytes(val)
+        for f in self.get_fused_fields():
+            if isinstance(f, FusedFields):
+                q = f.addfields(self, p)
+                if q is not None:
+                    p = q
+                    continue
+                # Build them one by one
+                flist = f.fields  # type: Sequence[AnyField]
             else:
-                p = f.addfield(self, p, val)
+                flist = (f,)
+            for f in flist:
+                val = self.getfieldval(f.name)
+                if isinstance(val, RawVal):
+                    p += bytes(val)
+                else:
+                    p = f.addfield(self, p, val)
         return p
 
     def do_build_payload(self):
@@ -683,6 +826,10 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         for t in self.post_transforms:
             pkt = t(pkt)
         pay = self.do_build_payload()
+        for f in reversed(self.get_fcs_fields()):
+            val = self.getfieldval(f.name)
+            if not isinstance(val, RawVal):
+                pay = f.add_trailer(self, pay, val)
         if self.raw_packet_cache is None:
             return self.post_build(pkt, pay)
         else:
@@ -951,17 +1098,44 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
     def do_dissect(self, s):
         # type: (bytes) -> bytes
         _raw = s
-        self.raw_packet_cache_fields = {}
-        for f in self.fields_desc:
-            if not s:
-                break
-            s, fval = f.getfield(self, s)
-            # We need to track fields with mutable values to discard
-            # .raw_packet_cache when needed.
-            if f.islist or f.holds_packets or f.ismutable:
-                self.raw_packet_cache_fields[f.name] = f.do_copy(fval)
-            self.fields[f.name] = fval
-        self.raw_packet_cache = _raw[:-len(s)] if s else _raw
+        # Only allocated when a field holds a mutable value
+        self.raw_packet_cache_fields = None
+        # Fields are read at an offset of the raw string, that is only
+        # sliced once all of them have been dissected.
+        offset = 0
+        for f in self.get_fused_fields():
+            if isinstance(f, FusedFields):
+                if not isinstance(s, tuple) and f.sz <= len(s) - offset:
+                    offset = f.getfields_at(self, s, offset)
+                    continue
+                # Truncated: dissect them one by one
+                flist = f.fields  # type: Sequence[AnyField]
+            else:
+                flist = (f,)
+            for f in flist:
+                if not isinstance(s, tuple) and offset >= len(s):
+                    break
+                s, offset, fval = f.getfield_at(self, s, offset)
+                # We need to track fields with mutable values to discard
+                # .raw_packet_cache when needed.
+                if f.islist or f.holds_packets or f.ismutable:
+                    if self.raw_packet_cache_fields is None:
+                        self.raw_packet_cache_fields = {}
+                    self.raw_packet_cache_fields[f.name] = f.do_copy(fval)
+                self.fields[f.name] = fval
+            else:
+                continue
+            break
+        if offset:
+            if isinstance(s, tuple):
+                s = (s[0][offset:], s[1])
+            else:
+                s = s[offset:]
+        if self.get_fcs_fields():
+            # The cache lacks the FCS: always rebuild the packet
+            self.raw_packet_cache = None
+        else:
+            self.raw_packet_cache = _raw[:-len(s)] if s else _raw
         self.explicit = 1
         return s
 
@@ -1000,9 +1174,35 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         s = self.post_dissect(s)
 
         payl, pad = self.extract_padding(s)
+        if conf.lazy_dissection and (payl or pad):
+            # Postpone the dissection of the payload until it is accessed.
+            # Unsetting the slot makes the next access go to __getattr__
+            self._lazy_payload = (payl, pad)
+            object.__delattr__(self, "payload")
+            return
+        self.do_dissect_payload(payl)
+        if pad and conf.padding:
+            self.add_payload(conf.padding_layer(pad))
+
+    def do_dissect_lazy_payload(self):
+        # type: () -> None
+        """
+        Perform the dissection of a payload that was postponed by
+        conf.lazy_dissection, then notify the new layers that their
+        dissection is done.
+        """
+        if self._lazy_payload is None:
+            return
+        payl, pad = self._lazy_payload
+        self._lazy_payload = None
+        self.payload = NoPayload()
         self.do_dissect_payload(payl)
         if pad and conf.padding:
             self.add_payload(conf.padding_layer(pad))
+        top = self
+        while top.underlayer is not None:
+            top = top.underlayer
+        self.payload.dissection_done(top)
 
     def guess_payload_class(self, payload):
         # type: (bytes) -> Type[Packet]
@@ -1014,13 +1214,9 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         :return: the payload class
         """
         for t in self.aliastypes:
-            for fval, cls in t.payload_guess:
-                try:
-                    if all(v == self.getfieldval(k)
-                           for k, v in six.iteritems(fval)):
-                        return cls  # type: ignore
-                except AttributeError:
-                    pass
+            cls = t.get_payload_guess_index().lookup(self)
+            if cls is not None:
+                return cls
         return self.default_payload_class(payload)
 
     def default_payload_class(self, payload):
@@ -1048,7 +1244,8 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
     def update_sent_time(self, time):
         # type: (Optional[float]) -> None
         """Use by clone_with to share the sent_time value"""
-        pass
+        if self._sent_time_parent is not None:
+            self._sent_time_parent.sent_time = time
 
     def clone_with(self, payload=None, share_time=False, **kargs):
         # type: (Optional[Any], bool, **Any) -> Any
@@ -1065,14 +1262,12 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
             self.raw_packet_cache_fields
         )
         pkt.wirelen = self.wirelen
+        pkt.original = self.original
         if payload is not None:
             pkt.add_payload(payload)
         if share_time:
             # This binds the subpacket .sent_time to this layer
-            def _up_time(x, parent=self):
-                # type: (float, Packet) -> None
-                parent.sent_time = x
-            pkt.update_sent_time = _up_time  # type: ignore
+            pkt._sent_time_parent = self
         return pkt
 
     def __iter__(self):
@@ -1968,6 +2163,381 @@ conf.padding_layer = Padding
 if conf.default_l2 is None:
     conf.default_l2 = Raw
 
+######################
+#  Batch dissection  #
+######################
+
+
+def _dissect_frames(cls,  # type: Type[Packet]
+                    frames,  # type: Sequence[bytes]
+                    ):
+    # type: (...) -> Iterator[Packet]
+    """Internal function to dissect a sequence of raw frames as ``cls``,
+    one packet per frame. As with the pcap readers, a frame that fails to
+    dissect is returned as a ``conf.raw_layer`` packet, unless
+    ``conf.debug_dissector`` is set.
+    """
+    for s in frames:
+        try:
+            yield cls(s)
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            if conf.debug_dissector:
+                from scapy.sendrecv import debug
+                debug.crashed_on = (cls, s)
+                raise
+            yield conf.raw_layer(s)
+
+######################
+#  Packet templates  #
+######################
+
+
+def _overrides(cls, name, base):
+    # type: (type, str, type) -> bool
+    """Tells whether cls overrides the method <name> of its parent base"""
+    for c in cls.__mro__:
+        if c is base:
+            return False
+        if name in c.__dict__:
+            return True
+    return False
+
+
+class PacketTemplate(Gen[bytes]):
+    """Generates the raw bytes of the packets of a Packet generator.
+
+    Iterating ``IP(dst="10.0.0.0/16")/TCP(dport=(1, 1024))`` clones and
+    fully builds each of its packets. A template only builds the first
+    one, and records the offsets of the varying fields in the headers of
+    its layers. Each packet is then produced by stamping the new values
+    into copies of those headers, and by running the post_build() of the
+    layers to fix lengths and checksums.
+
+    Only fixed-size fields can be stamped. Otherwise, or when the stamped
+    bytes do not match a full build, each packet is built as usual.
+
+    ex:
+        >>> for s in PacketTemplate(IP(dst="10.0.0.0/24")/ICMP()):
+        ...     sock.send(s)
+    """
+    __slots__ = ["pkt"]
+
+    def __init__(self, pkt):
+        # type: (Packet) -> None
+        self.pkt = pkt
+
+    def __iterlen__(self):
+        # type: () -> int
+        return self.pkt.__iterlen__()
+
+    def __iter__(self):
+        # type: () -> Iterator[bytes]
+        plan = self._compile()
+        if plan is None:
+            return (raw(p) for p in self.pkt)
+        return self._stamp(*plan)
+
+    def _compile(self):
+        # type: () -> Optional[Tuple[Any, ...]]
+        """Builds the template, or returns None if the packets cannot be
+        stamped
+        """
+        tmpl = next(iter(self.pkt), None)  # type: Optional[Packet]
+        if tmpl is None:
+            return None
+        origs = []  # type: List[Packet]
+        layers = []  # type: List[Packet]
+        orig, lay = self.pkt, tmpl  # type: Packet, Packet
+        while not isinstance(orig, NoPayload):
+            if (isinstance(lay, NoPayload) or
+                    _overrides(type(lay), "do_build", Packet) or
+                    _overrides(type(lay), "do_build_payload", Packet)):
+                return None
+            origs.append(orig)
+            layers.append(lay)
+            orig, lay = orig.payload, lay.payload
+        # The varying fields, outermost loop first (see Packet.__iter__)
+        dims = []  # type: List[Tuple[int, str, Gen[Any]]]
+        varying = False
+        for i, orig in enumerate(origs):
+            if orig.explicit or orig.raw_packet_cache is not None:
+                continue
+            todo = [k for (k, v) in itertools.chain(
+                six.iteritems(orig.default_fields),
+                six.iteritems(orig.overloaded_fields)
+            ) if isinstance(v, VolatileValue)] + list(orig.fields)
+            for fname in reversed(todo):
+                elt = orig.getfieldval(fname)
+                if not isinstance(elt, Gen):
+                    if orig.get_field(fname).islist:
+                        elt = SetGen([elt])
+                    else:
+                        elt = SetGen(elt)
+                values = iter(elt)
+                first = next(values, None)
+                if next(values, None) is not None:
+                    varying = True
+                elif not isinstance(first, VolatileValue):
+                    continue
+                dims.append((i, fname, elt))
+        if not varying:
+            return None
+        # Offsets of the fields to stamp, in the headers of their layers,
+        # and the conditions the layout of these headers depends on
+        stamps = []  # type: List[Tuple[int, List[Tuple[str, Field[Any, Any], int]]]]  # noqa: E501
+        checks = []  # type: List[Tuple[Packet, AnyField, Any]]
+        for i in sorted(set(d[0] for d in dims)):
+            lay = layers[i]
+            if (_overrides(type(lay), "self_build", Packet) or
+                    lay.raw_packet_cache is not None):
+                return None
+            names = set(d[1] for d in dims if d[0] == i)
+            fields = []  # type: List[Tuple[str, Field[Any, Any], int]]
+            p = b""  # type: Any
+            for f in lay.fields_desc:
+                val = lay.getfieldval(f.name)
+                fld = f  # type: Any
+                while not isinstance(fld, Field):
+                    if isinstance(fld, ConditionalField):
+                        cond = fld._evalcond(lay)
+                        checks.append((lay, fld, cond))
+                        if not cond:
+                            break
+                    elif isinstance(fld, MultipleTypeField):
+                        checks.append((lay, fld,
+                                       fld._find_fld_pkt_val(lay, val)[0]))
+                        fld = checks[-1][2]
+                        continue
+                    fld = fld.fld
+                if not isinstance(fld, Field):
+                    # Absent conditional field
+                    continue
+                # Fields left to None are computed from the others
+                if f.name in names or val is None:
+                    if (isinstance(p, bytes) and
+                            not _overrides(type(fld), "addfield", Field)):
+                        fields.append((f.name, cast(Field[Any, Any], fld),
+                                       len(p)))
+                    elif f.name in names:
+                        return None
+                if isinstance(val, RawVal):
+                    if f.name in names:
+                        return None
+                    p += bytes(val)
+                else:
+                    p = f.addfield(lay, p, val)
+            stamps.append((i, fields))
+        headers = [lay.self_build() for lay in layers]
+        # Check the stamped bytes of the first packet, and of a packet
+        # where every varying field takes its second value
+        if self._build(layers, headers, stamps, checks) != tmpl.build():
+            return None
+        for i, fname, elt in dims:
+            values = iter(elt)
+            val = next(values)
+            val = next(values, val)
+            if isinstance(val, VolatileValue):
+                val = val._fix()
+            layers[i].fields[fname] = val
+        if self._build(layers, headers, stamps, checks) != tmpl.build():
+            return None
+        return layers, headers, stamps, checks, dims
+
+    @staticmethod
+    def _build(layers,  # type: List[Packet]
+               headers,  # type: List[bytes]
+               stamps,  # type: List[Tuple[int, List[Tuple[str, Field[Any, Any], int]]]]  # noqa: E501
+               checks,  # type: List[Tuple[Packet, AnyField, Any]]
+               ):
+        # type: (...) -> bytes
+        """Stamps the current values of the fields into the headers, then
+        builds the packet as Packet.build() does
+        """
+        for lay, fld, expected in checks:
+            if isinstance(fld, ConditionalField):
+                res = fld._evalcond(lay)  # type: Any
+            else:
+                res = cast(MultipleTypeField, fld)._find_fld_pkt_val(
+                    lay, lay.getfieldval(fld.name)
+                )[0]
+            if res is not expected:
+                # The layout of the headers changed
+                return layers[0].build()
+        headers = headers[:]
+        for i, fields in stamps:
+            lay = layers[i]
+            h = bytearray(headers[i])
+            for fname, fld, off in fields:
+                val = fld.addfield(lay, b"", lay.getfieldval(fname))
+                h[off:off + len(val)] = val
+            headers[i] = bytes(h)
+        pay = b""
+        for lay, pkt in zip(reversed(layers), reversed(headers)):
+            for t in lay.post_transforms:
+                pkt = t(pkt)
+            for f in reversed(lay.get_fcs_fields()):
+                val = lay.getfieldval(f.name)
+                if not isinstance(val, RawVal):
+                    pay = f.add_trailer(lay, pay, val)
+            if lay.raw_packet_cache is None:
+                pay = lay.post_build(pkt, pay)
+            else:
+                pay = pkt + pay
+        return layers[0].build_done(pay + layers[0].build_padding())
+
+    def _stamp(self,
+               layers,  # type: List[Packet]
+               headers,  # type: List[bytes]
+               stamps,  # type: List[Tuple[int, List[Tuple[str, Field[Any, Any], int]]]]  # noqa: E501
+               checks,  # type: List[Tuple[Packet, AnyField, Any]]
+               dims,  # type: List[Tuple[int, str, Gen[Any]]]
+               ):
+        # type: (...) -> Iterator[bytes]
+        build = self._build
+        current = [None] * len(dims)  # type: List[Any]
+        targets = [(layers[i].fields, fname) for i, fname, _ in dims]
+
+        def loop(k):
+            # type: (int) -> Iterator[bytes]
+            if k == len(dims):
+                for (fields, fname), val in zip(targets, current):
+                    if isinstance(val, VolatileValue):
+                        val = val._fix()
+                    fields[fname] = val
+                yield build(layers, headers, stamps, checks)
+                return
+            for val in dims[k][2]:
+                current[k] = val
+                for s in loop(k + 1):
+                    yield s
+        return loop(0)
+
+
+def _has_volatile(pkt):
+    # type: (Packet) -> bool
+    """Returns True if some fields of pkt, or of its payloads, take random
+    values (see VolatileValue)
+    """
+    for lay in pkt.iterpayloads():
+        values = [v for k, v in six.iteritems(lay.default_fields)
+                  if k not in lay.fields and k not in lay.overloaded_fields]
+        values.extend(v for k, v in six.iteritems(lay.overloaded_fields)
+                      if k not in lay.fields)
+        values.extend(six.itervalues(lay.fields))
+        for val in values:
+            for v in (val if isinstance(val, list) else [val]):
+                if isinstance(v, VolatileValue) or (
+                        isinstance(v, Packet) and _has_volatile(v)):
+                    return True
+    return False
+
+
+class FrameCache(Gen[bytes]):
+    """Builds the raw bytes of a set of packets once, to send them again.
+
+    Sending the same packets in a loop builds all of them at each pass.
+    A cache builds them during its first iteration, and stores the frames
+    back to back in a single buffer. The next iterations yield the frames
+    from this buffer. Only the packets with random fields (see
+    VolatileValue) are built again each time.
+
+    With ``use_mmap=True``, the frames are written to a temporary file,
+    which is then memory-mapped: the kernel can page out huge sets.
+
+    ex:
+        >>> frames = FrameCache([Ether()/IP(dst=d)/UDP() for d in dsts])
+        >>> for _ in range(1000):
+        ...     for s in frames:
+        ...         sock.send(s)
+    """
+    __slots__ = ["pkts", "use_mmap", "buf", "ends", "segments"]
+
+    def __init__(self, pkts, use_mmap=False):
+        # type: (Any, bool) -> None
+        if isinstance(pkts, (Packet, bytes)):
+            pkts = [pkts]
+        self.pkts = pkts
+        self.use_mmap = use_mmap
+        self.buf = b""  # type: Union[bytes, mmap.mmap]
+        # The end offsets of the frames in buf
+        self.ends = array.array("L")
+        # The runs of cached frames, as (first, last + 1) indexes in ends,
+        # and the packets to build again
+        self.segments = None  # type: Optional[List[Any]]
+
+    def __iterlen__(self):
+        # type: () -> int
+        return sum(p.__iterlen__() if isinstance(p, Packet) else 1
+                   for p in self.pkts)
+
+    def __iter__(self):
+        # type: () -> Iterator[bytes]
+        if self.segments is None:
+            return self._fill()
+        return self._replay()
+
+    def _fill(self):
+        # type: () -> Iterator[bytes]
+        """Builds and yields the frames, while storing them"""
+        if self.use_mmap:
+            out = tempfile.TemporaryFile()  # type: Any
+            write = out.write
+        else:
+            out = bytearray()
+            write = out.extend
+        segments = []  # type: List[Any]
+        ends = array.array("L")
+        size = 0
+        for item in self.pkts:
+            if isinstance(item, Packet) and _has_volatile(item):
+                segments.append(item)
+                for p in item:
+                    yield raw(p)
+                continue
+            if isinstance(item, Packet) and item.__iterlen__() > 1:
+                frames = iter(PacketTemplate(item))  # type: Iterator[bytes]
+            else:
+                frames = (raw(p) for p in SetGen(item))
+            first = len(ends)
+            for s in frames:
+                write(s)
+                size += len(s)
+                ends.append(size)
+                yield s
+            if segments and isinstance(segments[-1], tuple):
+                # Merge with the previous run
+                first = segments.pop()[0]
+            segments.append((first, len(ends)))
+        if not self.use_mmap:
+            self.buf = bytes(out)
+        else:
+            if size:
+                out.flush()
+                self.buf = mmap.mmap(out.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+            # The mapping stays valid once the file is closed
+            out.close()
+        self.ends = ends
+        self.segments = segments
+
+    def _replay(self):
+        # type: () -> Iterator[bytes]
+        """Yields the stored frames, and builds the volatile packets"""
+        buf, ends = self.buf, self.ends
+        for seg in self.segments or []:
+            if not isinstance(seg, tuple):
+                for p in seg:
+                    yield raw(p)
+                continue
+            first, last = seg
+            start = ends[first - 1] if first else 0
+            for end in itertools.islice(ends, first, last):
+                yield buf[start:end]
+                start = end
+
+
 #################
 #  Bind layers  #
 #################
@@ -1993,6 +2563,7 @@ def bind_bottom_up(lower,  # type: Type[Packet]
         fval.update(__fval)
     lower.payload_guess = lower.payload_guess[:]
     lower.payload_guess.append((fval, upper))
+    Packet.class_payload_guess_index.pop(lower, None)
 
 
 def bind_top_down(lower,  # type: Type[Packet]
@@ -2060,6 +2631,7 @@ def split_bottom_up(lower,  # type: Type[Packet]
         )
         return cls != upper or params_is_invalid
     lower.payload_guess = [x for x in lower.payload_guess if do_filter(*x)]
+    Packet.class_payload_guess_index.pop(lower, None)
 
 
 def split_top_down(lower,  # type: Type[Packet]
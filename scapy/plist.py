@@ -10,15 +10,18 @@ PacketList: holds several packets and allows to do operations on them.
 
 from __future__ import absolute_import
 from __future__ import print_function
+import array
 import os
+import time
 from collections import defaultdict
+from decimal import Decimal
 
-from scapy.compat import lambda_tuple_converter
+from scapy.compat import lambda_tuple_converter, raw
 from scapy.config import conf
 from scapy.base_classes import BasePacket, BasePacketList, \
     _CanvasDumpExtended, PacketList_metaclass
 from scapy.utils import do_graph, hexdump, make_table, make_lined_table, \
-    make_tex_table, issubtype
+    make_tex_table, issubtype, EDecimal, PcapReader, _INT64
 from scapy.extlib import plt, Line2D, \
     MATPLOTLIB_INLINED, MATPLOTLIB_DEFAULT_PLOT_KARGS
 from functools import reduce
@@ -32,15 +35,18 @@ from scapy.compat import (
     DefaultDict,
     Dict,
     Generic,
+    IO,
     Iterator,
     List,
     Optional,
+    Sequence,
     Tuple,
     Type,
     TypeVar,
     Union,
+    cast,
 )
-from scapy.packet import Packet
+from scapy.packet import Packet, _dissect_frames
 
 
 #############
@@ -50,6 +56,36 @@ from scapy.packet import Packet
 _Inner = TypeVar("_Inner", Packet, Tuple[Packet, Packet])
 
 
+def _default_session_extractor(p):
+    # type: (Packet) -> str
+    """Extract sessions from packets"""
+    if 'Ether' in p:
+        if 'IP' in p or 'IPv6' in p:
+            ip_src_fmt = "{IP:%IP.src%}{IPv6:%IPv6.src%}"
+            ip_dst_fmt = "{IP:%IP.dst%}{IPv6:%IPv6.dst%}"
+            addr_fmt = (ip_src_fmt, ip_dst_fmt)
+            if 'TCP' in p:
+                fmt = "TCP {}:%r,TCP.sport% > {}:%r,TCP.dport%"
+            elif 'UDP' in p:
+                fmt = "UDP {}:%r,UDP.sport% > {}:%r,UDP.dport%"
+            elif 'ICMP' in p:
+                fmt = "ICMP {} > {} type=%r,ICMP.type% code=%r," \
+                      "ICMP.code% id=%ICMP.id%"
+            elif 'ICMPv6' in p:
+                fmt = "ICMPv6 {} > {} type=%r,ICMPv6.type% " \
+                      "code=%r,ICMPv6.code%"
+            elif 'IPv6' in p:
+                fmt = "IPv6 {} > {} nh=%IPv6.nh%"
+            else:
+                fmt = "IP {} > {} proto=%IP.proto%"
+            return p.sprintf(fmt.format(*addr_fmt))
+        elif 'ARP' in p:
+            return p.sprintf("ARP %ARP.psrc% > %ARP.pdst%")
+        else:
+            return p.sprintf("Ethernet type=%04xr,Ether.type%")
+    return "Other"
+
+
 @six.add_metaclass(PacketList_metaclass)
 class _PacketList(Generic[_Inner]):
     __slots__ = ["stats", "res", "listname"]
@@ -600,35 +636,7 @@ class _PacketList(Generic[_Inner]):
     ):
         # type: (...) -> Dict[str, _PacketList[_Inner]]
         if session_extractor is None:
-            def _session_extractor(p):
-                # type: (Packet) -> str
-                """Extract sessions from packets"""
-                if 'Ether' in p:
-                    if 'IP' in p or 'IPv6' in p:
-                        ip_src_fmt = "{IP:%IP.src%}{IPv6:%IPv6.src%}"
-                        ip_dst_fmt = "{IP:%IP.dst%}{IPv6:%IPv6.dst%}"
-                        addr_fmt = (ip_src_fmt, ip_dst_fmt)
-                        if 'TCP' in p:
-                            fmt = "TCP {}:%r,TCP.sport% > {}:%r,TCP.dport%"
-                        elif 'UDP' in p:
-                            fmt = "UDP {}:%r,UDP.sport% > {}:%r,UDP.dport%"
-                        elif 'ICMP' in p:
-                            fmt = "ICMP {} > {} type=%r,ICMP.type% code=%r," \
-                                  "ICMP.code% id=%ICMP.id%"
-                        elif 'ICMPv6' in p:
-                            fmt = "ICMPv6 {} > {} type=%r,ICMPv6.type% " \
-                                  "code=%r,ICMPv6.code%"
-                        elif 'IPv6' in p:
-                            fmt = "IPv6 {} > {} nh=%IPv6.nh%"
-                        else:
-                            fmt = "IP {} > {} proto=%IP.proto%"
-                        return p.sprintf(fmt.format(*addr_fmt))
-                    elif 'ARP' in p:
-                        return p.sprintf("ARP %ARP.psrc% > %ARP.pdst%")
-                    else:
-                        return p.sprintf("Ethernet type=%04xr,Ether.type%")
-                return "Other"
-            session_extractor = _session_extractor
+            session_extractor = _default_session_extractor
         sessions = defaultdict(self.__class__)  # type: DefaultDict[str, _PacketList[_Inner]]  # noqa: E501
         for p in self.res:
             sess = session_extractor(
@@ -756,6 +764,25 @@ class _PacketList(Generic[_Inner]):
 class PacketList(_PacketList[Packet],
                  BasePacketList[Packet],
                  _CanvasDumpExtended):
+    @classmethod
+    def from_raw(cls,
+                 frames,  # type: Sequence[bytes]
+                 layer=None,  # type: Optional[Type[Packet]]
+                 name="PacketList",  # type: str
+                 ):
+        # type: (...) -> PacketList
+        """
+        Build a packet list by dissecting raw frames
+
+        :param frames: a sequence of raw frames (bytes)
+        :param layer: the class used to dissect the frames. Defaults to
+                      conf.default_l2
+        :param name: the name of the packet list
+        """
+        if layer is None:
+            layer = conf.default_l2
+        return cls(list(_dissect_frames(layer, frames)), name=name)
+
     def sr(self, multi=False, lookahead=None):
         # type: (bool, Optional[int]) -> Tuple[SndRcvList, PacketList]
         """
@@ -814,3 +841,322 @@ class SndRcvList(_PacketList[Tuple[Packet, Packet]],
     def _elt2sum(self, elt):
         # type: (Tuple[Packet, Packet]) -> str
         return "%s ==> %s" % (elt[0].summary(), elt[1].summary())
+
+
+class ColumnarStore(object):
+    """A sequence of packets stored as columns: the raw frames are kept in
+    a single buffer, next to arrays holding their offsets, timestamps, wire
+    lengths and the class used to dissect them.
+
+    Packets are dissected each time they are accessed, and are therefore
+    read-only: changing them does not change the store.
+    """
+    __slots__ = ["buf", "offsets", "times", "wirelens", "classes",
+                 "class_idx", "columns"]
+
+    def __init__(self):
+        # type: () -> None
+        self.buf = bytearray()
+        # Frame i is buf[offsets[i]:offsets[i + 1]]
+        self.offsets = array.array(_INT64, [0])
+        # In nanoseconds
+        self.times = array.array(_INT64)
+        # -1 when unknown
+        self.wirelens = array.array(_INT64)
+        self.classes = []  # type: List[Type[Packet]]
+        self.class_idx = array.array("H")
+        # (layer, field name) -> list of values, see column()
+        self.columns = {}  # type: Dict[Tuple[Optional[Type[Packet]], str], List[Any]]  # noqa: E501
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.times)
+
+    def _class_index(self, cls):
+        # type: (Type[Packet]) -> int
+        try:
+            return self.classes.index(cls)
+        except ValueError:
+            self.classes.append(cls)
+            return len(self.classes) - 1
+
+    def append_raw(self,
+                   s,  # type: bytes
+                   cls,  # type: Type[Packet]
+                   pkt_time=None,  # type: Optional[Union[EDecimal, float]]
+                   wirelen=None,  # type: Optional[int]
+                   ):
+        # type: (...) -> None
+        """Adds a raw frame, that will be dissected as ``cls``. The time
+        defaults to the current time, as for a new Packet."""
+        if pkt_time is None:
+            pkt_time = time.time()
+        self.buf += s
+        self.offsets.append(len(self.buf))
+        self.times.append(
+            int(Decimal(pkt_time).scaleb(9).to_integral_value())
+        )
+        self.wirelens.append(-1 if wirelen is None else wirelen)
+        self.class_idx.append(self._class_index(cls))
+        self.columns.clear()
+
+    def append(self, pkt):
+        # type: (Packet) -> None
+        """Adds a packet, that is stored as its raw bytes"""
+        self.append_raw(raw(pkt), pkt.__class__, pkt.time, pkt.wirelen)
+
+    def extend(self, pkts):
+        # type: (Union[ColumnarStore, Sequence[Packet]]) -> None
+        if not isinstance(pkts, ColumnarStore):
+            for pkt in pkts:
+                self.append(pkt)
+            return
+        start = self.offsets[-1]
+        self.buf += pkts.buf
+        self.offsets.extend(start + off for off in pkts.offsets[1:])
+        self.times.extend(pkts.times)
+        self.wirelens.extend(pkts.wirelens)
+        self.class_idx.extend(self._class_index(cls)
+                              for cls in (pkts.classes[i]
+                                          for i in pkts.class_idx))
+        self.columns.clear()
+
+    def __add__(self, other):
+        # type: (Union[ColumnarStore, Sequence[Packet]]) -> ColumnarStore
+        store = ColumnarStore()
+        store.extend(self)
+        store.extend(other)
+        return store
+
+    def raw_frame(self, i):
+        # type: (int) -> bytes
+        """Returns the raw bytes of the i-th frame"""
+        return bytes(self.buf[self.offsets[i]:self.offsets[i + 1]])
+
+    def frame_time(self, i):
+        # type: (int) -> EDecimal
+        """Returns the timestamp of the i-th frame"""
+        return EDecimal(Decimal(self.times[i]).scaleb(-9))
+
+    def packet(self, i):
+        # type: (int) -> Packet
+        """Dissects the i-th frame"""
+        s = self.raw_frame(i)
+        cls = self.classes[self.class_idx[i]]
+        try:
+            p = cls(s)
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            if conf.debug_dissector:
+                raise
+            p = conf.raw_layer(s)
+        p.time = self.frame_time(i)
+        if self.wirelens[i] >= 0:
+            p.wirelen = self.wirelens[i]
+        return p
+
+    def select(self, indexes):
+        # type: (Sequence[int]) -> ColumnarStore
+        """Returns a new store holding the frames at the given indexes.
+        The columns that were already extracted are kept."""
+        store = ColumnarStore()
+        store.classes = self.classes[:]
+        for i in indexes:
+            store.buf += self.buf[self.offsets[i]:self.offsets[i + 1]]
+            store.offsets.append(len(store.buf))
+            store.times.append(self.times[i])
+            store.wirelens.append(self.wirelens[i])
+            store.class_idx.append(self.class_idx[i])
+        for key, values in six.iteritems(self.columns):
+            store.columns[key] = [values[i] for i in indexes]
+        return store
+
+    def __iter__(self):
+        # type: () -> Iterator[Packet]
+        for i in range(len(self)):
+            yield self.packet(i)
+
+    def __getitem__(self, item):
+        # type: (Union[int, slice]) -> Any
+        if isinstance(item, slice):
+            return self.select(range(len(self))[item])
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("ColumnarStore index out of range")
+        return self.packet(item)
+
+
+class ColumnarPacketList(PacketList):
+    """A PacketList backed by a ColumnarStore, meant for large captures:
+    a packet only costs its raw bytes and a few integers, instead of
+    a tree of dissected Packet objects.
+
+    Iterating or indexing the list still yields Packet objects, dissected
+    on the fly. Field values can be extracted once in columns (see
+    column()), and used to filter the list without dissecting the packets
+    again (see filter_column()). The methods that take a function of the
+    packets, such as filter() and sessions(), dissect each packet.
+    """
+
+    def __init__(self,
+                 res=None,  # type: Optional[Union[_PacketList[Packet], ColumnarStore, List[Packet]]]  # noqa: E501
+                 name="PacketList",  # type: str
+                 stats=None  # type: Optional[List[Type[Packet]]]
+                 ):
+        # type: (...) -> None
+        if isinstance(res, _PacketList):
+            res = res.res
+        if not isinstance(res, ColumnarStore):
+            store = ColumnarStore()
+            if res is not None:
+                store.extend(res)
+            res = store
+        super(ColumnarPacketList, self).__init__(res, name, stats)
+
+    @property
+    def store(self):
+        # type: () -> ColumnarStore
+        """The ColumnarStore holding the packets (the ``res`` attribute)"""
+        return cast(ColumnarStore, self.res)
+
+    @classmethod
+    def from_raw(cls,
+                 frames,  # type: Sequence[bytes]
+                 layer=None,  # type: Optional[Type[Packet]]
+                 name="PacketList",  # type: str
+                 ):
+        # type: (...) -> ColumnarPacketList
+        """
+        Build a packet list from raw frames, without dissecting them
+
+        :param frames: a sequence of raw frames (bytes)
+        :param layer: the class used to dissect the frames. Defaults to
+                      conf.default_l2
+        :param name: the name of the packet list
+        """
+        if layer is None:
+            layer = conf.default_l2
+        store = ColumnarStore()
+        for s in frames:
+            store.append_raw(s, layer)
+        return cls(store, name=name)
+
+    @classmethod
+    def from_pcap(cls,
+                  filename,  # type: Union[IO[bytes], str]
+                  count=-1,  # type: int
+                  ):
+        # type: (...) -> ColumnarPacketList
+        """
+        Read a pcap or pcapng file, without dissecting the packets
+
+        :param count: read only <count> packets
+        """
+        store = ColumnarStore()
+        with PcapReader(filename) as fdesc:  # type: ignore
+            for pcls, s, pkt_time, wirelen in fdesc._read_records(count):
+                store.append_raw(s, pcls, pkt_time, wirelen)
+            name = os.path.basename(fdesc.filename)
+        return cls(store, name=name)
+
+    def column(self,
+               layer,  # type: Optional[Type[Packet]]
+               field,  # type: str
+               ):
+        # type: (...) -> List[Any]
+        """
+        Returns the values of a field for all the packets of the list.
+        The values are extracted once, and kept until the list changes.
+
+        :param layer: the layer holding the field. None is used for the
+                      packets metadata: "time", "wirelen" and "len"
+        :param field: the name of the field
+        :returns: a list of values, None for packets without this layer
+
+        ex: lst.column(IP, "dst")
+        """
+        store = self.store
+        key = (layer, field)
+        values = store.columns.get(key)
+        if values is not None:
+            return values
+        if layer is None:
+            if field == "time":
+                values = [store.frame_time(i) for i in range(len(store))]
+            elif field == "wirelen":
+                values = [None if w < 0 else w for w in store.wirelens]
+            elif field == "len":
+                values = [store.offsets[i + 1] - store.offsets[i]
+                          for i in range(len(store))]
+            else:
+                raise AttributeError(field)
+        else:
+            values = []
+            for p in store:
+                lay = p.getlayer(layer)
+                values.append(None if lay is None else
+                              lay.getfieldval(field))
+        store.columns[key] = values
+        return values
+
+    def filter_column(self,
+                      layer,  # type: Optional[Type[Packet]]
+                      field,  # type: str
+                      func,  # type: Callable[[Any], bool]
+                      ):
+        # type: (...) -> ColumnarPacketList
+        """Returns a packet list filtered by a truth function applied to
+        the values of a column (see column())
+
+        ex: lst.filter_column(TCP, "dport", lambda x: x == 80)
+        """
+        return self.__class__(
+            self.store.select([i for i, v in
+                               enumerate(self.column(layer, field))
+                               if func(v)]),
+            name="filtered %s" % self.listname
+        )
+
+    def filter(self, func):
+        # type: (Callable[..., bool]) -> ColumnarPacketList
+        """Returns a packet list filtered by a truth function. Each packet
+        is dissected to call it: use filter_column() to filter on the
+        values of a field without dissecting the packets again.
+        """
+        func = lambda_tuple_converter(func)
+        return self.__class__(
+            self.store.select([i for i, p in enumerate(self.store)
+                               if func(p)]),
+            name="filtered %s" % self.listname
+        )
+
+    def __getitem__(self, item):
+        # type: (Any) -> Any
+        if issubtype(item, BasePacket):
+            return self.__class__(
+                self.store.select([i for i, p in enumerate(self.store)
+                                   if item in p]),
+                name="%s from %s" % (item.__name__, self.listname)
+            )
+        return super(ColumnarPacketList, self).__getitem__(item)
+
+    def sessions(
+            self,
+            session_extractor=None  # type: Optional[Callable[[Packet], str]]
+    ):
+        # type: (...) -> Dict[str, _PacketList[Packet]]
+        """Splits the list in sessions, as PacketList.sessions(). Each
+        packet is dissected to extract its session, but the sessions are
+        ColumnarPacketLists that only hold the raw frames.
+        """
+        if session_extractor is None:
+            session_extractor = _default_session_extractor
+        sessions = defaultdict(list)  # type: DefaultDict[str, List[int]]
+        for i, p in enumerate(self.store):
+            sessions[session_extractor(p)].append(i)
+        return {
+            sess: self.__class__(self.store.select(indexes))
+            for sess, indexes in six.iteritems(sessions)
+        }
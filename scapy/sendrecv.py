@@ -9,6 +9,7 @@ Functions to send and receive packets.
 
 from __future__ import absolute_import, print_function
 from collections import namedtuple
+import heapq
 import itertools
 from threading import Thread, Event
 import os
@@ -22,7 +23,7 @@ from scapy.data import ETH_P_ALL
 from scapy.config import conf
 from scapy.error import warning
 from scapy.interfaces import network_name, resolve_iface
-from scapy.packet import Gen, Packet
+from scapy.packet import FrameCache, Gen, Packet, PacketTemplate
 from scapy.utils import get_temp_file, tcpdump, wrpcap, \
     ContextManagerSubprocess, PcapReader
 from scapy.plist import PacketList, SndRcvList
@@ -30,6 +31,7 @@ from scapy.error import log_runtime, log_interactive, Scapy_Exception
 from scapy.base_classes import SetGen
 from scapy.modules import six
 from scapy.modules.six.moves import map
+from scapy.modules.six.moves.queue import Empty
 from scapy.sessions import DefaultSession
 from scapy.supersocket import SuperSocket
 
@@ -49,6 +51,130 @@ class debug:
     crashed_on = None
 
 
+############
+#  Pacing  #
+############
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+class Pacer(object):
+    """
+    Paces the packets sent on a socket, with a token bucket.
+
+    The sending time of each packet is an absolute deadline, computed from
+    the rate: the delays of the previous packets do not accumulate. Up to
+    ``burst`` packets can be sent back to back, which also lets the rate
+    catch up after a late wake-up. The wait is a sleep, followed by a
+    short spin to be accurate at high rates.
+
+    ex:
+        >>> pacer = Pacer(pps=10000, burst=8)
+        >>> for p in pkts:
+        ...     pacer.send(sock, p)
+        >>> print(pacer.summary())
+
+    :param pps: the maximum rate, in packets per second
+    :param mbps: the maximum rate, in megabits per second
+    :param burst: how many packets can be sent back to back (default 1)
+    """
+    #: Delay (in s) before a deadline below which the wait spins
+    spin = 0.0002
+
+    def __init__(self, pps=None, mbps=None, burst=1):
+        if not pps and not mbps:
+            raise ValueError("A rate (pps or mbps) is required !")
+        self.pps = pps
+        self.mbps = mbps
+        self.burst = max(1, int(burst or 1))
+        # Time needed to send a packet, at the rate
+        self.interval = 1.0 / pps if pps else 0.0
+        # Theoretical time of the next packet
+        self.tat = None
+        self.first = self.last = None
+        self.count = self.size = 0
+
+    def _cost(self, n, size):
+        cost = n / float(self.pps) if self.pps else 0.0
+        if self.mbps:
+            cost = max(cost, size * 8 / (self.mbps * 1e6))
+        return cost
+
+    def wait(self, n=1):
+        """Waits until n packets can be sent"""
+        now = _clock()
+        # Being late does not allow to send faster afterwards
+        if self.tat is None or self.tat < now:
+            self.tat = now
+        deadline = self.tat + (n - self.burst) * self.interval
+        if deadline > now:
+            remain = deadline - now
+            if remain > self.spin:
+                time.sleep(remain - self.spin)
+            while _clock() < deadline:
+                pass
+            now = _clock()
+        if self.first is None:
+            self.first = now
+        self.last = now
+
+    def charge(self, n=1, size=0):
+        """Accounts for n packets of size bytes, that were just sent"""
+        cost = self._cost(n, size)
+        self.tat += cost
+        if self.mbps and not self.pps:
+            # The interval depends on the size of the packets
+            self.interval = cost / n
+        self.count += n
+        self.size += size
+
+    def send(self, sock, pkt):
+        """Sends pkt on sock when the rate allows it"""
+        self.wait()
+        ret = sock.send(pkt)
+        if isinstance(ret, int):
+            self.charge(size=ret)
+        else:
+            self.charge(size=len(pkt) if self.mbps else 0)
+        return ret
+
+    def send_batch(self, sock, pkts):
+        """Sends pkts on sock, with send_batch(), when the rate allows it.
+        Batches must not be longer than burst, and mbps is not supported"""
+        self.wait(len(pkts))
+        sock.send_batch(pkts)
+        self.charge(len(pkts))
+
+    def rates(self):
+        """Returns the achieved rates, in packets and megabits per second"""
+        if self.count < 2 or self.last == self.first:
+            return 0.0, 0.0
+        # The last packet was sent at the end of the elapsed time
+        pps = (self.count - 1) / (self.last - self.first)
+        return pps, pps * self.size * 8 / (self.count * 1e6)
+
+    def summary(self):
+        pps, mbps = self.rates()
+        rate = "%.1f pps" % pps
+        if self.size:
+            rate += ", %.2f Mbps" % mbps
+        target = []
+        if self.pps:
+            target.append("%g pps" % self.pps)
+        if self.mbps:
+            target.append("%g Mbps" % self.mbps)
+        return "Sent %i packets at %s (target: %s)." % (
+            self.count, rate, ", ".join(target)
+        )
+
+
+def _pacer(pps=None, mbps=None, burst=None):
+    """Returns a Pacer if a rate is given, else None"""
+    if pps or mbps:
+        return Pacer(pps=pps, mbps=mbps, burst=burst)
+    return None
+
+
 ####################
 #  Send / Receive  #
 ####################
@@ -69,7 +195,62 @@ _DOC_SNDRCV_PARAMS = """
     :param multi: whether to accept multiple answers for the same stimulus
     :param prebuild: pre-build the packets before starting to send them.
         Automatically enabled when a generator is passed as the packet
+    :param pps: the maximum rate, in packets per second (see Pacer)
+    :param mbps: the maximum rate, in megabits per second
+    :param burst: how many packets can be sent back to back at that rate
+    :param stateless: do not keep the sent packets: identify them with
+        cookies stamped into the fields their answers echo back (IPv4
+        only, see ProbeCookies). The queries of the answers are rebuilt
+        from the first packet, and the unanswered packets are not returned.
+        The packets must only differ by their destination, ports or ICMP
+        type
+    :param adaptive: send each unanswered packet again as soon as its own
+        retransmission timeout expires, instead of waiting for the end of
+        the round. The timeout is estimated from the measured round-trip
+        times (see RTOEstimator). retry is the number of retransmissions
+        of each packet, and timeout the maximal retransmission timeout.
+        Returns as soon as all the packets are answered or given up
+    """
+
+
+class RTOEstimator(object):
+    """
+    Estimates the retransmission timeout of the packets from their
+    round-trip times, as TCP does (RFC 6298): the timeout is the smoothed
+    round-trip time, plus four times its variation.
+
+    :param initial: the timeout before any round-trip time is measured
+    :param max_rto: the maximal timeout
     """
+    #: The minimal timeout, in seconds
+    min_rto = 0.01
+
+    def __init__(self, initial=1.0, max_rto=60.0):
+        self.initial = initial
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+
+    def sample(self, rtt):
+        """Accounts for a measured round-trip time"""
+        rtt = max(0.0, float(rtt))
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.samples += 1
+
+    def rto(self, backoff=0):
+        """Returns the timeout of a packet that was sent again backoff
+        times: it doubles at each retransmission"""
+        if self.srtt is None:
+            rto = self.initial
+        else:
+            rto = self.srtt + max(self.min_rto, 4 * self.rttvar)
+        return min(rto * 2 ** backoff, self.max_rto)
 
 
 class SndRcvHandler(object):
@@ -92,7 +273,8 @@ class SndRcvHandler(object):
                  retry=0, multi=False, rcv_pks=None,
                  prebuild=False, _flood=None,
                  threaded=False,
-                 session=None):
+                 session=None, stateless=False,
+                 pps=None, mbps=None, burst=None, adaptive=False):
         # Instantiate all arguments
         if verbose is None:
             verbose = conf.verb
@@ -110,6 +292,7 @@ class SndRcvHandler(object):
         self.multi = multi
         self.timeout = timeout
         self.session = session
+        self.pacer = _pacer(pps, mbps, burst)
         # Instantiate packet holders
         if _flood:
             self.tobesent = pkt
@@ -123,6 +306,14 @@ class SndRcvHandler(object):
                     SetGen(pkt) if not isinstance(pkt, Gen) else pkt
                 )
                 self.notans = self.tobesent.__iterlen__()
+        self.probes = None
+        if stateless:
+            from scapy.layers.inet import ProbeCookies
+            self.probes = ProbeCookies(
+                pkt if isinstance(pkt, Packet) else self.tobesent
+            )
+            # Cookies of the answered probes
+            self.answered = set()
 
         if retry < 0:
             autostop = retry = -retry
@@ -132,8 +323,27 @@ class SndRcvHandler(object):
         if timeout is not None and timeout < 0:
             self.timeout = None
 
+        self.rto = None
+        if adaptive:
+            if self.probes is not None or _flood:
+                raise ValueError(
+                    "adaptive is not supported with stateless or flood !"
+                )
+            # A single round: each packet is sent again by the sending
+            # thread, when its own timeout expires
+            self.rto = RTOEstimator(max_rto=self.timeout or 60.0)
+            self.retries = retry
+            retry = autostop = 0
+            threaded = True
+            # Number of retransmissions of the packets being waited for,
+            # by id()
+            self._pending = {}
+            self._stop_snd = Event()
+            self.nretrans = 0
+
         while retry >= 0:
             self.hsent = {}
+            nsent = self.notans
 
             if threaded or _flood:
                 # Send packets in thread.
@@ -150,38 +360,54 @@ class SndRcvHandler(object):
                 if _flood:
                     # Flood: stop send thread
                     _flood[1]()
+                if self.rto is not None:
+                    # Stop the retransmissions
+                    self._stop_snd.set()
                 snd_thread.join()
             else:
                 self._sndrcv_rcv(self._sndrcv_snd)
 
-            if multi:
-                remain = [
-                    p for p in itertools.chain(*six.itervalues(self.hsent))
-                    if not hasattr(p, '_answered')
-                ]
+            if self.probes is not None:
+                # The probes are not kept: the next round sends the
+                # whole generator again, but the answered probes
+                remain = []
+                nremain = self.notans
             else:
-                remain = list(itertools.chain(*six.itervalues(self.hsent)))
+                remain = self._remain()
+                nremain, nsent = len(remain), len(self.tobesent)
+                self.tobesent = remain
 
-            if autostop and len(remain) > 0 and \
-               len(remain) != len(self.tobesent):
+            if autostop and nremain > 0 and nremain != nsent:
                 retry = autostop
 
-            self.tobesent = remain
-            if len(self.tobesent) == 0:
+            if nremain == 0:
                 break
             retry -= 1
 
+        self._finish(remain)
+
+    def _remain(self):
+        """Returns the sent packets that are still unanswered"""
+        if self.multi:
+            return [
+                p for p in itertools.chain(*six.itervalues(self.hsent))
+                if not hasattr(p, '_answered')
+            ]
+        return list(itertools.chain(*six.itervalues(self.hsent)))
+
+    def _finish(self, remain):
+        """Builds the results once all the retries are done"""
         if conf.debug_match:
             debug.sent = PacketList(remain[:], "Sent")
             debug.match = SndRcvList(self.ans[:])
 
         # Clean the ans list to delete the field _answered
-        if multi:
+        if self.multi:
             for snd, _ in self.ans:
                 if hasattr(snd, '_answered'):
                     del snd._answered
 
-        if verbose:
+        if self.verbose:
             print(
                 "\nReceived %i packets, got %i answers, "
                 "remaining %i packets" % (
@@ -200,37 +426,156 @@ class SndRcvHandler(object):
         try:
             if self.verbose:
                 print("Begin emission:")
-            i = 0
-            for p in self.tobesent:
-                # Populate the dictionary of _sndrcv_rcv
-                # _sndrcv_rcv won't miss the answer of a packet that
-                # has not been sent
-                self.hsent.setdefault(p.hashret(), []).append(p)
-                # Send packet
-                self.pks.send(p)
-                time.sleep(self.inter)
-                i += 1
+            if self.probes is not None:
+                i = self._stateless_snd()
+            elif self.rto is not None:
+                i = self._adaptive_snd()
+            else:
+                i = 0
+                for p in self.tobesent:
+                    # Populate the dictionary of _sndrcv_rcv
+                    # _sndrcv_rcv won't miss the answer of a packet that
+                    # has not been sent
+                    self.hsent.setdefault(p.hashret(), []).append(p)
+                    # Send packet
+                    if self.pacer is not None:
+                        self.pacer.send(self.pks, p)
+                    else:
+                        self.pks.send(p)
+                    time.sleep(self.inter)
+                    i += 1
             if self.verbose:
                 print("Finished sending %i packets." % i)
+                if self.pacer is not None:
+                    print(self.pacer.summary())
+                if self.rto is not None:
+                    print("Sent %i packets again." % self.nretrans)
         except SystemExit:
             pass
         except Exception:
             log_runtime.exception("--- Error sending packets")
 
+    def _stateless_snd(self):
+        """Stamps the cookies into the packets and sends them, without
+        keeping them. Returns the number of packets sent"""
+        probes = (p for p in self.tobesent
+                  if self.probes.stamp(p) not in self.answered)
+        pacer = self.pacer
+        i = 0
+        batch_size = _batch_size(self.pks, self.inter, pacer)
+        if not batch_size:
+            for p in probes:
+                if pacer is not None:
+                    pacer.send(self.pks, p)
+                else:
+                    self.pks.send(p)
+                time.sleep(self.inter)
+                i += 1
+            return i
+        while True:
+            batch = list(itertools.islice(probes, batch_size))
+            if not batch:
+                return i
+            if pacer is not None:
+                pacer.send_batch(self.pks, batch)
+            else:
+                self.pks.send_batch(batch)
+            i += len(batch)
+
+    def _send(self, p):
+        if self.pacer is not None:
+            self.pacer.send(self.pks, p)
+        else:
+            self.pks.send(p)
+
+    def _adaptive_snd(self):
+        """Sends the packets, and sends again each unanswered packet when
+        its retransmission timeout expires. Returns the number of packets
+        sent the first time"""
+        # Heap of (deadline, index, sending time, retransmissions, packet)
+        timers = []
+        pkts = iter(self.tobesent)
+        more = True
+        base = self.rto.rto()
+        i = 0
+        try:
+            while (more or timers) and not self._stop_snd.is_set():
+                rto = self.rto.rto()
+                if rto < base / 2:
+                    # The estimate dropped: the timers that were armed
+                    # before are late
+                    base = rto
+                    timers = [
+                        (t + self.rto.rto(tries), n, t, tries, p)
+                        for _, n, t, tries, p in timers
+                    ]
+                    heapq.heapify(timers)
+                now = time.time()
+                if timers and timers[0][0] <= now:
+                    _, n, _, tries, p = heapq.heappop(timers)
+                    if id(p) not in self._pending:
+                        # Answered
+                        continue
+                    if tries >= self.retries:
+                        # Given up
+                        self._pending.pop(id(p), None)
+                        continue
+                    self._pending[id(p)] = tries + 1
+                    self._send(p)
+                    self.nretrans += 1
+                    now = time.time()
+                    heapq.heappush(timers, (now + self.rto.rto(tries + 1),
+                                            n, now, tries + 1, p))
+                elif more:
+                    p = next(pkts, None)
+                    if p is None:
+                        more = False
+                        continue
+                    self.hsent.setdefault(p.hashret(), []).append(p)
+                    self._pending[id(p)] = 0
+                    self._send(p)
+                    now = time.time()
+                    heapq.heappush(timers, (now + rto, i, now, 0, p))
+                    time.sleep(self.inter)
+                    i += 1
+                else:
+                    # Wake up regularly, to follow the estimate
+                    self._stop_snd.wait(min(timers[0][0] - now, 0.05))
+        finally:
+            # All the packets are answered or given up (or sending failed)
+            if not self._stop_snd.is_set():
+                try:
+                    self.sniffer.stop(join=False)
+                except Scapy_Exception:
+                    # Already stopped
+                    pass
+        return i
+
     def _process_packet(self, r):
         """Internal function used to process each packet."""
         if r is None:
             return
+        self._match(r)
+        if self.notans <= 0 and not self.multi:
+            self.sniffer.stop(join=False)
+
+    def _match(self, r):
+        """Matches a received packet against the sent ones.
+        Returns True if it answers one of them."""
         ok = False
-        h = r.hashret()
-        if h in self.hsent:
-            hlst = self.hsent[h]
+        if self.probes is not None:
+            ok = self._match_cookie(r)
+        else:
+            h = r.hashret()
+            hlst = self.hsent.get(h, [])
             for i, sentpkt in enumerate(hlst):
                 if r.answers(sentpkt):
                     self.ans.append(QueryAnswer(sentpkt, r))
                     if self.verbose > 1:
                         os.write(1, b"*")
                     ok = True
+                    if self.rto is not None:
+                        self._sample_rtt(sentpkt, r)
                     if not self.multi:
                         del hlst[i]
                         self.notans -= 1
@@ -239,14 +584,39 @@ class SndRcvHandler(object):
                             self.notans -= 1
                         sentpkt._answered = 1
                     break
-        if self.notans <= 0 and not self.multi:
-            self.sniffer.stop(join=False)
         if not ok:
             if self.verbose > 1:
                 os.write(1, b".")
             self.nbrecv += 1
             if conf.debug_match:
                 debug.recv.append(r)
+        return ok
+
+    def _sample_rtt(self, sentpkt, r):
+        """Measures the round-trip time of an answered packet"""
+        tries = self._pending.pop(id(sentpkt), None)
+        # Karn's algorithm: the answer of a packet sent again could be
+        # the answer of any of its transmissions
+        if tries == 0 and sentpkt.sent_time and r.time:
+            self.rto.sample(float(r.time) - float(sentpkt.sent_time))
+
+    def _match_cookie(self, r):
+        """Matches a received packet with the cookies of the stateless
+        probes. Returns True if it answers one of them."""
+        res = self.probes.query(r)
+        if res is None:
+            return False
+        c, sentpkt = res
+        if c in self.answered:
+            if not self.multi:
+                return False
+        else:
+            self.answered.add(c)
+            self.notans -= 1
+        self.ans.append(QueryAnswer(sentpkt, r))
+        if self.verbose > 1:
+            os.write(1, b"*")
+        return True
 
     def _sndrcv_rcv(self, callback):
         """Function used to receive packets and check their hashret"""
@@ -255,7 +625,8 @@ class SndRcvHandler(object):
             self.sniffer = AsyncSniffer()
             self.sniffer._run(
                 prn=self._process_packet,
-                timeout=self.timeout,
+                # In adaptive mode, the sending thread stops the sniffer
+                timeout=self.timeout if self.rto is None else None,
                 store=False,
                 opened_socket=self.pks,
                 session=self.session,
@@ -275,7 +646,19 @@ def sndrcv(*args, **kwargs):
     return sndrcver.results()
 
 
-def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, return_packets=False, *args, **kargs):  # noqa: E501
+def _batch_size(s, inter=0, pacer=None):
+    """Returns how many packets to send at once with s.send_batch(), or 0
+    to send them one at a time"""
+    if inter or not hasattr(s, "send_batch"):
+        return 0
+    if pacer is None:
+        return s.batch_size
+    if pacer.burst == 1 or pacer.mbps:
+        return 0
+    return min(s.batch_size, pacer.burst)
+
+
+def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, return_packets=False, pps=None, mbps=None, burst=None, *args, **kargs):  # noqa: E501
     if isinstance(x, str):
         x = conf.raw_layer(load=x)
     if not isinstance(x, Gen):
@@ -289,8 +672,30 @@ def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, r
         loop = -1
     if return_packets:
         sent_packets = PacketList()
+    pacer = _pacer(pps, mbps, burst)
+    batch_size = 0
+    if not realtime:
+        # Send the packets with as few system calls as possible
+        batch_size = _batch_size(s, inter, pacer)
     try:
         while loop:
+            if batch_size:
+                it = iter(x)
+                pkts = list(itertools.islice(it, batch_size))
+                while pkts:
+                    if pacer is not None:
+                        pacer.send_batch(s, pkts)
+                    else:
+                        s.send_batch(pkts)
+                    if return_packets:
+                        sent_packets.extend(pkts)
+                    n += len(pkts)
+                    if verbose:
+                        os.write(1, b"." * len(pkts))
+                    pkts = list(itertools.islice(it, batch_size))
+                if loop < 0:
+                    loop += 1
+                continue
             dt0 = None
             for p in x:
                 if realtime:
@@ -301,7 +706,10 @@ def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, r
                             time.sleep(st)
                     else:
                         dt0 = ct - float(p.time)
-                s.send(p)
+                if pacer is not None:
+                    pacer.send(s, p)
+                else:
+                    s.send(p)
                 if return_packets:
                     sent_packets.append(p)
                 n += 1
@@ -314,20 +722,24 @@ def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, r
         pass
     if verbose:
         print("\nSent %i packets." % n)
+        if pacer is not None:
+            print(pacer.summary())
     if return_packets:
         return sent_packets
 
 
 def _send(x, _func, inter=0, loop=0, iface=None, count=None,
           verbose=None, realtime=None,
-          return_packets=False, socket=None, **kargs):
+          return_packets=False, socket=None,
+          pps=None, mbps=None, burst=None, **kargs):
     """Internal function used by send and sendp"""
     need_closing = socket is None
     iface = resolve_iface(iface or conf.iface)
     socket = socket or _func(iface)(iface=iface, **kargs)
     results = __gen_send(socket, x, inter=inter, loop=loop,
                          count=count, verbose=verbose,
-                         realtime=realtime, return_packets=return_packets)
+                         realtime=realtime, return_packets=return_packets,
+                         pps=pps, mbps=mbps, burst=burst)
     if need_closing:
         socket.close()
     return results
@@ -345,6 +757,9 @@ def send(x, iface=None, *args, **kargs):
     :param verbose: verbose mode (default None=conf.verbose)
     :param realtime: check that a packet was sent before sending the next one
     :param return_packets: return the sent packets
+    :param pps: the maximum rate, in packets per second (see Pacer)
+    :param mbps: the maximum rate, in megabits per second
+    :param burst: how many packets can be sent back to back at that rate
     :param socket: the socket to use (default is conf.L3socket(kargs))
     :param iface: the interface to send the packets on
     :param monitor: (not on linux) send in monitor mode
@@ -370,6 +785,9 @@ def sendp(x, iface=None, iface_hint=None, socket=None, *args, **kargs):
     :param verbose: verbose mode (default None=conf.verbose)
     :param realtime: check that a packet was sent before sending the next one
     :param return_packets: return the sent packets
+    :param pps: the maximum rate, in packets per second (see Pacer)
+    :param mbps: the maximum rate, in megabits per second
+    :param burst: how many packets can be sent back to back at that rate
     :param socket: the socket to use (default is conf.L3socket(kargs))
     :param iface: the interface to send the packets on
     :param monitor: (not on linux) send in monitor mode
@@ -377,6 +795,16 @@ def sendp(x, iface=None, iface_hint=None, socket=None, *args, **kargs):
     """
     if iface is None and iface_hint is not None and socket is None:
         iface = conf.route.route(iface_hint)[0]
+    if (socket is None and not args and
+            not kargs.get("realtime") and not kargs.get("return_packets")):
+        # Only the raw packets are needed
+        if ((kargs.get("loop") or (kargs.get("count") or 1) > 1) and
+                isinstance(x, (Packet, list, PacketList))):
+            # Build them once, and send the same bytes at each pass
+            x = FrameCache(x)
+        elif isinstance(x, Packet) and x.__iterlen__() > 1:
+            # Stamp them from a template
+            x = PacketTemplate(x)
     return _send(
         x,
         lambda iface: iface.l2socket(),
@@ -784,6 +1212,9 @@ class AsyncSniffer(object):
         monitor: use monitor mode. May not be available on all OS
         started_callback: called as soon as the sniffer starts sniffing
                           (default: None).
+        workers: sniff an interface with this number of processes, among
+                 which the packets are spread by flow (Linux only, see
+                 below).
 
     The iface, offline and opened_socket parameters can be either an
     element, a list of elements, or a dict object mapping an element to a
@@ -792,6 +1223,12 @@ class AsyncSniffer(object):
     For more information about the session argument, see
     https://scapy.rtfd.io/en/latest/usage.html#advanced-sniffing-sniffing-sessions
 
+    With workers, each process dissects its share of the packets, with its
+    own session, and calls prn and the filters: the results are merged
+    when all of them are done. The packets of a flow, in both directions,
+    are always handled by the same process. Stopping after count packets
+    may let a few more packets reach prn.
+
     Examples: synchronous
       >>> sniff(filter="arp")
       >>> sniff(filter="tcp",
@@ -805,6 +1242,8 @@ class AsyncSniffer(object):
       >>> sniff(iface={"eth0": "Ethernet", "mon0": "Wifi"},
       ...       prn=lambda pkt: "%s: %s" % (pkt.sniffed_on,
       ...                                   pkt.summary()))
+      >>> sniff(iface="eth0", workers=4, session=TCPSession,
+      ...       store=False, prn=lambda pkt: pkt.summary())
 
     Examples: asynchronous
       >>> t = AsyncSniffer(iface="enp0s3")
@@ -838,7 +1277,21 @@ class AsyncSniffer(object):
              L2socket=None, timeout=None, opened_socket=None,
              stop_filter=None, iface=None, started_callback=None,
              session=None, session_args=[], session_kwargs={},
-             *arg, **karg):
+             workers=None, *arg, **karg):
+        if workers:
+            if offline is not None or opened_socket is not None or \
+                    isinstance(iface, (list, dict)):
+                raise Scapy_Exception(
+                    "workers can only be used to sniff one interface"
+                )
+            self._run_workers(
+                workers, count, timeout, stop_filter, started_callback,
+                iface, L2socket, arg, karg,
+                dict(store=store, prn=prn, lfilter=lfilter, session=session,
+                     session_args=session_args,
+                     session_kwargs=session_kwargs),
+            )
+            return
         self.running = True
         # Start main thread
         # instantiate session
@@ -964,13 +1417,21 @@ class AsyncSniffer(object):
                     if remain <= 0:
                         break
                 sockets, read_func = select_func(sniff_sockets, remain)
+                batch = read_func is None
                 read_func = read_func or _backup_read_func
                 dead_sockets = []
                 for s in sockets:
                     if s is close_pipe:
                         break
                     try:
-                        p = read_func(s)
+                        if batch and hasattr(s, "recv_batch"):
+                            # Read all the packets available at once
+                            n = s.batch_size
+                            if count > 0:
+                                n = min(n, count - session.count)
+                            pkts = s.recv_batch(n)
+                        else:
+                            pkts = [read_func(s)]
                     except EOFError:
                         # End of stream
                         try:
@@ -993,17 +1454,20 @@ class AsyncSniffer(object):
                         if conf.debug_dissector >= 2:
                             raise
                         continue
-                    if p is None:
-                        continue
-                    if lfilter and not lfilter(p):
-                        continue
-                    p.sniffed_on = sniff_sockets[s]
-                    # on_packet_received handles the prn/storage
-                    session.on_packet_received(p)
-                    # check
-                    if (stop_filter and stop_filter(p)) or \
-                            (0 < count <= session.count):
-                        self.continue_sniff = False
+                    for p in pkts:
+                        if p is None:
+                            continue
+                        if lfilter and not lfilter(p):
+                            continue
+                        p.sniffed_on = sniff_sockets[s]
+                        # on_packet_received handles the prn/storage
+                        session.on_packet_received(p)
+                        # check
+                        if (stop_filter and stop_filter(p)) or \
+                                (0 < count <= session.count):
+                            self.continue_sniff = False
+                            break
+                    if not self.continue_sniff:
                         break
                 # Removed dead sockets
                 for s in dead_sockets:
@@ -1018,6 +1482,73 @@ class AsyncSniffer(object):
             close_pipe.close()
         self.results = session.toPacketList()
 
+    def _run_workers(self, workers, count, timeout, stop_filter,
+                     started_callback, iface, L2socket, arg, karg, kwargs):
+        """Internal function to sniff with several processes, each of them
+        getting its share of the packets from a PACKET_FANOUT group"""
+        import multiprocessing
+        try:
+            # The processes inherit the sockets and functions
+            mp = multiprocessing.get_context("fork")
+        except AttributeError:
+            # Python 2
+            mp = multiprocessing
+        iface = resolve_iface(iface or conf.iface)
+        if L2socket is None:
+            L2socket = iface.l2listen()
+        if not hasattr(L2socket, "set_fanout"):
+            raise Scapy_Exception(
+                "workers are not supported by %s" % L2socket.__name__
+            )
+        socks = [L2socket(type=ETH_P_ALL, iface=iface, *arg, **karg)
+                 for _ in range(workers)]
+        group = socks[0].set_fanout()
+        for s in socks[1:]:
+            s.set_fanout(group)
+        stop = mp.Event()
+        counter = mp.Value("L", 0)
+        queue = mp.Queue()
+        procs = [mp.Process(target=_sniff_worker,
+                            args=(s, network_name(iface), queue, stop,
+                                  counter, count, timeout, stop_filter,
+                                  kwargs))
+                 for s in socks]
+        self.running = True
+        self.stop_cb = stop.set
+        for p in procs:
+            p.daemon = True
+            p.start()
+        started, results = 0, []
+        while len(results) < workers:
+            try:
+                msg = queue.get(timeout=conf.recv_poll_rate)
+            except KeyboardInterrupt:
+                stop.set()
+                continue
+            except Empty:
+                if not any(p.is_alive() for p in procs):
+                    break
+                continue
+            if msg is None:
+                started += 1
+                if started == workers and started_callback:
+                    started_callback()
+            else:
+                results.append(msg)
+        for p in procs:
+            p.join()
+        for s in socks:
+            s.close()
+        self.running = False
+        for res in results:
+            if isinstance(res, Exception):
+                raise res
+        pkts = sorted((pkt for res in results if res for pkt in res),
+                      key=lambda pkt: pkt.time)
+        if count:
+            pkts = pkts[:count]
+        self.results = PacketList(pkts, "Sniffed")
+
     def start(self):
         """Starts AsyncSniffer in async mode"""
         self._setup_thread()
@@ -1043,6 +1574,70 @@ class AsyncSniffer(object):
             self.thread.join(*args, **kwargs)
 
 
+def _sniff_worker(sock, label, queue, stop, counter, count, timeout,
+                  stop_filter, kwargs):
+    """Internal function run by the processes of sniff(workers=N)"""
+    def _stop_filter(pkt):
+        if count:
+            with counter.get_lock():
+                counter.value += 1
+                if counter.value >= count:
+                    stop.set()
+        if stop_filter and stop_filter(pkt):
+            stop.set()
+        return stop.is_set()
+
+    started = Event()
+
+    def _started_callback():
+        started.set()
+        queue.put(None)
+
+    sniffer = AsyncSniffer()
+    errors = []
+
+    def _run():
+        try:
+            sniffer._run(opened_socket={sock: label},
+                         stop_filter=_stop_filter,
+                         started_callback=_started_callback, **kwargs)
+        except Exception as ex:
+            errors.append(ex)
+
+    thread = Thread(target=_run)
+    thread.setDaemon(True)
+    result = None
+    try:
+        thread.start()
+        # The sniffer may fail before it starts: stop is checked, so that
+        # the parent can always stop the workers
+        while not started.wait(conf.recv_poll_rate):
+            if stop.is_set() or not thread.is_alive():
+                break
+        stop_time = None if timeout is None else time.time() + timeout
+        while thread.is_alive() and not stop.wait(conf.recv_poll_rate):
+            if stop_time is not None and time.time() >= stop_time:
+                break
+    except KeyboardInterrupt:
+        pass
+    except Exception as ex:
+        result = ex
+    finally:
+        stop.set()
+        while thread.is_alive():
+            # The sniffer may still be starting
+            if sniffer.running:
+                try:
+                    sniffer.stop(join=False)
+                except Scapy_Exception:
+                    # Already stopped by _stop_filter
+                    pass
+            thread.join(conf.recv_poll_rate)
+        if result is None:
+            result = errors[0] if errors else sniffer.results
+        queue.put(result)
+
+
 @conf.commands.register
 def sniff(*args, **kwargs):
     sniffer = AsyncSniffer()
@@ -7,9 +7,10 @@
 Sessions: decode flow of packets when sniffing
 """
 
-from collections import defaultdict
-from scapy.compat import raw
+from collections import defaultdict, OrderedDict
+import bisect
 from scapy.config import conf
+from scapy.modules import six
 from scapy.packet import NoPayload, Packet
 from scapy.plist import PacketList
 
@@ -19,9 +20,11 @@ from scapy.compat import (
     Callable,
     DefaultDict,
     Dict,
+    Iterator,
     List,
     Optional,
     Tuple,
+    Union,
     cast
 )
 
@@ -110,44 +113,247 @@ class DefaultSession(object):
                 print(result)
 
 
+class FlowTable(object):
+    """A table of flows, that evicts the flows that are idle or too old,
+    and the least recently used ones when it is full.
+
+    Flows are created by ``factory()`` when they are first used. Times are
+    those of the packets (``pkt.time``): reading a capture file expires
+    the flows as sniffing it live would.
+
+    :param factory: a function that returns a new flow
+    :param max_flows: the maximal number of flows
+    :param idle_timeout: evicts the flows unused for this time (in s)
+    :param active_timeout: evicts the flows created this time ago (in s)
+    :param max_memory: the maximal total size of the flows (in bytes), as
+        accounted with account()
+    :param on_evict: a function called with (key, flow, reason) for each
+        evicted flow. reason is "idle", "active", "flows" or "memory"
+    """
+
+    def __init__(self,
+                 factory,  # type: Callable[[], Any]
+                 max_flows=None,  # type: Optional[int]
+                 idle_timeout=None,  # type: Optional[float]
+                 active_timeout=None,  # type: Optional[float]
+                 max_memory=None,  # type: Optional[int]
+                 on_evict=None,  # type: Optional[Callable[[Any, Any, str], Any]]  # noqa: E501
+                 ):
+        # type: (...) -> None
+        self.factory = factory
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_memory = max_memory
+        self.on_evict = on_evict
+        # key: [flow, creation time, last use time, size], least recently
+        # used first
+        self.flows = OrderedDict()  # type: OrderedDict[Any, List[Any]]
+        # key: creation time, oldest first
+        self.created = OrderedDict()  # type: OrderedDict[Any, Optional[float]]  # noqa: E501
+        self.memory = 0
+        self.now = None  # type: Optional[float]
+        # The number of evicted flows, by reason
+        self.evictions = defaultdict(int)  # type: DefaultDict[str, int]
+
+    def get(self, key, now=None):
+        # type: (Any, Optional[float]) -> Any
+        """Returns the flow of key, created if needed, and marks it as used
+        at time now (default: the last time seen)
+        """
+        if now is None:
+            now = self.now
+        else:
+            self.expire(now)
+        entry = self.flows.pop(key, None)
+        if entry is None:
+            entry = [self.factory(), now, now, 0]
+            self.created[key] = now
+            self.flows[key] = entry
+            if self.max_flows is not None:
+                while len(self.flows) > self.max_flows:
+                    self._evict(next(iter(self.flows)), "flows")
+        else:
+            if now is not None:
+                entry[2] = now
+            self.flows[key] = entry
+        return entry[0]
+
+    def account(self, key, size):
+        # type: (Any, int) -> None
+        """Adds size bytes (which may be negative) to the size of the flow
+        of key. Evicts the least recently used flows if there is too much
+        """
+        entry = self.flows.get(key)
+        if entry is None:
+            return
+        entry[3] += size
+        self.memory += size
+        if self.max_memory is not None:
+            while self.memory > self.max_memory and self.flows:
+                self._evict(next(iter(self.flows)), "memory")
+
+    def expire(self, now):
+        # type: (float) -> None
+        """Evicts the flows that timed out at time now"""
+        now = float(now)
+        self.now = now
+        if self.idle_timeout is not None:
+            while self.flows:
+                key, entry = next(six.iteritems(self.flows))
+                if entry[2] is None or entry[2] + self.idle_timeout > now:
+                    break
+                self._evict(key, "idle")
+        if self.active_timeout is not None:
+            while self.created:
+                key, created = next(six.iteritems(self.created))
+                if created is None or created + self.active_timeout > now:
+                    break
+                self._evict(key, "active")
+
+    def _evict(self, key, reason):
+        # type: (Any, str) -> None
+        flow = self.pop(key)
+        self.evictions[reason] += 1
+        if self.on_evict is not None:
+            self.on_evict(key, flow, reason)
+
+    def pop(self, key, default=None):
+        # type: (Any, Any) -> Any
+        """Removes the flow of key, and returns it"""
+        entry = self.flows.pop(key, None)
+        if entry is None:
+            return default
+        del self.created[key]
+        self.memory -= entry[3]
+        return entry[0]
+
+    def clear(self):
+        # type: () -> None
+        self.flows.clear()
+        self.created.clear()
+        self.memory = 0
+
+    def __getitem__(self, key):
+        # type: (Any) -> Any
+        return self.get(key)
+
+    def __delitem__(self, key):
+        # type: (Any) -> None
+        if key not in self.flows:
+            raise KeyError(key)
+        self.pop(key)
+
+    def __contains__(self, key):
+        # type: (Any) -> bool
+        return key in self.flows
+
+    def __iter__(self):
+        # type: () -> Iterator[Any]
+        return iter(list(self.flows))
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.flows)
+
+
 class IPSession(DefaultSession):
     """Defragment IP packets 'on-the-flow'.
 
     Usage:
     >>> sniff(session=IPSession)
+
+    The fragments can arrive in any order. The incomplete packets are
+    dropped after a while, or when there are too many of them: see
+    FlowTable. The limits can be changed with a ``fragments_limits`` dict,
+    given to sniff() in ``session_kwargs``. The oldest incomplete packets
+    of a source are also dropped when its fragments use more than
+    ``max_source_memory`` bytes (the eviction reason is then "source").
+
+    The invalid packets (overlapping fragments, too big...) are dropped,
+    as well as their next fragments.
     """
 
+    #: The default limits of the table of fragments (see FlowTable)
+    fragments_limits = {
+        "max_flows": 4096,
+        "idle_timeout": 30,
+        "max_memory": 16 << 20,
+    }  # type: Dict[str, Any]
+    #: The maximal size of the fragments of a source (in bytes), or None
+    max_source_memory = 4 << 20  # type: Optional[int]
+
     def __init__(self, *args, **kwargs):
         # type: (*Any, **Any) -> None
+        from scapy.layers.inet import _DefragBuffer
+        limits = dict(self.fragments_limits,
+                      **(kwargs.pop("fragments_limits", None) or {}))
+        self.max_source_memory = kwargs.pop("max_source_memory",
+                                            self.max_source_memory)
         DefaultSession.__init__(self, *args, **kwargs)
-        self.fragments = defaultdict(list)  # type: DefaultDict[Tuple[Any, ...], List[Packet]]  # noqa: E501
+        self._on_evict = limits.pop("on_evict", None)
+        self.fragments = FlowTable(_DefragBuffer, on_evict=self._evicted,
+                                   **limits)
+        #: The size of the fragments stored, by source
+        self.sources = defaultdict(int)  # type: DefaultDict[str, int]
+        # The keys of the packets of each source, least recently used first
+        self._source_keys = {}  # type: Dict[str, OrderedDict[Any, None]]
+
+    def _forget(self, key, flow):
+        # type: (Any, Any) -> None
+        """Removes the packet of key, evicted or reassembled, from the
+        fragments of its source"""
+        src = key[1]
+        self.sources[src] -= flow.stored
+        if self.sources[src] <= 0:
+            del self.sources[src]
+        keys = self._source_keys.get(src)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self._source_keys[src]
+
+    def _evicted(self, key, flow, reason):
+        # type: (Any, Any, str) -> None
+        self._forget(key, flow)
+        if self._on_evict is not None:
+            self._on_evict(key, flow, reason)
+
+    def _account(self, key, size):
+        # type: (Any, int) -> None
+        """Adds size bytes to the fragments of key, and evicts the least
+        recently used ones of its source if it uses too much memory
+        """
+        src = key[1]
+        keys = self._source_keys.setdefault(src, OrderedDict())
+        keys.pop(key, None)
+        keys[key] = None
+        self.sources[src] += size
+        self.fragments.account(key, size)
+        while self.max_source_memory is not None and \
+                self.sources.get(src, 0) > self.max_source_memory:
+            self.fragments._evict(next(iter(self._source_keys[src])),
+                                  "source")
 
     def _ip_process_packet(self, packet):
         # type: (Packet) -> Optional[Packet]
-        from scapy.layers.inet import _defrag_list, IP
+        from scapy.layers.inet import IP
         if IP not in packet:
             return packet
         ip = packet[IP]
-        packet._defrag_pos = 0
-        if ip.frag != 0 or ip.flags.MF:
-            uniq = (ip.id, ip.src, ip.dst, ip.proto)
-            self.fragments[uniq].append(packet)
-            if not ip.flags.MF:  # end of frag
-                try:
-                    if self.fragments[uniq][0].frag == 0:
-                        # Has first fragment (otherwise ignore)
-                        defrag = []  # type: List[Packet]
-                        _defrag_list(self.fragments[uniq], defrag, [])
-                        defragmented_packet = defrag[0]
-                        defragmented_packet = defragmented_packet.__class__(
-                            raw(defragmented_packet)
-                        )
-                        return defragmented_packet
-                finally:
-                    del self.fragments[uniq]
-            return None
-        else:
+        if ip.frag == 0 and not ip.flags.MF:
             return packet
+        uniq = (ip.id, ip.src, ip.dst, ip.proto)
+        datagram = self.fragments.get(uniq, packet.time)
+        size = datagram.stored
+        datagram.add(packet)
+        # An invalid datagram is kept empty, to drop its next fragments
+        self._account(uniq, datagram.stored - size)
+        if datagram.complete():
+            if self.fragments.pop(uniq) is not None:
+                self._forget(uniq, datagram)
+            return datagram.build()
+        return None
 
     def on_packet_received(self, pkt):
         # type: (Optional[Packet]) -> None
@@ -159,6 +365,29 @@ class IPSession(DefaultSession):
         )
 
 
+def flow_key(l4, bidirectional=False):
+    # type: (Packet, bool) -> Tuple[Any, Any, Any, Any]
+    """Returns the (src, sport, dst, dport) tuple that identifies the flow
+    of a transport layer (TCP, UDP...), from its fields and those of the
+    IP or IPv6 layer below it (under the IPv6 extension headers, if any).
+
+    :param l4: the transport layer, e.g. ``pkt[TCP]``
+    :param bidirectional: if True, both directions of a connection have
+        the same key: the lowest endpoint comes first
+    """
+    ip = l4.underlayer
+    while ip is not None and "src" not in ip.fieldtype:
+        ip = ip.underlayer
+    if ip is None:
+        src = dst = None
+    else:
+        src, dst = ip.src, ip.dst
+    sport, dport = l4.sport, l4.dport
+    if bidirectional and (dst, dport) < (src, sport):
+        return (dst, dport, src, sport)
+    return (src, sport, dst, dport)
+
+
 class StringBuffer(object):
     """StringBuffer is an object used to re-order data received during
     a TCP transmission.
@@ -167,53 +396,126 @@ class StringBuffer(object):
     (relatively to the first sequence number) the index of the data contained
     in the fragment.
 
-    If a TCP fragment is missed, this class will fill the missing space with
-    zeros.
+    The fragments are stored as a sorted list of segments, merged when
+    they touch. Fragments can arrive out of order and overlap: the data
+    received first is kept. The missing ranges are reported by holes(),
+    and filled with zeros when the buffer is converted to bytes.
+
+    :param max_size: the maximal size of the buffer, or None
     """
-    def __init__(self):
-        # type: () -> None
-        self.content = bytearray(b"")
-        self.content_len = 0
-        self.incomplete = []  # type: List[Tuple[int, int]]
+    def __init__(self, max_size=None):
+        # type: (Optional[int]) -> None
+        self.max_size = max_size
+        # The offset of the first byte of the buffer (0 is seq 1)
+        self.base = 0
+        # The segments: their boundaries, and their data as chunks
+        self.starts = []  # type: List[int]
+        self.ends = []  # type: List[int]
+        self.chunks = []  # type: List[List[bytes]]
+        self.stored = 0
 
     def append(self, data, seq):
-        # type: (bytes, int) -> None
-        data_len = len(data)
-        seq = seq - 1
-        if seq + data_len > self.content_len:
-            self.content += b"\x00" * (seq - self.content_len + data_len)
-            # If data was missing, mark it.
-            self.incomplete.append((self.content_len, seq))
-            self.content_len = seq + data_len
-            assert len(self.content) == self.content_len
-        # XXX removes empty space marker.
-        # for ifrag in self.incomplete:
-        #     if [???]:
-        #         self.incomplete.remove([???])
-        memoryview(self.content)[seq:seq + data_len] = data  # type: ignore
+        # type: (bytes, int) -> bool
+        """Adds data, that starts at seq. Returns False if it does not fit
+        in max_size (and then it is not stored)
+        """
+        start = seq - 1
+        end = start + len(data)
+        if start < self.base:
+            # Already released
+            data = data[self.base - start:]
+            start = self.base
+        if end <= start:
+            return True
+        if self.max_size is not None and end - self.base > self.max_size:
+            return False
+        starts, ends = self.starts, self.ends
+        # The segments that overlap or touch the new data are merged
+        first = last = bisect.bisect_left(ends, start)
+        pieces = []  # type: List[bytes]
+        pos = start
+        while last < len(starts) and starts[last] <= end:
+            if starts[last] > pos:
+                pieces.append(data[pos - start:starts[last] - start])
+            pieces.extend(self.chunks[last])
+            pos = max(pos, ends[last])
+            last += 1
+        if pos < end:
+            pieces.append(data[pos - start:])
+        if first < last:
+            start = min(start, starts[first])
+            end = max(end, ends[last - 1])
+            self.stored -= sum(ends[first:last]) - sum(starts[first:last])
+        starts[first:last] = [start]
+        ends[first:last] = [end]
+        self.chunks[first:last] = [pieces]
+        self.stored += end - start
+        return True
+
+    def holes(self):
+        # type: () -> List[Tuple[int, int]]
+        """Returns the missing ranges, as (seq, length) tuples"""
+        res = []
+        pos = self.base
+        for start, end in zip(self.starts, self.ends):
+            if start > pos:
+                res.append((pos + 1, start - pos))
+            pos = end
+        return res
 
     def full(self):
         # type: () -> bool
-        # Should only be true when all missing data was filled up,
-        # (or there never was missing data)
-        return True  # XXX
+        """True when no data is missing before the end of the buffer"""
+        return not self.starts or (
+            len(self.starts) == 1 and self.starts[0] == self.base
+        )
+
+    def release(self, length):
+        # type: (int) -> None
+        """Drops the first length bytes of the buffer, that were consumed"""
+        self.base += length
+        while self.starts and self.ends[0] <= self.base:
+            self.stored -= self.ends[0] - self.starts[0]
+            del self.starts[0], self.ends[0], self.chunks[0]
+        if self.starts and self.starts[0] < self.base:
+            data = b"".join(self.chunks[0])[self.base - self.starts[0]:]
+            self.stored -= self.base - self.starts[0]
+            self.starts[0] = self.base
+            self.chunks[0] = [data]
+
+    def shift(self, length):
+        # type: (int) -> None
+        """Moves the data length bytes further, leaving room for the data
+        that precedes it"""
+        self.starts = [start + length for start in self.starts]
+        self.ends = [end + length for end in self.ends]
 
     def clear(self):
         # type: () -> None
-        self.__init__()  # type: ignore
+        self.__init__(self.max_size)  # type: ignore
 
     def __bool__(self):
         # type: () -> bool
-        return bool(self.content_len)
+        return bool(self.starts)
     __nonzero__ = __bool__
 
     def __len__(self):
         # type: () -> int
-        return self.content_len
+        return self.ends[-1] - self.base if self.ends else 0
 
     def __bytes__(self):
         # type: () -> bytes
-        return bytes(self.content)
+        res = []
+        pos = self.base
+        for i, (start, end) in enumerate(zip(self.starts, self.ends)):
+            if start > pos:
+                res.append(b"\x00" * (start - pos))
+            if len(self.chunks[i]) > 1:
+                # Join the chunks once
+                self.chunks[i] = [b"".join(self.chunks[i])]
+            res.extend(self.chunks[i])
+            pos = end
+        return b"".join(res)
 
     def __str__(self):
         # type: () -> str
@@ -232,41 +534,160 @@ class TCPSession(IPSession):
             # metadata = empty dictionary, that can be used to store data
             [...]
             # If the packet is available, return it. Otherwise don't.
-            # Whenever you return a packet, the buffer will be discarded.
+            # Whenever you return a packet, the buffer will be discarded,
+            # unless metadata["tcp_release"] is set to the number of bytes
+            # consumed: tcp_reassemble is then called again on the bytes
+            # that follow (e.g. pipelined requests).
             return pkt
             # Otherwise, maybe store stuff in metadata, and return None,
             # as you need additional data.
+            # To only get the next bytes at the next call, set
+            # metadata["tcp_release"] to the number of bytes consumed.
             return None
 
+    tcp_reassemble is only called when no data is missing: the segments
+    can arrive out of order, but a PDU that misses a segment is never
+    returned (see StringBuffer.holes()). The missing data is given up
+    when the stream ends or is evicted, or when more than reorder_window
+    bytes were received after it: metadata["tcp_resync"] is then set, as
+    the data that follows may start in the middle of a PDU. tcp_reassemble
+    should then look for the start of the next PDU, and delete this key.
+
     For more details and a real example, see:
     https://scapy.readthedocs.io/en/latest/usage.html#how-to-use-tcpsession-to-defragment-tcp-packets
 
     :param app: Whether the socket is on application layer = has no TCP
                 layer. This is used for instance if you are using a native
                 TCP socket. Default to False
+    :param streams_limits: a dict that overrides the limits of the table
+                of the streams being reassembled (see FlowTable)
+    :param max_stream_size: the maximal size of the data buffered for a
+                stream. Streams that exceed it are not reassembled
+    :param reorder_window: how much data can be received after missing
+                data, before it is given up
     """
 
-    fmt = ('TCP {IP:%IP.src%}{IPv6:%IPv6.src%}:%r,TCP.sport% > ' +
-           '{IP:%IP.dst%}{IPv6:%IPv6.dst%}:%r,TCP.dport%')
+    #: The default limits of the table of streams (see FlowTable)
+    streams_limits = {
+        "max_flows": 65536,
+        "idle_timeout": 600,
+        "max_memory": 256 << 20,
+    }  # type: Dict[str, Any]
+    #: The default maximal size of the data buffered for a stream
+    max_stream_size = 16 << 20  # type: Optional[int]
+    #: The default amount of data received after missing data, before it
+    #: is given up
+    reorder_window = 256 << 10
 
     def __init__(self, app=False, *args, **kwargs):
         # type: (bool, *Any, **Any) -> None
+        limits = dict(self.streams_limits,
+                      **(kwargs.pop("streams_limits", None) or {}))
+        max_stream_size = kwargs.pop("max_stream_size", self.max_stream_size)
+        self.reorder_window = kwargs.pop("reorder_window",
+                                         self.reorder_window)
         super(TCPSession, self).__init__(*args, **kwargs)
         self.app = app
+        self.max_stream_size = max_stream_size
         if app:
             self.data = b""
             self.metadata = {}  # type: Dict[str, Any]
         else:
             # The StringBuffer() is used to build a global
             # string from fragments and their seq nulber
-            self.tcp_frags = defaultdict(
-                lambda: (StringBuffer(), {})
-            )  # type: DefaultDict[str, Tuple[StringBuffer, Dict[str, Any]]]
+            self.tcp_frags = FlowTable(
+                lambda: (StringBuffer(max_stream_size), {}),
+                on_evict=self._stream_evicted, **limits
+            )
+
+    @staticmethod
+    def _next_pdu(metadata):
+        # type: (Dict[str, Any]) -> None
+        """Resets the metadata of a stream for its next PDU"""
+        state = dict((k, metadata[k]) for k in ["relative_seq", "pay_class",
+                                                "tcp_reassemble", "tcp_end",
+                                                "tcp_psh", "tcp_last"]
+                     if k in metadata)
+        metadata.clear()
+        metadata.update(state)
+
+    def _reassemble(self, ident, data, metadata, flush=False):
+        # type: (Any, StringBuffer, Dict[str, Any], bool) -> List[Packet]
+        """Returns the PDUs completed by the data of a stream. The missing
+        data is given up if the stream ended, if flush is set, or if too
+        much data was received after it.
+        """
+        tcp_reassemble = metadata["tcp_reassemble"]
+        packets = []  # type: List[Packet]
+        while True:
+            while data.full() and len(data):
+                # Reassemble using all previous packets
+                packet = tcp_reassemble(bytes(data), metadata)
+                release = metadata.pop("tcp_release", None)
+                if packet and release is None:
+                    release = len(data)
+                if release:
+                    # Drop the consumed data. The stream is still followed,
+                    # to put the next segments in order, and to ignore the
+                    # retransmitted ones
+                    size = data.stored
+                    data.release(release)
+                    self.tcp_frags.account(ident, data.stored - size)
+                if not packet:
+                    break
+                packets.append(packet)
+                # The data that follows (e.g. pipelined requests) starts a
+                # new packet
+                self._next_pdu(metadata)
+                if not release:
+                    break
+            holes = data.holes()
+            if not holes:
+                return packets
+            seq, length = holes[0]
+            if not (flush or metadata.get("tcp_end") or
+                    data.base + len(data) - (seq - 1 + length) >
+                    self.reorder_window):
+                return packets
+            # Give up the missing data, and the PDU it belongs to
+            size = data.stored
+            data.release(seq - 1 + length - data.base)
+            self.tcp_frags.account(ident, data.stored - size)
+            self._next_pdu(metadata)
+            metadata["tcp_resync"] = True
+
+    @staticmethod
+    def _stack(pkt, packets):
+        # type: (Packet, List[Packet]) -> Union[Packet, List[Packet]]
+        """Stacks the reassembled packets on top of the frames of pkt"""
+        from scapy.layers.inet import IP, TCP
+        pkt[TCP].remove_payload()
+        if IP in pkt:
+            pkt[IP].len = None
+            pkt[IP].chksum = None
+        if len(packets) == 1:
+            return pkt / packets[0]
+        return [pkt.copy() / packet for packet in packets]
+
+    def _stream_evicted(self, key, flow, reason):
+        # type: (Any, Tuple[StringBuffer, Dict[str, Any]], str) -> None
+        """Returns the PDUs left in an evicted stream"""
+        data, metadata = flow
+        if not data or "tcp_last" not in metadata:
+            return
+        packets = self._reassemble(key, data, metadata, flush=True)
+        if packets:
+            res = self._stack(metadata["tcp_last"].copy(), packets)
+            for pkt in res if isinstance(res, list) else [res]:
+                DefaultSession.on_packet_received(self, pkt)
 
     def _process_packet(self, pkt):
-        # type: (Packet) -> Optional[Packet]
+        # type: (Packet) -> Union[Packet, List[Packet], None]
         """Process each packet: matches the TCP seq/ack numbers
         to follow the TCP streams, and orders the fragments.
+
+        Returns the reassembled packet, or a list of packets if the data
+        received completes several of them.
         """
         if self.app:
             # Special mode: Application layer. Use on top of TCP
@@ -276,70 +697,98 @@ class TCPSession(IPSession):
                 # when a packet ends.
                 return pkt
             self.data += bytes(pkt)
-            pkt = pay_class.tcp_reassemble(self.data, self.metadata)
-            if pkt:
-                self.data = b""
+            packets = []  # type: List[Packet]
+            while self.data:
+                packet = pay_class.tcp_reassemble(self.data, self.metadata)
+                release = self.metadata.pop("tcp_release", None)
+                if packet and release is None:
+                    release = len(self.data)
+                if release:
+                    self.data = self.data[release:]
+                if not packet:
+                    break
+                packets.append(packet)
                 self.metadata = {}
-                return pkt
-            return None
+                if not release:
+                    break
+            if len(packets) > 1:
+                return packets
+            return packets[0] if packets else None
 
-        from scapy.layers.inet import IP, TCP
+        from scapy.layers.inet import TCP
         if not pkt or TCP not in pkt:
             return pkt
-        pay = pkt[TCP].payload
+        tcp = pkt[TCP]
+        # Match packets by a unique TCP identifier
+        ident = flow_key(tcp)
+        seq = tcp.seq
+        pay = tcp.payload
         if isinstance(pay, (NoPayload, conf.padding_layer)):
+            if tcp.flags.S:
+                # A new stream: its data starts right after the SYN
+                self.tcp_frags.pop(ident)
+                self.tcp_frags.get(ident, pkt.time)[1]["relative_seq"] = seq
+            elif (tcp.flags.F or tcp.flags.R) and ident in self.tcp_frags:
+                # The end of a stream: the missing data is given up
+                data, metadata = self.tcp_frags.get(ident, pkt.time)
+                if "tcp_reassemble" not in metadata:
+                    # No data was received
+                    self.tcp_frags.pop(ident)
+                    return pkt
+                metadata["tcp_end"] = True
+                packets = self._reassemble(ident, data, metadata)
+                if not data:
+                    self.tcp_frags.pop(ident)
+                if packets:
+                    return self._stack(pkt, packets)
             return pkt
         new_data = pay.original
-        # Match packets by a uniqute TCP identifier
-        seq = pkt[TCP].seq
-        ident = pkt.sprintf(self.fmt)
-        data, metadata = self.tcp_frags[ident]
+        data, metadata = self.tcp_frags.get(ident, pkt.time)
         # Let's guess which class is going to be used
         if "pay_class" not in metadata:
             pay_class = pay.__class__
-            if hasattr(pay_class, "tcp_reassemble"):
-                tcp_reassemble = pay_class.tcp_reassemble
-            else:
+            if not hasattr(pay_class, "tcp_reassemble"):
                 # We can't know for sure when a packet ends.
                 # Ignore.
                 return pkt
             metadata["pay_class"] = pay_class
-            metadata["tcp_reassemble"] = tcp_reassemble
-        else:
-            tcp_reassemble = metadata["tcp_reassemble"]
+            metadata["tcp_reassemble"] = pay_class.tcp_reassemble
         # Get a relative sequence number for a storage purpose
         relative_seq = metadata.get("relative_seq", None)
         if relative_seq is None:
             relative_seq = metadata["relative_seq"] = seq - 1
         seq = seq - relative_seq
+        if seq < 1 and not data.base:
+            # Out of order: this data precedes the first one received
+            data.shift(1 - seq)
+            metadata["relative_seq"] -= 1 - seq
+            seq = 1
         # Add the data to the buffer
         # Note that this take care of retransmission packets.
-        data.append(new_data, seq)
+        size = data.stored
+        if not data.append(new_data, seq):
+            # Too much data: give up this stream
+            self.tcp_frags.pop(ident)
+            return pkt
+        self.tcp_frags.account(ident, data.stored - size)
         # Check TCP FIN or TCP RESET
-        if pkt[TCP].flags.F or pkt[TCP].flags.R:
+        if tcp.flags.F or tcp.flags.R:
             metadata["tcp_end"] = True
 
         # In case any app layer protocol requires it,
         # allow the parser to inspect TCP PSH flag
-        if pkt[TCP].flags.P:
+        if tcp.flags.P:
             metadata["tcp_psh"] = True
-        # XXX TODO: check that no empty space is missing in the buffer.
-        # XXX Currently, if a TCP fragment was missing, we won't notice it.
-        packet = None  # type: Optional[Packet]
-        if data.full():
-            # Reassemble using all previous packets
-            packet = tcp_reassemble(bytes(data), metadata)
-        # Stack the result on top of the previous frames
-        if packet:
-            data.clear()
-            metadata.clear()
-            del self.tcp_frags[ident]
-            pay.underlayer.remove_payload()
-            if IP in pkt:
-                pkt[IP].len = None
-                pkt[IP].chksum = None
-            return pkt / packet
-        return None
+        # Kept to return the PDUs left when the stream is evicted
+        metadata["tcp_last"] = pkt
+        packets = self._reassemble(ident, data, metadata)
+        if not packets:
+            return None
+        if metadata.get("tcp_end"):
+            self.tcp_frags.pop(ident)
+        metadata.pop("tcp_psh", None)
+        # Stack the results on top of the previous frames
+        return self._stack(pkt, packets)
 
     def on_packet_received(self, pkt):
         # type: (Optional[Packet]) -> None
@@ -93,6 +93,14 @@ class SuperSocket(six.with_metaclass(_SuperSocket_metaclass)):
             pkt, ancdata, flags, sa_ll = sock.recvmsg(x, flags_len)
             if not pkt:
                 return pkt, sa_ll, timestamp
+            pkt, timestamp = self._process_ancdata(pkt, ancdata)
+            return pkt, sa_ll, timestamp
+
+        def _process_ancdata(self, pkt, ancdata):
+            """Internal function to process the ancillary data of a
+            received packet. Returns a tuple (pkt, timestamp)
+            """
+            timestamp = None
             for cmsg_lvl, cmsg_type, cmsg_data in ancdata:
                 # Check available ancillary data
                 if (cmsg_lvl == SOL_PACKET and cmsg_type == PACKET_AUXDATA):
@@ -104,7 +112,7 @@ class SuperSocket(six.with_metaclass(_SuperSocket_metaclass)):
                         #       can return a truncated message. A ValueError
                         #       exception likely indicates that Auxiliary
                         #       Data is not supported by the Linux kernel.
-                        return pkt, sa_ll, timestamp
+                        return pkt, timestamp
                     if auxdata.tp_vlan_tci != 0 or \
                             auxdata.tp_status & TP_STATUS_VLAN_VALID:
                         # Insert VLAN tag
@@ -125,7 +133,7 @@ class SuperSocket(six.with_metaclass(_SuperSocket_metaclass)):
                         log_runtime.warning("Unknown timespec format.. ?!")
                         continue
                     timestamp = tmp[0] + tmp[1] * 1e-9
-            return pkt, sa_ll, timestamp
+            return pkt, timestamp
 
     def recv_raw(self, x=MTU):
         """Returns a tuple containing (cls, pkt_data, time)"""
@@ -133,6 +141,10 @@ class SuperSocket(six.with_metaclass(_SuperSocket_metaclass)):
 
     def recv(self, x=MTU):
         cls, val, ts = self.recv_raw(x)
+        return self._dissect(cls, val, ts)
+
+    def _dissect(self, cls, val, ts):
+        """Internal function to build the Packet returned by recv()"""
         if not val or not cls:
             return
         try:
@@ -16,6 +16,8 @@ import array
 import collections
 import difflib
 import gzip
+import itertools
+import mmap
 import os
 import random
 import re
@@ -63,6 +65,11 @@ if TYPE_CHECKING:
 
 _UniPacketList = Union[List["Packet"], "Packet", "PacketList"]
 _ByteStream = Union[IO[bytes], gzip.GzipFile]
+# (class, pkt_data, time, wirelen), as yielded by PcapReader._read_records
+_PcapRecord = Tuple[Type["Packet"], bytes, Any, int]
+
+# Typecode of 64 bits signed arrays
+_INT64 = "q" if six.PY3 else "l"
 
 ###########
 #  Tools  #
@@ -479,6 +486,26 @@ def checksum(pkt):
     return checksum_endian_transform(s) & 0xffff
 
 
+def checksum_update(chksum, old, new):
+    # type: (int, bytes, bytes) -> int
+    """Incrementally updates an Internet checksum (RFC 1624, eqn. 3)
+
+    :param chksum: the checksum of some data
+    :param old: bytes removed from the data
+    :param new: bytes added to the data, in place of old
+    :return: the checksum of the updated data
+
+    old and new must have even lengths, and start at even offsets.
+    """
+    n_old, n_new = len(old) // 2, len(new) // 2
+    s = ((~chksum & 0xffff) + 0xffff * n_old -
+         sum(struct.unpack("!%dH" % n_old, old)) +
+         sum(struct.unpack("!%dH" % n_new, new)))
+    while s >> 16:
+        s = (s & 0xffff) + (s >> 16)
+    return ~s & 0xffff
+
+
 def _fletcher16(charbuf):
     # type: (bytes) -> Tuple[int, int]
     # This is based on the GPLed C implementation in Zebra <http://www.zebra.org/>  # noqa: E501
@@ -1087,18 +1114,26 @@ def wrpcap(filename,  # type: Union[IO[bytes], str]
 
 
 @conf.commands.register
-def rdpcap(filename, count=-1):
-    # type: (Union[IO[bytes], str], int) -> PacketList
+def rdpcap(filename,  # type: Union[IO[bytes], str]
+           count=-1,  # type: int
+           lfilter=None,  # type: Optional[Callable[[Packet], bool]]
+           ):
+    # type: (...) -> PacketList
     """Read a pcap or pcapng file and return a packet list
 
     :param count: read only <count> packets
+    :param lfilter: only return the packets for which lfilter(packet) is
+        true. To call it in several processes, see ParallelPcapReader
     """
     # Rant: Our complicated use of metaclasses and especially the
     # __call__ function is, of course, not supported by MyPy.
     # One day we should simplify this mess and use a much simpler
     # layout that will actually be supported and properly dissected.
     with PcapReader(filename) as fdesc:  # type: ignore
-        return fdesc.read_all(count=count)
+        pkts = fdesc.read_all(count=count)
+    if lfilter is not None:
+        pkts.res = [p for p in pkts.res if lfilter(p)]
+    return pkts
 
 
 class PcapReader_metaclass(type):
@@ -1173,6 +1208,8 @@ class RawPcapReader:
     nonblocking_socket = True
     PacketMetadata = collections.namedtuple("PacketMetadata",
                                             ["sec", "usec", "wirelen", "caplen"])  # noqa: E501
+    #: size of the blocks read by the buffered readers (see read_all())
+    buffer_size = 4 * 1024 * 1024
 
     def __init__(self, filename, fdesc, magic):
         # type: (str, _ByteStream, bytes) -> None
@@ -1273,6 +1310,92 @@ class RawPcapReader:
             res.append(p)
         return res
 
+    def _read_chunks(self, count=-1, chunk_size=1024):
+        # type: (int, int) -> Iterator[List[Tuple[bytes, Any]]]
+        """yield lists of at most chunk_size (pkt_data, pkt_metadata)
+        tuples, as returned by _read_packet, until <count> packets were
+        read or the end of the file is reached
+        """
+        if count < 0:
+            return self._read_buffered_chunks(count, chunk_size)
+        try:
+            seekable = self.f.seekable()
+        except (AttributeError, ValueError):
+            seekable = False
+        if seekable:
+            return self._read_buffered_chunks(count, chunk_size)
+        return self._read_packet_chunks(count, chunk_size)
+
+    def _read_buffered_chunks(self, count=-1, chunk_size=1024):
+        # type: (int, int) -> Iterator[List[Tuple[bytes, Any]]]
+        """same as _read_packet_chunks(), but reads the file in blocks
+        of buffer_size bytes and parses the records out of them.
+
+        When <count> packets were read, the unused part of the last block
+        is given back to the file with a relative seek(), so the file
+        must be seekable unless it is read until the end.
+        """
+        unpack_from = struct.Struct(self.endian + "IIII").unpack_from
+        new_metadata = tuple.__new__
+        metadata_cls = RawPcapReader.PacketMetadata
+        buf = b""
+        pos = 0
+        chunk = []  # type: List[Tuple[bytes, Any]]
+        while count != 0:
+            data = self.f.read(self.buffer_size)
+            if not data:
+                if len(buf) - pos >= 16:
+                    # Truncated last record, as _read_packet() does
+                    sec, usec, caplen, wirelen = unpack_from(buf, pos)
+                    chunk.append((
+                        buf[pos + 16:pos + 16 + min(caplen, MTU)],
+                        new_metadata(metadata_cls,
+                                     (sec, usec, wirelen, caplen))
+                    ))
+                buf = b""
+                pos = 0
+                break
+            buf = buf[pos:] + data
+            pos = 0
+            end = len(buf)
+            while count != 0 and pos + 16 <= end:
+                sec, usec, caplen, wirelen = unpack_from(buf, pos)
+                nxt = pos + 16 + caplen
+                if nxt > end:
+                    break
+                chunk.append((
+                    buf[pos + 16:pos + 16 + min(caplen, MTU)],
+                    new_metadata(metadata_cls, (sec, usec, wirelen, caplen))
+                ))
+                pos = nxt
+                count -= 1
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+        if pos < len(buf):
+            self.f.seek(pos - len(buf), 1)
+        if chunk:
+            yield chunk
+
+    def _read_packet_chunks(self, count=-1, chunk_size=1024):
+        # type: (int, int) -> Iterator[List[Tuple[bytes, Any]]]
+        """yield lists of at most chunk_size (pkt_data, pkt_metadata)
+        tuples, calling _read_packet for each packet
+        """
+        while count != 0:
+            n = chunk_size if count < 0 else min(count, chunk_size)
+            chunk = []  # type: List[Tuple[bytes, Any]]
+            try:
+                for _ in range(n):
+                    chunk.append(self._read_packet())
+            except EOFError:
+                count = 0
+            else:
+                if count > 0:
+                    count -= n
+            if chunk:
+                yield chunk
+
     def recv(self, size=MTU):
         # type: (int) -> bytes
         """ Emulate a socket
@@ -1344,6 +1467,35 @@ class PcapReader(RawPcapReader):
         p.wirelen = pkt_info.wirelen
         return p
 
+    def _read_all(self, count=-1):
+        # type: (int) -> List[Packet]
+        """return a list of all packets in the pcap file
+
+        The packets are read in chunks
+        """
+        from scapy.packet import _dissect_frames
+        power = Decimal(10) ** Decimal(-9 if self.nano else -6)
+        res = []  # type: List[Packet]
+        for chunk in self._read_chunks(count):
+            pkts = _dissect_frames(self.LLcls, [s for s, _ in chunk])
+            for p, (_, pkt_info) in zip(pkts, chunk):
+                p.time = EDecimal(pkt_info.sec + power * pkt_info.usec)
+                p.wirelen = pkt_info.wirelen
+                res.append(p)
+        return res
+
+    def _read_records(self, count=-1):
+        # type: (int) -> Iterator[Tuple[Type[Packet], bytes, EDecimal, int]]
+        """yield (class, pkt_data, time, wirelen) tuples without dissecting
+        the packets
+        """
+        power = Decimal(10) ** Decimal(-9 if self.nano else -6)
+        for chunk in self._read_chunks(count):
+            for s, pkt_info in chunk:
+                yield (self.LLcls, s,
+                       EDecimal(pkt_info.sec + power * pkt_info.usec),
+                       pkt_info.wirelen)
+
     def recv(self, size=MTU):
         # type: (int) -> Packet
         return self.read_packet(size=size)
@@ -1371,6 +1523,7 @@ class RawPcapNgReader(RawPcapReader):
             "tsresol": 1000000
         }
         self.blocktypes = {
+            0x0A0D0D0A: self.read_block_shb,
             1: self.read_block_idb,
             2: self.read_block_pkt,
             3: self.read_block_spb,
@@ -1429,6 +1582,10 @@ class RawPcapNgReader(RawPcapReader):
             if res is not None:
                 return res
 
+    def _read_chunks(self, count=-1, chunk_size=1024):
+        # type: (int, int) -> Iterator[List[Tuple[bytes, Any]]]
+        return self._read_packet_chunks(count, chunk_size)
+
     def read_options(self, options):
         # type: (bytes) -> Dict[str, int]
         """Section Header Block"""
@@ -1452,6 +1609,12 @@ class RawPcapNgReader(RawPcapReader):
             options = options[4 + length:]
         return opts
 
+    def read_block_shb(self, block, _):
+        # type: (bytes, int) -> None
+        """Section Header Block"""
+        # Interface IDs are local to a section
+        self.interfaces = []
+
     def read_block_idb(self, block, _):
         # type: (bytes, int) -> None
         """Interface Description Block"""
@@ -1538,14 +1701,480 @@ class PcapNgReader(RawPcapNgReader):
         p.wirelen = wirelen
         return p
 
+    def _read_all(self, count=-1):
+        # type: (int) -> List[Packet]
+        """return a list of all packets in the pcapng file
+
+        The packets are read in chunks
+        """
+        from scapy.packet import _dissect_frames
+        if conf.raw_layer is None:
+            # conf.raw_layer is set on import
+            import scapy.packet  # noqa: F401
+        res = []  # type: List[Packet]
+        for chunk in self._read_chunks(count):
+            for linktype, group in itertools.groupby(
+                    chunk, key=lambda rp: rp[1].linktype):
+                records = list(group)
+                cls = conf.l2types.num2layer.get(linktype, conf.raw_layer)
+                pkts = _dissect_frames(cls, [s for s, _ in records])
+                for p, (_, pkt_info) in zip(pkts, records):
+                    if pkt_info.tshigh is not None:
+                        p.time = EDecimal(
+                            (pkt_info.tshigh << 32) + pkt_info.tslow
+                        ) / pkt_info.tsresol
+                    p.wirelen = pkt_info.wirelen
+                    res.append(p)
+        return res
+
+    def _read_records(self, count=-1):
+        # type: (int) -> Iterator[Tuple[Type[Packet], bytes, Optional[EDecimal], int]]  # noqa: E501
+        """yield (class, pkt_data, time, wirelen) tuples without dissecting
+        the packets
+        """
+        if conf.raw_layer is None:
+            # conf.raw_layer is set on import
+            import scapy.packet  # noqa: F401
+        for chunk in self._read_chunks(count):
+            for s, pkt_info in chunk:
+                cls = conf.l2types.num2layer.get(pkt_info.linktype,
+                                                 conf.raw_layer)
+                if pkt_info.tshigh is None:
+                    pkt_time = None
+                else:
+                    pkt_time = EDecimal(
+                        (pkt_info.tshigh << 32) + pkt_info.tslow
+                    ) / pkt_info.tsresol
+                yield cls, s, pkt_time, pkt_info.wirelen
+
     def recv(self, size=MTU):
         # type: (int) -> Packet
         return self.read_packet()
 
 
+class IndexedPcapReader(object):
+    """Random-access reader for pcap and pcapng files.
+
+    The file is memory-mapped, and the offsets and timestamps of its
+    packets are indexed when it is opened. The index can be saved to a
+    sidecar file, and is then loaded from it the next time the capture is
+    opened, as long as the capture did not change.
+
+    Packets are accessed by index (``reader[i]``, ``reader[i:j]``) or by
+    time (``reader.between(start, stop)``), and are dissected as by
+    PcapReader. Accesses are serialized, so a reader can be shared between
+    threads; processes should open their own reader, sharing the sidecar
+    index.
+
+    ex:
+        >>> with IndexedPcapReader("big.pcap", index_file="big.pcap.idx") as r:  # noqa: E501
+        ...     r[-1].show()
+        ...     r.between(1600000000, 1600000060).summary()
+    """
+
+    INDEX_MAGIC = b"SCPYIDX" + (b"l" if sys.byteorder == "little" else b"b")
+
+    def __init__(self,
+                 filename,  # type: str
+                 index_file=None,  # type: Optional[str]
+                 ):
+        # type: (...) -> None
+        """
+        :param filename: the pcap or pcapng file to read
+        :param index_file: if not None, the index is loaded from this
+                           file if it is up to date, and saved to it
+                           otherwise
+        """
+        self.filename = filename
+        self.fdesc = open(filename, "rb")
+        if self.fdesc.read(2) == b"\x1f\x8b":
+            self.fdesc.close()
+            raise Scapy_Exception("Compressed captures cannot be indexed")
+        self.mm = mmap.mmap(self.fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+        self.reader = PcapReader(self.mm)  # type: Any
+        self.reader.filename = filename
+        self.is_pcapng = isinstance(self.reader, RawPcapNgReader)
+        self.lock = threading.Lock()
+        # Offset of each packet record, and its timestamp in nanoseconds
+        self.offsets = array.array(_INT64)
+        self.times = array.array(_INT64)
+        # pcapng only: the interfaces of each section, and the section of
+        # each packet
+        self.sections = []  # type: List[List[Tuple[int, int, int]]]
+        self.section_ids = array.array("i")
+        if index_file is None or not self.load_index(index_file):
+            self.build_index()
+            if index_file is not None:
+                self.save_index(index_file)
+
+    def _stamp(self):
+        # type: () -> Tuple[int, int]
+        """Identifies the current version of the capture"""
+        st = os.fstat(self.fdesc.fileno())
+        return st.st_size, int(st.st_mtime * 1000000)
+
+    def build_index(self):
+        # type: () -> None
+        """Reads the whole capture, and indexes its packets"""
+        reader = self.reader
+        self.mm.seek(0 if self.is_pcapng else 24)
+        offsets = array.array(_INT64)
+        times = array.array(_INT64)
+        sections = []  # type: List[List[Tuple[int, int, int]]]
+        section_ids = array.array("i")
+        while True:
+            start = self.mm.tell()
+            try:
+                _, pkt_info = reader._read_packet()
+            except EOFError:
+                break
+            if self.is_pcapng:
+                # Skipped blocks (e.g. IDB) may precede the packet block,
+                # that is found from its trailing length
+                end = self.mm.tell()
+                start = end - struct.unpack(reader.endian + "I",
+                                            self.mm[end - 4:end])[0]
+                if pkt_info.tshigh is None:
+                    pkt_time = 0
+                else:
+                    pkt_time = ((pkt_info.tshigh << 32) + pkt_info.tslow) * \
+                        1000000000 // pkt_info.tsresol
+                # A Section Header Block resets the interfaces list
+                if not sections or reader.interfaces is not sections[-1]:
+                    sections.append(reader.interfaces)
+                section_ids.append(len(sections) - 1)
+            else:
+                pkt_time = pkt_info.sec * 1000000000 + \
+                    pkt_info.usec * (1 if reader.nano else 1000)
+            offsets.append(start)
+            times.append(pkt_time)
+        self.offsets = offsets
+        self.times = times
+        self.sections = sections
+        self.section_ids = section_ids
+
+    def load_index(self, index_file):
+        # type: (str) -> bool
+        """Loads the index from index_file. Returns False if it does not
+        exist or does not match the capture."""
+        hdr_fmt = "8sqqqi"
+        try:
+            with open(index_file, "rb") as fdesc:
+                hdr = fdesc.read(struct.calcsize(hdr_fmt))
+                magic, size, mtime, count, nb_sections = struct.unpack(
+                    hdr_fmt, hdr
+                )
+                if magic != self.INDEX_MAGIC or \
+                        (size, mtime) != self._stamp():
+                    return False
+                sections = []
+                for _ in range(nb_sections):
+                    nb_ifaces = struct.unpack("i", fdesc.read(4))[0]
+                    sections.append([
+                        struct.unpack("qqq", fdesc.read(24))
+                        for _ in range(nb_ifaces)
+                    ])
+                offsets = array.array(_INT64)
+                times = array.array(_INT64)
+                section_ids = array.array("i")
+                offsets.fromfile(fdesc, count)
+                times.fromfile(fdesc, count)
+                if self.is_pcapng:
+                    section_ids.fromfile(fdesc, count)
+        except (IOError, OSError, EOFError, struct.error):
+            return False
+        self.offsets = offsets
+        self.times = times
+        self.sections = sections
+        self.section_ids = section_ids
+        return True
+
+    def save_index(self, index_file):
+        # type: (str) -> None
+        """Saves the index to index_file"""
+        with open(index_file, "wb") as fdesc:
+            fdesc.write(struct.pack("8sqqqi", self.INDEX_MAGIC,
+                                    *(self._stamp() + (len(self),
+                                                       len(self.sections)))))
+            for interfaces in self.sections:
+                fdesc.write(struct.pack("i", len(interfaces)))
+                for iface in interfaces:
+                    fdesc.write(struct.pack("qqq", *iface))
+            self.offsets.tofile(fdesc)
+            self.times.tofile(fdesc)
+            if self.is_pcapng:
+                self.section_ids.tofile(fdesc)
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.offsets)
+
+    def _index(self, i):
+        # type: (int) -> int
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("IndexedPcapReader index out of range")
+        return i
+
+    def _seek(self, i):
+        # type: (int) -> None
+        """Moves the reader to the i-th packet, with the interfaces of its
+        section"""
+        i = self._index(i)
+        if self.is_pcapng:
+            self.reader.interfaces = self.sections[self.section_ids[i]]
+        self.mm.seek(self.offsets[i])
+
+    def read_raw_packet(self, i):
+        # type: (int) -> Tuple[bytes, Any]
+        """Returns the i-th packet as a (pkt_data, pkt_metadata) tuple, see
+        RawPcapReader._read_packet()"""
+        with self.lock:
+            self._seek(i)
+            return self.reader._read_packet()  # type: ignore
+
+    def read_packet(self, i):
+        # type: (int) -> Packet
+        """Returns the i-th packet, dissected"""
+        with self.lock:
+            self._seek(i)
+            return self.reader.read_packet()  # type: ignore
+
+    def __getitem__(self, item):
+        # type: (Union[int, slice]) -> Any
+        if isinstance(item, slice):
+            from scapy import plist
+            return plist.PacketList(
+                [self.read_packet(i) for i in range(len(self))[item]],
+                name=os.path.basename(self.filename)
+            )
+        return self.read_packet(item)
+
+    def __iter__(self):
+        # type: () -> Iterator[Packet]
+        for i in range(len(self)):
+            yield self.read_packet(i)
+
+    def time_index(self, timestamp):
+        # type: (Union[float, Decimal]) -> int
+        """Returns the index of the first packet captured at timestamp or
+        later. Packets are expected to be sorted by time, as captured."""
+        ns = int(Decimal(timestamp).scaleb(9).to_integral_value())
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[mid] < ns:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def between(self,
+                start=None,  # type: Optional[Union[float, Decimal]]
+                stop=None,  # type: Optional[Union[float, Decimal]]
+                ):
+        # type: (...) -> Any
+        """Returns the packets captured from start (included) to stop
+        (excluded) as a PacketList"""
+        return self[slice(
+            None if start is None else self.time_index(start),
+            None if stop is None else self.time_index(stop),
+        )]
+
+    def close(self):
+        # type: () -> None
+        self.mm.close()
+        self.fdesc.close()
+
+    def __enter__(self):
+        # type: () -> IndexedPcapReader
+        return self
+
+    def __exit__(self, exc_type, exc_value, tracback):
+        # type: (Optional[Any], Optional[Any], Optional[Any]) -> None
+        self.close()
+
+
+# Function applied by the ParallelPcapReader workers. It is set by the
+# pool initializer, so that it does not have to be pickled with each task.
+_parallel_pcap_func = None  # type: Optional[Callable[[Packet], Any]]
+
+
+def _parallel_pcap_init(func):
+    # type: (Callable[[Packet], Any]) -> None
+    global _parallel_pcap_func
+    _parallel_pcap_func = func
+
+
+def _parallel_pcap_task(records, filter_only):
+    # type: (List[_PcapRecord], bool) -> List[Any]
+    """Dissects a chunk of records in a ParallelPcapReader worker, and
+    returns either the indexes of the packets matching the filter, or the
+    results of the function.
+    """
+    from scapy.packet import _dissect_frames
+    func = _parallel_pcap_func  # type: Any
+    res = []  # type: List[Any]
+    i = 0
+    for cls, group in itertools.groupby(records, key=lambda rec: rec[0]):
+        recs = list(group)
+        pkts = _dissect_frames(cls, [rec[1] for rec in recs])
+        for p, (_, _, pkt_time, wirelen) in zip(pkts, recs):
+            if pkt_time is not None:
+                p.time = pkt_time
+            p.wirelen = wirelen
+            if not filter_only:
+                res.append(func(p))
+            elif func(p):
+                res.append(i)
+            i += 1
+    return res
+
+
+class ParallelPcapReader(object):
+    """Reads a pcap or pcapng file, and processes its packets in a pool of
+    worker processes.
+
+    The file is read in the calling process, and split into chunks of
+    records that are dissected by the workers. Only raw records go to the
+    workers: what comes back is either the result of a function (imap()),
+    or the index of the packets matching a filter (filter()).
+
+    Dissected packets are not sent back: unpickling them would dissect
+    them again. The packets matching a filter are rebuilt from their raw
+    bytes with ``conf.lazy_dissection``, so that only their first layer is
+    dissected in the calling process until they are accessed. filter() is
+    therefore worth it when the filter is selective, and imap() when the
+    work can be done in the workers.
+
+    Results are returned in the order of the file, and at most two chunks
+    per worker are in flight, so that huge files can be streamed.
+
+    The functions are given to the workers when they are started. With the
+    ``fork`` start method (the default on Linux) any function can be used;
+    other start methods require functions that can be pickled.
+
+    ex:
+        >>> r = ParallelPcapReader("big.pcap", workers=32)
+        >>> dns = r.read_all(lfilter=lambda p: DNS in p)
+        >>> sizes = list(r.imap(len))
+    """
+
+    def __init__(self,
+                 filename,  # type: Union[IO[bytes], str]
+                 workers=None,  # type: Optional[int]
+                 chunk_size=1024,  # type: int
+                 ):
+        # type: (...) -> None
+        """
+        :param filename: the pcap or pcapng file to read, or an open file
+        :param workers: the number of worker processes. Defaults to the
+                        number of CPUs
+        :param chunk_size: the number of packets in each chunk
+        """
+        self.filename = filename
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def _chunks(self, count):
+        # type: (int) -> Iterator[List[_PcapRecord]]
+        """Reads the file, and yields lists of at most chunk_size
+        (class, pkt_data, time, wirelen) records
+        """
+        with PcapReader(self.filename) as fdesc:  # type: ignore
+            records = fdesc._read_records(count)
+            while True:
+                chunk = list(itertools.islice(records, self.chunk_size))
+                if not chunk:
+                    break
+                yield chunk
+
+    def _map_chunks(self, func, filter_only, count):
+        # type: (Callable[[Packet], Any], bool, int) -> Iterator[Tuple[List[_PcapRecord], List[Any]]]  # noqa: E501
+        """Yields (chunk, worker result) for each chunk, in order"""
+        import multiprocessing
+        pool = multiprocessing.Pool(self.workers, _parallel_pcap_init,
+                                    (func,))
+        try:
+            window = collections.deque()  # type: Any
+            max_pending = 2 * getattr(pool, "_processes", 1)
+            for chunk in self._chunks(count):
+                window.append((chunk, pool.apply_async(
+                    _parallel_pcap_task, (chunk, filter_only)
+                )))
+                if len(window) >= max_pending:
+                    chunk, result = window.popleft()
+                    yield chunk, result.get()
+            while window:
+                chunk, result = window.popleft()
+                yield chunk, result.get()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def imap(self, func, count=-1):
+        # type: (Callable[[Packet], Any], int) -> Iterator[Any]
+        """Yields func(packet) for each packet of the file, func being
+        called in the workers
+        """
+        for _, results in self._map_chunks(func, False, count):
+            for res in results:
+                yield res
+
+    def filter(self,
+               lfilter,  # type: Callable[[Packet], bool]
+               count=-1,  # type: int
+               ):
+        # type: (...) -> Iterator[Packet]
+        """Yields the packets of the file for which lfilter(packet) is
+        true, lfilter being called in the workers
+        """
+        for chunk, indexes in self._map_chunks(lfilter, True, count):
+            for pkt in self._rebuild([chunk[i] for i in indexes]):
+                yield pkt
+
+    @staticmethod
+    def _rebuild(records):
+        # type: (List[_PcapRecord]) -> List[Packet]
+        """Rebuilds packets from their records, with lazy dissection"""
+        from scapy.packet import _dissect_frames
+        res = []  # type: List[Packet]
+        lazy_dissection = conf.lazy_dissection
+        conf.lazy_dissection = True
+        try:
+            for cls, s, pkt_time, wirelen in records:
+                p = next(_dissect_frames(cls, [s]))
+                if pkt_time is not None:
+                    p.time = pkt_time
+                p.wirelen = wirelen
+                res.append(p)
+        finally:
+            conf.lazy_dissection = lazy_dissection
+        return res
+
+    def read_all(self,
+                 lfilter,  # type: Callable[[Packet], bool]
+                 count=-1,  # type: int
+                 ):
+        # type: (...) -> PacketList
+        """Returns a PacketList of the packets of the file for which
+        lfilter(packet) is true, see filter()
+        """
+        from scapy import plist
+        name = self.filename if isinstance(self.filename, str) else \
+            getattr(self.filename, "name", "No name")
+        return plist.PacketList(list(self.filter(lfilter, count)),
+                                name=os.path.basename(name))
+
+
 class RawPcapWriter:
     """A stream PCAP writer with more control than wrpcap()"""
 
+    #: records written by write() are accumulated up to this size
+    buffer_size = 1024 * 1024
+
     def __init__(self,
                  filename,  # type: Union[IO[bytes], str]
                  linktype=None,  # type: Optional[int]
@@ -1580,6 +2209,8 @@ class RawPcapWriter:
         self.endian = endianness
         self.sync = sync
         self.nano = nano
+        self._buffer = None  # type: Optional[bytearray]
+        self._record_header = struct.Struct(self.endian + "IIII")
         bufsz = 4096
         if sync:
             bufsz = 0
@@ -1654,17 +2285,29 @@ class RawPcapWriter:
                 pkt_iter = _iter()
             else:
                 pkt_iter = pkt.__iter__()
-            for p in pkt_iter:
-                if not self.header_present:
-                    self.write_header(p)
+            if not self.sync:
+                self._buffer = bytearray()
+            try:
+                for p in pkt_iter:
+                    if not self.header_present:
+                        self.write_header(p)
+
+                    if self.linktype != conf.l2types.get(type(p), None):
+                        warning("Inconsistent linktypes detected!"
+                                " The resulting PCAP file might contain"
+                                " invalid packets."
+                                )
 
-                if self.linktype != conf.l2types.get(type(p), None):
-                    warning("Inconsistent linktypes detected!"
-                            " The resulting PCAP file might contain"
-                            " invalid packets."
-                            )
+                    self.write_packet(p)
+            finally:
+                self._flush_buffer()
 
-                self.write_packet(p)
+    def _flush_buffer(self):
+        # type: () -> None
+        """Write the records accumulated by write() to the file"""
+        buf, self._buffer = self._buffer, None
+        if buf:
+            self.f.write(bytes(buf))
 
     def write_packet(self,
                      packet,  # type: Union[bytes, Packet]
@@ -1724,8 +2367,16 @@ class RawPcapWriter:
             elif usec is None:
                 usec = 0
 
-        self.f.write(struct.pack(self.endian + "IIII",
-                                 sec, usec, caplen, wirelen))
+        hdr = self._record_header.pack(sec, usec, caplen, wirelen)
+        buf = self._buffer
+        if buf is not None:
+            buf += hdr
+            buf += packet
+            if len(buf) >= self.buffer_size:
+                self.f.write(bytes(buf))
+                del buf[:]
+            return
+        self.f.write(hdr)
         self.f.write(packet)
         if self.sync:
             self.f.flush()
@@ -0,0 +1,31 @@
+# This file is part of Scapy
+# See http://www.secdev.org/projects/scapy for more information
+# This program is published under a GPLv2 license
+
+from common import *
+import tracemalloc
+
+N = 10000
+raw_packet = raw(Ether() / IP(dst="127.0.0.1", src="127.0.0.1") / UDP() / DNS())
+
+
+def footprint(build):
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    pkts = build()
+    stop = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in stop.compare_to(start, "filename"))
+
+
+size = footprint(lambda: PacketList.from_raw([raw_packet] * N, layer=Ether))
+print("Dissected packets - %d bytes per packet (%d bytes frames)" % (
+    size // N, len(raw_packet)
+))
+
+size = footprint(
+    lambda: ColumnarPacketList.from_raw([raw_packet] * N, layer=Ether)
+)
+print("Columnar packets - %d bytes per packet (%d bytes frames)" % (
+    size // N, len(raw_packet)
+))